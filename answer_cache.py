@@ -0,0 +1,105 @@
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+import config as cfg
+
+class AnswerCache:
+    """
+    Semantic cache of generated answers. An answer is reused when a new query embedding is
+    within max_distance (cosine) of a cached query for the same collection and index
+    version, so rebuilding a collection implicitly invalidates its answers. Entries expire
+    after ttl seconds and the least recently used ones are evicted past max_entries.
+    """
+
+    def __init__(self, path=None, max_distance=None, ttl=None, max_entries=None):
+        self.max_distance = cfg.answer_cache_max_distance if max_distance is None else max_distance
+        self.ttl = ttl or cfg.answer_cache_ttl_seconds
+        self.max_entries = max_entries or cfg.answer_cache_max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path or cfg.answer_cache_path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS answers ("
+            "id INTEGER PRIMARY KEY, collection TEXT NOT NULL, index_version TEXT NOT NULL, query TEXT NOT NULL, "
+            "embedding BLOB NOT NULL, answer TEXT NOT NULL, created REAL NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS answers_collection ON answers (collection, index_version)")
+        self._conn.commit()
+
+    def lookup(self, collection, index_version, query_embedding):
+        """
+        Returns the cached answer of the closest previous query, or None.
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, embedding, answer FROM answers WHERE collection = ? AND index_version = ? AND created > ?",
+                (collection, index_version, time.time() - self.ttl),
+            ).fetchall()
+            # Queries embedded with other settings (config.embedding_dimensions) can't be compared
+            query = np.asarray(query_embedding, dtype=np.float32)
+            rows = [row for row in rows if len(row[1]) == query.nbytes]
+
+            answer = None
+            if rows:
+                matrix = np.vstack([np.frombuffer(row[1], dtype=np.float32) for row in rows])
+                similarities = matrix @ query / (np.linalg.norm(matrix, axis=1) * np.linalg.norm(query) + 1e-12)
+                best = int(np.argmax(similarities))
+                if 1.0 - similarities[best] <= self.max_distance:
+                    answer = rows[best][2]
+                    self._conn.execute("UPDATE answers SET last_used = ? WHERE id = ?", (time.time(), rows[best][0]))
+                    self._conn.commit()
+
+            if answer is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return answer
+
+    def store(self, collection, index_version, query, query_embedding, answer):
+        with self._lock:
+            now = time.time()
+            self._conn.execute(
+                "INSERT INTO answers (collection, index_version, query, embedding, answer, created, last_used) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (collection, index_version, query, np.asarray(query_embedding, dtype=np.float32).tobytes(), answer, now, now),
+            )
+            self._conn.execute("DELETE FROM answers WHERE created <= ?", (now - self.ttl,))
+            overflow = self._conn.execute("SELECT COUNT(*) FROM answers").fetchone()[0] - self.max_entries
+            if overflow > 0:
+                self._conn.execute(
+                    "DELETE FROM answers WHERE id IN (SELECT id FROM answers ORDER BY last_used LIMIT ?)", (overflow,)
+                )
+            self._conn.commit()
+
+    def invalidate(self, collection, keep_version=None):
+        """
+        Drops the cached answers of a collection, except those for keep_version. Answers
+        from several collections (comma-separated, with their versions in the same order)
+        are dropped too when the version of this collection differs.
+        """
+        with self._lock:
+            # LIKE only narrows the rows down; "_" and "%" in names are checked exactly below
+            rows = self._conn.execute(
+                "SELECT id, collection, index_version FROM answers WHERE ',' || collection || ',' LIKE ?",
+                (f"%,{collection},%",),
+            ).fetchall()
+            stale = []
+            for row_id, collections, index_versions in rows:
+                versions = dict(zip(collections.split(","), index_versions.split(",")))
+                if collection in versions and versions[collection] != keep_version:
+                    stale.append((row_id,))
+            self._conn.executemany("DELETE FROM answers WHERE id = ?", stale)
+            self._conn.commit()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
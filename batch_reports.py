@@ -0,0 +1,279 @@
+"""
+Headless batch mode for scheduled competitor briefings. Reads a file of questions,
+embeds all of them in one batched embeddings request, answers them concurrently through
+the async query pipeline under a global rate budget and writes one Markdown (and PDF)
+report per question plus a combined briefing. The "zip" format also writes all PDF
+reports to reports.zip, rendered one at a time.
+
+Finished answers are appended to <output>/progress.jsonl as they complete, so an
+interrupted run picks up where it stopped when started again with the same output folder.
+
+Questions are read from a text file (one per line, for the --collection choice) or a
+JSONL file of {"query": ..., "collection": ..., "id": ...} objects, where collection
+(a competitor label such as "JNJ", a collection name or "All competitors") and id are
+optional:
+    python batch_reports.py questions.txt --output reports/2024-07-01 --concurrency 16
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import re
+import sys
+import time
+from datetime import datetime
+
+import config as cfg
+
+if cfg.deploy:
+    __import__('pysqlite3')
+    sys.modules['sqlite3'] = sys.modules.pop('pysqlite3')
+from dotenv import load_dotenv
+load_dotenv('.env')
+
+from pdf_export import create_pdf, write_pdf_zip
+from query_pipeline import answer_query, run_sync
+from resources import get_embeddings, get_collection_names, get_collection_options
+from retrieval import plan_search
+from tracing import Trace
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+class RateBudget:
+    """
+    Global request and token budget of a batch, refilled continuously. Token use is only
+    known once an answer is done, so it is charged afterwards and later requests wait
+    until the balance is positive again.
+    """
+
+    def __init__(self, requests_per_minute, tokens_per_minute):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self._requests = float(requests_per_minute)
+        self._tokens = float(tokens_per_minute)
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self._updated
+        self._updated = now
+        self._requests = min(self.requests_per_minute, self._requests + elapsed * self.requests_per_minute / 60)
+        self._tokens = min(self.tokens_per_minute, self._tokens + elapsed * self.tokens_per_minute / 60)
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                self._refill()
+                if self._requests >= 1 and self._tokens > 0:
+                    self._requests -= 1
+                    return
+                await asyncio.sleep(max(
+                    (1 - self._requests) * 60 / self.requests_per_minute,
+                    -self._tokens * 60 / self.tokens_per_minute,
+                    0.01,
+                ))
+
+    def spend(self, tokens):
+        self._refill()
+        self._tokens -= tokens
+
+def read_queries(path, default_collection):
+    """
+    Returns the questions of a text or JSONL file as dicts with id, query and collection.
+    Questions without an id get one derived from the collection and question, so it stays
+    the same when the file is run again; repeated questions are only answered once.
+    """
+    items = {}
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            item = json.loads(line) if path.endswith(".jsonl") else {"query": line}
+            item.setdefault("collection", default_collection)
+            item.setdefault("id", hashlib.sha1(f"{item['collection']}\0{item['query']}".encode('utf-8')).hexdigest()[:12])
+            items.setdefault(item["id"], item)
+    return list(items.values())
+
+def resolve_collections(collection):
+    """
+    Returns the collection names of a competitor label, collection name or the
+    all-competitors choice.
+    """
+    # The page only offers the all-competitors choice with several collections; batches default to it
+    if collection == cfg.all_competitors_label:
+        return get_collection_names()
+    options = get_collection_options()
+    if collection in options:
+        return options[collection]
+    if collection in get_collection_names():
+        return [collection]
+    raise ValueError(f"Unknown collection '{collection}', expected one of {sorted(options) + [cfg.all_competitors_label]}")
+
+def load_progress(path):
+    """
+    Returns the finished reports of an earlier run by id. A line cut off by an interrupted
+    write is ignored, so its question is answered again, and terminated so the next
+    record starts on a line of its own.
+    """
+    done = {}
+    if os.path.exists(path):
+        with open(path, "rb+") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                done[record["id"]] = record
+            if f.tell() and not line.endswith(b"\n"):
+                f.write(b"\n")
+    return done
+
+def report_file_name(item):
+    slug = re.sub(r'[^a-z0-9]+', '-', item["query"].lower()).strip('-')[:60]
+    return f"{slug}-{item['id']}"
+
+def report_markdown(record, heading="#"):
+    return (f"{heading} {record['query']}\n\n"
+            f"*{record['collection']} · generated {record['generated_at']}*\n\n"
+            f"{record['answer'].strip()}\n")
+
+def embed_queries(items):
+    """
+    Embeds the questions that need a vector search in one batched embeddings request
+    (cached questions are not sent) and returns their vectors by id.
+    """
+    pending = [item for item in items if plan_search(item["query"], item["collection_names"])[0] != "lexical"]
+    if not pending:
+        return {}
+    start = time.perf_counter()
+    vectors = get_embeddings().embed_documents([item["query"] for item in pending])
+    logging.info(f"Embedded {len(pending)} questions in {time.perf_counter() - start:.2f}s")
+    return {item["id"]: vector for item, vector in zip(pending, vectors)}
+
+async def answer_all(items, query_embeddings, api_key, output, concurrency, budget, formats):
+    """
+    Answers the questions concurrently and writes each report as soon as it is done.
+    Returns the number of questions that failed.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    progress_path = os.path.join(output, "progress.jsonl")
+    failed = 0
+    done = 0
+
+    async def answer_one(item):
+        nonlocal failed, done
+        async with semaphore:
+            await budget.acquire()
+            trace = Trace("batch_report", collection=item["collection"], report_id=item["id"])
+            start = time.perf_counter()
+            try:
+                answer = await answer_query(item["query"], item["collection_names"], api_key, trace=trace,
+                                            query_embedding=query_embeddings.get(item["id"]))
+            except Exception as e:
+                failed += 1
+                trace.set(error=type(e).__name__)
+                trace.finish()
+                logging.error(f"Failed to answer '{item['query']}': {e}")
+                return
+            budget.spend(sum(trace.attributes.get(key, 0) for key in ("query_tokens", "context_tokens", "answer_tokens")))
+
+        record = {
+            "id": item["id"],
+            "query": item["query"],
+            "collection": item["collection"],
+            "answer": answer,
+            "generated_at": datetime.now().isoformat(timespec="seconds"),
+            "seconds": round(time.perf_counter() - start, 2),
+        }
+        try:
+            await asyncio.to_thread(write_report, record, item, output, formats)
+        except Exception as e:
+            failed += 1
+            logging.error(f"Failed to write the report of '{item['query']}': {e}")
+            return
+        # The checkpoint is written last, so a recorded question always has its report
+        with open(progress_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record) + "\n")
+        done += 1
+        logging.info(f"Answered {done} of {len(items)} questions ({record['seconds']:.1f}s): {item['query']}")
+
+    await asyncio.gather(*(answer_one(item) for item in items))
+    return failed
+
+def write_report(record, item, output, formats):
+    name = os.path.join(output, "reports", report_file_name(item))
+    markdown = report_markdown(record)
+    if "md" in formats:
+        with open(f"{name}.md", "w", encoding="utf-8") as f:
+            f.write(markdown)
+    if "pdf" in formats:
+        create_pdf(markdown).output(f"{name}.pdf")
+
+def write_briefing(items, done, output, formats):
+    """
+    Writes all finished reports, in the order of the questions file, to one briefing.
+    """
+    records = [done[item["id"]] for item in items if item["id"] in done]
+    title = f"# Competitor briefing {datetime.now():%Y-%m-%d}\n\n"
+    markdown = title + "\n".join(report_markdown(record, heading="##") for record in records)
+    if "md" in formats:
+        with open(os.path.join(output, "briefing.md"), "w", encoding="utf-8") as f:
+            f.write(markdown)
+    if "pdf" in formats:
+        create_pdf(markdown).output(os.path.join(output, "briefing.pdf"))
+    if "zip" in formats:
+        reports = ((f"{report_file_name(item)}.pdf", report_markdown(done[item["id"]]))
+                   for item in items if item["id"] in done)
+        write_pdf_zip(reports, os.path.join(output, "reports.zip"), use_cache=False)
+    logging.info(f"Wrote the briefing of {len(records)} of {len(items)} questions to {output}")
+
+def run_batch(queries_path, output, collection=None, concurrency=None, requests_per_minute=None,
+              tokens_per_minute=None, formats=("md", "pdf"), api_key=None):
+    """
+    Answers every question of queries_path that has no report in output yet and writes the
+    briefing. Returns the number of questions that failed; running again retries them.
+    """
+    api_key = api_key or os.getenv('OPENAI_API_KEY')
+    items = read_queries(queries_path, collection or cfg.all_competitors_label)
+    for item in items:
+        item["collection_names"] = resolve_collections(item["collection"])
+
+    os.makedirs(os.path.join(output, "reports"), exist_ok=True)
+    done = load_progress(os.path.join(output, "progress.jsonl"))
+    pending = [item for item in items if item["id"] not in done]
+    logging.info(f"{len(items) - len(pending)} of {len(items)} questions already answered")
+
+    start = time.perf_counter()
+    failed = 0
+    if pending:
+        query_embeddings = embed_queries(pending)
+        budget = RateBudget(requests_per_minute or cfg.batch_requests_per_minute,
+                            tokens_per_minute or cfg.batch_tokens_per_minute)
+        failed = run_sync(answer_all(pending, query_embeddings, api_key, output,
+                                     concurrency or cfg.batch_concurrency, budget, formats))
+        logging.info(f"Answered {len(pending) - failed} questions in {time.perf_counter() - start:.1f}s, {failed} failed")
+
+    write_briefing(items, load_progress(os.path.join(output, "progress.jsonl")), output, formats)
+    return failed
+
+def main():
+    parser = argparse.ArgumentParser(description="Answer a file of questions into Markdown/PDF competitor reports")
+    parser.add_argument('queries', help="Text file with one question per line, or a JSONL file")
+    parser.add_argument('--output', default=f"reports/{datetime.now():%Y-%m-%d}", help="Folder of the reports and the progress file")
+    parser.add_argument('--collection', default=None, help="Competitor of questions without one (defaults to all competitors)")
+    parser.add_argument('--concurrency', type=int, default=None, help="Questions answered at once")
+    parser.add_argument('--requests-per-minute', type=float, default=None)
+    parser.add_argument('--tokens-per-minute', type=float, default=None)
+    parser.add_argument('--formats', default="md,pdf", help="Comma-separated output formats (md, pdf, zip)")
+    args = parser.parse_args()
+
+    failed = run_batch(args.queries, args.output, args.collection, args.concurrency, args.requests_per_minute,
+                       args.tokens_per_minute, args.formats.split(","))
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""
+Micro-benchmark of the scraper's boilerplate removal: the compiled single-pass cleaner in
+scraper.remove_unwanted_content against the previous implementation, which called
+str.replace once per phrase and re.match once per line. Inputs are data/jnj.txt repeated
+to several sizes. The outputs differ where phrases overlap: the compiled cleaner removes
+the longest phrase at each position of the original text, whatever the order of the
+phrases (PINNED_PHRASE_REMOVALS); the benchmark checks that behaviour before timing.
+
+Run it with:
+    python benchmarks/bench_cleaning.py --sizes 1 10 100
+    python benchmarks/bench_cleaning.py --check
+"""
+import argparse
+import glob
+import json
+import os
+import re
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(ROOT, "scraper"))
+
+import scraper
+
+# Phrase removal of the jnj patterns: input -> output of the compiled cleaner's phrase pass
+PINNED_PHRASE_REMOVALS = {
+    # Overlapping phrases: "Innovation at J&J" and "MedTech", where the replaces removed
+    # "J&J MedTech" and "Innovation" and left " at "
+    "Innovation at J&J MedTech": " ",
+    "x Innovation at J&J MedTech y": "x   y",
+    # A phrase that only appears once another is removed stays
+    "InnoMedTechvation": "Innovation",
+    "MedTech MedTech": " ",
+}
+
+def check_phrase_removal(site="jnj"):
+    """
+    Returns the pinned inputs whose phrase removal changed, with what they became.
+    """
+    phrases, _ = scraper.get_boilerplate_cleaner(site)
+    return {text: phrases.sub("", text) for text, expected in PINNED_PHRASE_REMOVALS.items()
+            if phrases.sub("", text) != expected}
+
+def legacy_remove_unwanted_content(content, phrases):
+    for pattern in phrases:
+        content = content.replace(pattern, "")
+
+    content = "\n".join(
+        line for line in content.splitlines() if not re.match(r'^\d+(,\d+)*$', line) and line.strip()
+    )
+    return content
+
+def load_sample():
+    paths = sorted(glob.glob(os.path.join(ROOT, "data", "*.txt")) + glob.glob(os.path.join(ROOT, "data", "*", "*.txt")))
+    if not paths:
+        sys.exit("No scraped TXT files found in data/")
+    return "\n".join(open(path, encoding="utf-8").read() for path in paths)
+
+def throughput(func, text, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(text)
+        best = min(best, time.perf_counter() - start)
+    return len(text.encode("utf-8")) / 1e6 / best, result
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark boilerplate removal")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1, 10, 100], help="Copies of the sample per input")
+    parser.add_argument('--repeat', type=int, default=5, help="Runs per input; the fastest is reported")
+    parser.add_argument('--site', default="jnj")
+    parser.add_argument('--check', action='store_true', help="Only check the pinned phrase removals")
+    args = parser.parse_args()
+
+    changed = check_phrase_removal()
+    for text, result in changed.items():
+        print(f"Phrase removal changed: {text!r} -> {result!r}, expected {PINNED_PHRASE_REMOVALS[text]!r}")
+    if changed:
+        sys.exit(1)
+    if args.check:
+        print(f"{len(PINNED_PHRASE_REMOVALS)} pinned phrase removals unchanged")
+        return
+
+    with open(scraper.BOILERPLATE_PATTERNS_PATH, encoding="utf-8") as f:
+        phrases = json.load(f)[args.site]["phrases"]
+    scraper.get_boilerplate_cleaner(args.site)  # Compile outside the timings
+
+    sample = load_sample()
+    print(f"{'input':>10} {'legacy MB/s':>12} {'compiled MB/s':>14} {'speedup':>8}  same output")
+    for size in args.sizes:
+        text = sample * size
+        legacy, legacy_result = throughput(lambda t: legacy_remove_unwanted_content(t, phrases), text, args.repeat)
+        compiled, compiled_result = throughput(lambda t: scraper.remove_unwanted_content(t, args.site), text, args.repeat)
+        print(f"{len(text.encode('utf-8')) / 1e6:>8.2f}MB {legacy:>12.1f} {compiled:>14.1f} {compiled / legacy:>7.2f}x  "
+              f"{legacy_result == compiled_result}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+Throughput benchmark of the embedding backends (config.embedding_backend). For each
+backend, embeds synthetic release passages the way populate_vectordb does (batches of
+config.embed_batch_size on config.embed_max_workers threads) and single queries the way
+the chatbot does, without the embedding cache, and reports passages per second and
+query latency percentiles.
+
+The remote backend calls the OpenAI API when OPENAI_API_KEY is set and --stub-latency
+is not given; otherwise the local OpenAI stand-in (stub_openai_server.py) answers with
+the given latency. The local backend needs sentence-transformers and is skipped without it:
+
+    python benchmarks/bench_embeddings.py --passages 2000 --stub-latency 0.3
+    python benchmarks/bench_embeddings.py --backends local --local-processes 4
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARKS_DIR))
+sys.path.insert(0, BENCHMARKS_DIR)
+
+import config as cfg
+from corpus import SITES, generate_queries, release_text
+from embedding_backends import create_embedding_function
+
+def generate_passages(count, seed=0):
+    rng = random.Random(seed)
+    passages = []
+    while len(passages) < count:
+        _, body = release_text(rng, rng.choice(SITES), paragraphs=8)
+        passages.extend(body.split("\n\n"))
+    return passages[:count]
+
+def bench_backend(backend, passages, queries):
+    embeddings = create_embedding_function(backend)
+    embeddings.embed_query("warm up")  # Loads a local model before timing
+
+    batches = [passages[i:i + cfg.embed_batch_size] for i in range(0, len(passages), cfg.embed_batch_size)]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=cfg.embed_max_workers) as executor:
+        vectors = [vector for batch in executor.map(embeddings.embed_documents, batches) for vector in batch]
+    ingest_seconds = time.perf_counter() - start
+
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        embeddings.embed_query(query)
+        latencies.append(time.perf_counter() - start)
+    p50, p95 = np.percentile(np.array(latencies) * 1000, [50, 95])
+    return {
+        "dimension": len(vectors[0]),
+        "passages_per_second": round(len(passages) / ingest_seconds, 1),
+        "query_p50_ms": round(p50, 2),
+        "query_p95_ms": round(p95, 2),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Throughput of the remote and local embedding backends")
+    parser.add_argument('--backends', default="openai,local")
+    parser.add_argument('--passages', type=int, default=2000, help="Passages embedded like an ingestion run")
+    parser.add_argument('--queries', type=int, default=50, help="Single queries embedded like chatbot requests")
+    parser.add_argument('--stub-latency', type=float, default=None, help="Use the local OpenAI stand-in with this latency")
+    parser.add_argument('--local-processes', type=int, default=None, help="Overrides config.local_embedding_processes")
+    args = parser.parse_args()
+
+    if args.stub_latency is not None or not os.getenv("OPENAI_API_KEY"):
+        from stub_openai_server import start_server
+        _, base_url = start_server(latency=args.stub_latency or 0.0)
+        os.environ["OPENAI_BASE_URL"] = base_url
+        os.environ["OPENAI_API_KEY"] = "stub"
+    if args.local_processes is not None:
+        cfg.local_embedding_processes = args.local_processes
+
+    passages = generate_passages(args.passages)
+    queries = generate_queries(args.queries)
+    print(f"{'backend':<8} {'model':<26} {'dims':>5} {'passages/s':>11} {'query p50 ms':>13} {'query p95 ms':>13}")
+    for backend in args.backends.split(","):
+        model = cfg.local_embedding_model if backend == "local" else cfg.embedding_model
+        try:
+            result = bench_backend(backend, passages, queries)
+        except ImportError as e:
+            print(f"{backend:<8} {model:<26} skipped: {e}")
+            continue
+        print(f"{backend:<8} {model:<26} {result['dimension']:>5} {result['passages_per_second']:>11} "
+              f"{result['query_p50_ms']:>13} {result['query_p95_ms']:>13}")
+
+if __name__ == "__main__":
+    main()
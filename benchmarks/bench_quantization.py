@@ -0,0 +1,110 @@
+"""
+Recall-vs-memory benchmark of the vector storage settings. Reads the full-precision
+embeddings of a Chroma database built by populate_vectordb, uses a sample of them as
+queries and compares shortened embeddings (config.embedding_dimensions) with float32,
+int8 and binary storage (config.vector_quantization), with and without the float re-rank
+(config.quantized_rerank_candidates):
+
+- recall@k against the exact top k of the full-precision vectors
+- bytes per vector held in memory, and MB for all collections
+- search latency per query
+
+Each query is left out of its own results. Shortening text-embedding-3 vectors and
+normalizing them again gives the vectors the API returns for fewer dimensions, so a
+database of full-size embeddings covers every dimension setting. Run it on a database
+built with the real model: the embeddings of the benchmark stub are not ordered by
+importance, so its recall for shortened embeddings means nothing.
+
+    python benchmarks/bench_quantization.py --db-path chroma_db --k 15
+"""
+import argparse
+import os
+import sys
+import time
+
+import chromadb
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from quantized_index import QuantizedIndex, normalize, quantize
+
+def load_embeddings(db_path, page_size=5000):
+    client = chromadb.PersistentClient(path=db_path)
+    vectors = []
+    for collection in client.list_collections():
+        collection = client.get_collection(getattr(collection, "name", collection))
+        for offset in range(0, collection.count(), page_size):
+            vectors.append(np.asarray(collection.get(include=["embeddings"], limit=page_size, offset=offset)["embeddings"]))
+    if not vectors:
+        sys.exit(f"No embeddings in {db_path}, run populate_vectordb.py first")
+    return normalize(np.concatenate(vectors))
+
+def chroma_files_mb(db_path):
+    """
+    Size of Chroma's files on disk: its SQLite database and HNSW segment folders.
+    """
+    size = os.path.getsize(os.path.join(db_path, "chroma.sqlite3"))
+    for entry in os.scandir(db_path):
+        if entry.is_dir() and len(entry.name) == 36:
+            size += sum(os.path.getsize(os.path.join(entry.path, name)) for name in os.listdir(entry.path))
+    return size / 1e6
+
+def exact_neighbours(vectors, queries, k):
+    similarities = vectors[queries] @ vectors.T
+    similarities[np.arange(len(queries)), queries] = -np.inf
+    return [set(np.argsort(-row)[:k]) for row in similarities]
+
+def evaluate(search, queries, truth, k):
+    """
+    Returns the recall@k and the p50 latency in ms of a search(position) -> positions function.
+    """
+    recalls, latencies = [], []
+    for query, expected in zip(queries, truth):
+        start = time.perf_counter()
+        found = [position for position in search(query) if position != query][:k]
+        latencies.append(time.perf_counter() - start)
+        recalls.append(len(expected.intersection(found)) / k)
+    return float(np.mean(recalls)), float(np.percentile(latencies, 50) * 1000)
+
+def main():
+    parser = argparse.ArgumentParser(description="Recall and memory of shortened and quantized embeddings")
+    parser.add_argument('--db-path', default="chroma_db")
+    parser.add_argument('--queries', type=int, default=200, help="Stored vectors used as queries")
+    parser.add_argument('--k', type=int, default=15, help="Results per search (config.retrieval_collection_quota)")
+    parser.add_argument('--dimensions', default="3072,1536,1024,512,256")
+    parser.add_argument('--rerank', default="0,2,4,10", help="Values of quantized_rerank_candidates to try")
+    args = parser.parse_args()
+
+    vectors = load_embeddings(args.db_path)
+    queries = np.random.RandomState(0).choice(len(vectors), min(args.queries, len(vectors)), replace=False)
+    truth = exact_neighbours(vectors, queries, args.k)
+    print(f"{len(vectors)} vectors of {vectors.shape[1]} dimensions, {len(queries)} queries, "
+          f"Chroma files {chroma_files_mb(args.db_path):.1f} MB")
+    print(f"{'dims':>6} {'storage':>8} {'rerank':>7} {'recall@k':>9} {'B/vector':>9} {'memory MB':>10} {'p50 ms':>8}")
+
+    ids = np.arange(len(vectors))
+    for dimensions in [int(value) for value in args.dimensions.split(",") if int(value) <= vectors.shape[1]]:
+        shortened = normalize(vectors[:, :dimensions])
+
+        def float_search(query):
+            return np.argsort(-(shortened @ shortened[query]))[:args.k + 1]
+
+        recall, latency = evaluate(float_search, queries, truth, args.k)
+        print(f"{dimensions:>6} {'float32':>8} {'-':>7} {recall:>9.3f} {dimensions * 4:>9} "
+              f"{shortened.nbytes / 1e6:>10.1f} {latency:>8.2f}")
+
+        for mode in ("int8", "binary"):
+            codes, scales = quantize(shortened, mode)
+            index = QuantizedIndex(ids, mode, codes, scales, shortened)
+            bytes_per_vector = (codes.nbytes + (scales.nbytes if scales is not None else 0)) / len(vectors)
+            for rerank_candidates in [int(value) for value in args.rerank.split(",")]:
+                def quantized_search(query):
+                    return [int(position) for position, _ in index.search(shortened[query], args.k + 1, rerank_candidates)]
+
+                recall, latency = evaluate(quantized_search, queries, truth, args.k)
+                print(f"{dimensions:>6} {mode:>8} {rerank_candidates:>7} {recall:>9.3f} {bytes_per_vector:>9.0f} "
+                      f"{bytes_per_vector * len(vectors) / 1e6:>10.1f} {latency:>8.2f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""
+Benchmarks the scraper against a local fixture server that serves a press-release
+listing, release pages and a stand-in for the SCRAPER_API_URL proxy, with configurable
+latency and a share of transient 503 errors to exercise the retries. The scrape runs
+twice with a fetch state, to show that the second run only makes a conditional request.
+
+Run it with:
+    python benchmarks/bench_scraper.py --releases 40 --latency 0.2 --error-rate 0.1
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "scraper"))
+
+RELEASE_BODY = (
+    "<html><body><script>var tracking = 1;</script><h1>Press release {number}</h1>"
+    "<p>New intraocular lens data presented at the annual meeting, release {number}.</p>"
+    "<p>Patients reported improved vision at every distance and in any lighting.</p>"
+    "</body></html>"
+)
+
+class FixtureHandler(BaseHTTPRequestHandler):
+    releases = 10
+    latency = 0.0
+    error_rate = 0.0
+
+    def do_GET(self):
+        time.sleep(self.latency)
+        url = urlsplit(self.path)
+        if random.random() < self.error_rate:
+            self.respond(503, "Service temporarily unavailable")
+        elif url.path == "/press-releases":
+            etag = f'"listing-{self.releases}"'
+            if self.headers.get("If-None-Match") == etag:
+                self.respond(304, "")
+                return
+            items = "".join(
+                f'<h3 class="PagePromo-title"><a href="/press-releases/{n}">Release {n}</a></h3>'
+                for n in range(self.releases)
+            )
+            self.respond(200, f"<html><body>{items}</body></html>", {"ETag": etag})
+        elif url.path == "/proxy":
+            # Stand-in for the scraping proxy: renders the page named by the url parameter
+            target = parse_qs(url.query).get("url", [""])[0]
+            self.respond(200, RELEASE_BODY.format(number=target.rsplit("/", 1)[-1]))
+        else:
+            self.respond(404, "Not found")
+
+    def respond(self, status, body, headers=None):
+        data = body.encode('utf-8')
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the scraper against a local fixture server")
+    parser.add_argument('--releases', type=int, default=40)
+    parser.add_argument('--latency', type=float, default=0.2, help="Seconds the fixture waits before each response")
+    parser.add_argument('--error-rate', type=float, default=0.1, help="Share of requests answered with a 503")
+    args = parser.parse_args()
+
+    FixtureHandler.releases = args.releases
+    FixtureHandler.latency = args.latency
+    FixtureHandler.error_rate = args.error_rate
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FixtureHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+
+    # The scraper reads the proxy URL when it is imported
+    os.environ['SCRAPER_API_URL'] = f"{base_url}/proxy"
+    os.environ.setdefault('API_KEY', "fixture")
+    import jnj_scraper
+    import scraper
+    from fetch_state import FetchState
+    from fetcher import Fetcher
+
+    # Use a fetcher without the politeness delay and with short backoffs, so the run
+    # measures concurrency and retries rather than sleeps
+    scraper.fetcher = Fetcher(per_host_rate=None, backoff_factor=0.05)
+
+    with tempfile.TemporaryDirectory() as state_dir:
+        state = FetchState(os.path.join(state_dir, "fetch_state.json"))
+        for run in ("First", "Second"):
+            scraper.fetcher.reset_stats()
+            releases = jnj_scraper.scrape_jnj_articles(
+                num_articles=args.releases, url=f"{base_url}/press-releases", state=state
+            )
+            stats = scraper.fetcher.report()
+            print(f"{run} run: scraped {len(releases or [])}/{args.releases} releases with {stats['pages']} requests, "
+                  f"{stats['pages_per_second']:.2f} pages/sec, {stats['failures']} failures after retries")
+    server.shutdown()
+
+if __name__ == "__main__":
+    main()
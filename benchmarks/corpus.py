@@ -0,0 +1,104 @@
+"""
+Deterministic synthetic corpus for the benchmarks: press releases in the format written
+by the scrapers (data/<site>/<release>.txt starting with a "## title" header), questions
+about them, and boilerplate-laden HTML pages for the cleaning functions.
+"""
+import json
+import os
+import random
+
+SITES = ["jnj", "rxsight", "zeiss"]
+PRODUCTS = {
+    "jnj": ["TECNIS Odyssey", "TECNIS PureSee", "Eyhance", "Symfony", "Synergy"],
+    "rxsight": ["Light Adjustable Lens", "Light Delivery Device", "ActivShield", "RxLAL"],
+    "zeiss": ["AT LISA tri", "CT LUCIA", "AT ELANA", "QUATERA 700", "IOLMaster 700"],
+}
+TOPICS = [
+    "presbyopia", "cataract surgery", "depth of focus", "contrast sensitivity", "glare and halos",
+    "spectacle independence", "refractive outcomes", "astigmatism", "night vision", "patient satisfaction",
+    "surgeon adoption", "reimbursement", "clinical trial", "FDA approval", "CE mark", "market share",
+    "quarterly revenue", "manufacturing capacity", "distribution in Asia", "surgical workflow",
+]
+TEMPLATES = [
+    "{company} announced that {product} showed improved {topic} in a study of {number} patients.",
+    "According to {company}, {product} addresses {topic} better than previous generation lenses.",
+    "The {topic} results for {product} were presented at the annual meeting in {city}.",
+    "{product} received {topic} clearance, expanding availability to {number} additional clinics.",
+    "Surgeons reported that {product} simplified {topic} during routine procedures in {city}.",
+    "{company} expects {product} to contribute to {topic} growth over the next {number} quarters.",
+]
+CITIES = ["Chicago", "San Diego", "Vienna", "Barcelona", "Tokyo", "Boston", "Munich"]
+COMPANIES = {"jnj": "Johnson & Johnson", "rxsight": "RxSight", "zeiss": "ZEISS"}
+
+def sentence(rng, site):
+    return rng.choice(TEMPLATES).format(
+        company=COMPANIES[site],
+        product=rng.choice(PRODUCTS[site]),
+        topic=rng.choice(TOPICS),
+        number=rng.randint(2, 900),
+        city=rng.choice(CITIES),
+    )
+
+def release_text(rng, site, paragraphs):
+    title = f"{COMPANIES[site]} {rng.choice(['launches', 'reports', 'presents', 'expands'])} {rng.choice(PRODUCTS[site])} {rng.choice(TOPICS)} update"
+    body = "\n\n".join(" ".join(sentence(rng, site) for _ in range(rng.randint(3, 7))) for _ in range(paragraphs))
+    return title, body
+
+def generate_corpus(folder, releases_per_site=50, paragraphs=8, seed=0):
+    """
+    Writes releases_per_site releases per site to folder/<site>/ and returns the number of
+    characters written.
+    """
+    rng = random.Random(seed)
+    written = 0
+    for site in SITES:
+        os.makedirs(os.path.join(folder, site), exist_ok=True)
+        for i in range(releases_per_site):
+            title, body = release_text(rng, site, paragraphs)
+            text = f"## {title}\n\n{body}\n"
+            with open(os.path.join(folder, site, f"release-{i:04d}.txt"), "w", encoding="utf-8") as f:
+                f.write(text)
+            written += len(text)
+    return written
+
+def generate_queries(count, seed=1):
+    rng = random.Random(seed)
+    queries = []
+    for _ in range(count):
+        site = rng.choice(SITES)
+        queries.append(rng.choice([
+            f"What did {COMPANIES[site]} report about {rng.choice(TOPICS)}?",
+            f"How does {rng.choice(PRODUCTS[site])} perform for {rng.choice(TOPICS)}?",
+            f"Summarize recent news on {rng.choice(PRODUCTS[site])}",
+            f"Which competitors launched products for {rng.choice(TOPICS)}?",
+        ]))
+    return queries
+
+# Rephrasings of the previous question in a conversation, which may reuse its search results
+FOLLOW_UPS = ["{question} In detail.", "Briefly: {question}", "{question} Any update?"]
+
+def generate_conversation(count, seed=1):
+    """
+    Returns the questions of a chat session: new questions, each followed by a rephrasing
+    of it.
+    """
+    rng = random.Random(seed)
+    turns = []
+    for question in generate_queries((count + 1) // 2, seed):
+        turns.extend([question, rng.choice(FOLLOW_UPS).format(question=question)])
+    return turns[:count]
+
+def generate_html(paragraphs, boilerplate_path, site="jnj", seed=2):
+    """
+    Returns an HTML page with navigation and footer boilerplate of the site around
+    paragraphs of release text, as fetched by the scraper.
+    """
+    rng = random.Random(seed)
+    with open(boilerplate_path, encoding="utf-8") as f:
+        phrases = json.load(f)[site]["phrases"]
+    nav = "".join(f"<li><a href='#'>{phrase}</a></li>" for phrase in phrases[:60])
+    footer = "".join(f"<p>{phrase}</p>" for phrase in phrases[60:])
+    body = "".join(f"<p>{sentence(rng, 'jnj')} {sentence(rng, 'jnj')}</p>\n<p>{rng.randint(1, 99)},{rng.randint(100, 999)}</p>\n"
+                   for _ in range(paragraphs))
+    return (f"<html><head><style>p {{ margin: 0 }}</style><script>var tracking = 1;</script></head>"
+            f"<body><nav><ul>{nav}</ul></nav><main>\n{body}</main><footer>{footer}</footer></body></html>")
@@ -0,0 +1,345 @@
+"""
+Offline benchmark suite. Starts the local OpenAI stand-in, generates a synthetic corpus
+in a scratch directory and measures:
+
+- populate: a full build of the vector database with populate_vectordb.main, then an
+  incremental run with nothing to do
+- retrieval: find_relevant_entries_from_chroma_db over all collections
+- query: query_interface end to end, with the answer cache off
+- load: concurrent sessions calling query_interface
+- conversation: one long chat session with conversation memory, questions alternating
+  with rephrased follow-ups, comparing the prompt history size and latency of its first
+  and last turns, and counting the turns that reused earlier search results
+- app: questions asked on the chatbot page through Streamlit's AppTest, which runs the
+  page with a script run context as streamlit run does; the other stages call it bare
+- batch: batch_reports.run_batch over a file of questions, with the answer cache off
+- cleaning: the scraper's clean_body_content and remove_unwanted_content
+
+Results are appended to benchmarks/results.jsonl with the commit they were measured on
+and the peak RSS of the process, so runs can be compared across commits.
+
+Run it with:
+    python benchmarks/run_benchmarks.py --releases 50 --latency 0.05 --sessions 8
+    python benchmarks/run_benchmarks.py --base-url http://127.0.0.1:8001/v1 --sessions 32
+    python benchmarks/run_benchmarks.py --compare 5
+
+Token counts need the tiktoken encodings of the OpenAI models, which tiktoken downloads
+on first use. To run without network, cache them beforehand with
+`python token_counting.py download`; the suite checks for them before it starts, and
+--approximate-tokens estimates the counts instead when they are missing.
+
+Streamlit warns about the missing script context when cached resources are used outside
+`streamlit run`; the warnings go to stderr and can be ignored.
+"""
+import argparse
+import contextlib
+import importlib.util
+import io
+import json
+import logging
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+import numpy as np
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCHMARKS_DIR)
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "scraper"))
+sys.path.insert(0, BENCHMARKS_DIR)
+
+from corpus import PRODUCTS, generate_conversation, generate_corpus, generate_html, generate_queries
+from stub_openai_server import start_server
+
+RESULTS_PATH = os.path.join(BENCHMARKS_DIR, "results.jsonl")
+
+def percentiles(latencies):
+    p50, p95, p99 = np.percentile(np.array(latencies) * 1000, [50, 95, 99])
+    return {"count": len(latencies), "p50_ms": round(p50, 2), "p95_ms": round(p95, 2), "p99_ms": round(p99, 2)}
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if platform.system() == "Darwin" else 1024), 1)
+
+def git_commit():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=ROOT, capture_output=True, text=True).stdout.strip()
+        return f"{commit}-dirty" if dirty else commit
+    except OSError:
+        return "unknown"
+
+def timed(func, *args):
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        result = func(*args)
+    return time.perf_counter() - start, result
+
+def load_chatbot_page():
+    spec = importlib.util.spec_from_file_location("chatbot", os.path.join(ROOT, "pages", "1_chatbot.py"))
+    page = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(page)
+    return page
+
+def bench_populate(populate_vectordb, chars):
+    full_seconds, _ = timed(populate_vectordb.main)
+    manifest = populate_vectordb.load_manifest(populate_vectordb.DB_PATH)
+    if manifest is None:
+        sys.exit("populate_vectordb.main failed, rerun with --verbose to see why")
+    chunks = sum(info["chunks"] for info in manifest["collections"].values())
+    noop_seconds, _ = timed(populate_vectordb.main)
+    return {
+        "chunks": chunks,
+        "corpus_mb": round(chars / 1e6, 2),
+        "full_seconds": round(full_seconds, 3),
+        "chunks_per_second": round(chunks / full_seconds, 1),
+        "noop_seconds": round(noop_seconds, 4),
+    }
+
+def bench_retrieval(page, collection, queries):
+    latencies = [timed(page.find_relevant_entries_from_chroma_db, query, collection)[0] for query in queries]
+    return percentiles(latencies)
+
+def bench_query(page, collection, queries, client):
+    latencies = [timed(page.query_interface, query, True, collection, client)[0] for query in queries]
+    return percentiles(latencies)
+
+def bench_load(page, collection, queries, client, sessions):
+    def session(session_queries):
+        latencies = []
+        for query in session_queries:
+            start = time.perf_counter()
+            page.query_interface(query, False, collection, client)
+            latencies.append(time.perf_counter() - start)
+        return latencies
+
+    batches = [queries[i::sessions] for i in range(sessions)]
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()), ThreadPoolExecutor(max_workers=sessions) as executor:
+        latencies = [latency for batch in executor.map(session, batches) for latency in batch]
+    elapsed = time.perf_counter() - start
+    return dict(percentiles(latencies), sessions=sessions, queries_per_second=round(len(latencies) / elapsed, 2))
+
+def bench_conversation(page, collection, queries, client):
+    from context_packing import count_tokens
+    from conversation_memory import ConversationMemory
+    memory = ConversationMemory()
+
+    # Questions whose turn reused the search results of an earlier one, by turn
+    reused = {}
+    find_retrieval = memory.find_retrieval
+    def record_reuse(*args):
+        retrieval = find_retrieval(*args)
+        if retrieval is not None:
+            reused[len(latencies)] = retrieval["query"]
+        return retrieval
+    memory.find_retrieval = record_reuse
+
+    latencies, history_tokens = [], []
+    for query in queries:
+        latencies.append(timed(page.query_interface, query, not memory.has_history(), collection, client, memory)[0])
+        history_tokens.append(sum(count_tokens(message["content"]) for message in memory.history_messages()))
+
+    products = [product for names in PRODUCTS.values() for product in names]
+    def named(text):
+        return {product for product in products if product in text}
+    window = max(1, len(queries) // 5)
+    return {
+        "turns": len(queries),
+        "first_turns": percentiles(latencies[:window]),
+        "last_turns": percentiles(latencies[-window:]),
+        "max_history_tokens": max(history_tokens),
+        "final_history_tokens": history_tokens[-1],
+        "reused_turns": len(reused),
+        # Reuses for a question naming a product the reused question did not: wrong context
+        "reused_other_product": sum(bool(named(queries[turn]) - named(question)) for turn, question in reused.items()),
+    }
+
+def bench_batch(queries, concurrency):
+    import batch_reports
+    queries_path = os.path.abspath("batch_questions.txt")
+    with open(queries_path, "w", encoding="utf-8") as f:
+        f.write("\n".join(queries) + "\n")
+    start = time.perf_counter()
+    failed = batch_reports.run_batch(queries_path, os.path.abspath("batch_reports"), concurrency=concurrency,
+                                     formats=["md", "pdf"], api_key="stub")
+    elapsed = time.perf_counter() - start
+    return {
+        "questions": len(queries),
+        "failed": failed,
+        "concurrency": concurrency,
+        "seconds": round(elapsed, 2),
+        "questions_per_second": round(len(queries) / elapsed, 2),
+    }
+
+def bench_app(queries):
+    """
+    Asks the chatbot page questions through Streamlit's AppTest, so the pipeline runs
+    under a real script run context as with streamlit run, unlike the other stages.
+    """
+    from streamlit.testing.v1 import AppTest
+    app = AppTest.from_file(os.path.join(ROOT, "pages", "1_chatbot.py"), default_timeout=120)
+    app.run()
+    app.text_input[0].input("stub").run()
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        app.chat_input[0].set_value(query).run()
+        latencies.append(time.perf_counter() - start)
+        if app.exception:
+            sys.exit(f"The chatbot page failed to answer {query!r}: {app.exception[0].value or 'see the stack trace above'}")
+    answers = [message for message in app.chat_message if message.name == "assistant"]
+    if len(answers) != len(queries):
+        sys.exit(f"The chatbot page showed {len(answers)} answers to {len(queries)} questions")
+    return percentiles(latencies)
+
+def bench_cleaning(paragraphs, repeat=5):
+    import scraper
+    html = generate_html(paragraphs, scraper.BOILERPLATE_PATTERNS_PATH)
+    size_mb = len(html.encode("utf-8")) / 1e6
+    clean_seconds = min(timed(scraper.clean_body_content, html)[0] for _ in range(repeat))
+    text = scraper.clean_body_content(html)
+    remove_seconds = min(timed(scraper.remove_unwanted_content, text)[0] for _ in range(repeat))
+    return {
+        "html_mb": round(size_mb, 2),
+        "clean_body_mb_per_second": round(size_mb / clean_seconds, 2),
+        "remove_unwanted_mb_per_second": round(len(text.encode("utf-8")) / 1e6 / remove_seconds, 2),
+    }
+
+def check_tokenizers(approximate):
+    """
+    Loads the tokenizers before anything is measured, so a missing tiktoken encoding
+    fails the run at once instead of in the middle of the populate stage.
+    """
+    import config as cfg
+    from token_counting import chat_tokenizer, embedding_tokenizer
+    cfg.approximate_token_counts = approximate
+    try:
+        embedding_tokenizer()
+        chat_tokenizer()
+    except RuntimeError as e:
+        sys.exit(f"{e}\nOr pass --approximate-tokens to estimate the token counts.")
+
+def run(args):
+    check_tokenizers(args.approximate_tokens)
+    server, base_url = None, args.base_url
+    if base_url is None:
+        server, base_url = start_server(latency=args.latency, tokens_per_second=args.tokens_per_second,
+                                        completion_tokens=args.completion_tokens)
+    os.environ["OPENAI_BASE_URL"] = base_url
+    os.environ["OPENAI_API_KEY"] = "stub"
+
+    workdir = tempfile.mkdtemp(prefix="alcon-bench-")
+    os.chdir(workdir)  # The database, caches and traces use paths relative to the working directory
+    chars = generate_corpus(os.path.join(workdir, "data"), releases_per_site=args.releases)
+
+    import config as cfg
+    cfg.deploy = False  # Read the API key from the environment instead of Streamlit secrets
+    cfg.answer_cache_enabled = args.answer_cache
+    import populate_vectordb
+    if not args.verbose:
+        logging.getLogger().setLevel(logging.WARNING)
+
+    # The database is built before the page opens it, as when populate_vectordb runs on its own
+    results = {}
+    stages = args.stages.split(",")
+    if "populate" in stages:
+        results["populate"] = bench_populate(populate_vectordb, chars)
+    elif {"retrieval", "query", "load", "conversation", "app", "batch"} & set(stages):
+        timed(populate_vectordb.main)
+
+    page = load_chatbot_page()
+    from openai import OpenAI
+    client = OpenAI(api_key="stub", base_url=base_url)
+    options = page.get_collection_options()
+    collection = cfg.all_competitors_label if cfg.all_competitors_label in options else next(iter(options), None)
+    queries = generate_queries(args.queries)
+
+    if "retrieval" in stages:
+        results["retrieval"] = bench_retrieval(page, collection, queries)
+    if "query" in stages:
+        results["query"] = bench_query(page, collection, generate_queries(args.queries, seed=2), client)
+    if "load" in stages:
+        results["load"] = bench_load(page, collection, generate_queries(args.sessions * args.queries_per_session, seed=3),
+                                     client, args.sessions)
+    if "conversation" in stages:
+        results["conversation"] = bench_conversation(page, collection, generate_conversation(args.conversation_turns, seed=5), client)
+    if "app" in stages:
+        results["app"] = bench_app(generate_queries(args.app_questions, seed=6))
+    if "batch" in stages:
+        results["batch"] = bench_batch(generate_queries(args.batch_questions, seed=4), args.batch_concurrency)
+    if "cleaning" in stages:
+        results["cleaning"] = bench_cleaning(args.html_paragraphs)
+    if server is not None:
+        server.shutdown()
+
+    record = {
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "params": {key: value for key, value in vars(args).items() if key not in ("compare", "verbose")},
+        "results": results,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+    with open(args.results, "a", encoding="utf-8") as f:
+        f.write(json.dumps(record) + "\n")
+    print(json.dumps(record, indent=2))
+    print(f"Appended to {args.results} (scratch directory: {workdir})")
+
+def compare(path, count):
+    """
+    Prints the metrics of the last count runs side by side.
+    """
+    with open(path, encoding="utf-8") as f:
+        records = [json.loads(line) for line in f if line.strip()][-count:]
+    metrics = {}
+    for i, record in enumerate(records):
+        for stage, values in record["results"].items():
+            for name, value in values.items():
+                metrics.setdefault(f"{stage}.{name}", [None] * len(records))[i] = value
+        metrics.setdefault("peak_rss_mb", [None] * len(records))[i] = record["peak_rss_mb"]
+
+    print(f"{'metric':<42}" + "".join(f"{record['commit']:>16}" for record in records))
+    for name, values in metrics.items():
+        print(f"{name:<42}" + "".join(f"{'-' if value is None else value:>16}" for value in values))
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmarks of the chatbot and its data pipeline")
+    parser.add_argument('--stages', default="populate,retrieval,query,load,conversation,app,batch,cleaning")
+    parser.add_argument('--releases', type=int, default=50, help="Synthetic releases per competitor")
+    parser.add_argument('--queries', type=int, default=30, help="Queries for the retrieval and query stages")
+    parser.add_argument('--sessions', type=int, default=8, help="Concurrent sessions in the load test")
+    parser.add_argument('--queries-per-session', type=int, default=5)
+    parser.add_argument('--conversation-turns', type=int, default=30, help="Questions of the conversation stage")
+    parser.add_argument('--app-questions', type=int, default=3, help="Questions asked through the chatbot page (AppTest)")
+    parser.add_argument('--batch-questions', type=int, default=200, help="Questions of the batch reports stage")
+    parser.add_argument('--batch-concurrency', type=int, default=16)
+    parser.add_argument('--latency', type=float, default=0.05, help="Seconds the stub waits before each response")
+    parser.add_argument('--tokens-per-second', type=float, default=0.0, help="Pace of generated tokens (0 = unlimited)")
+    parser.add_argument('--completion-tokens', type=int, default=200)
+    parser.add_argument('--html-paragraphs', type=int, default=2000, help="Paragraphs of the cleaning benchmark page")
+    parser.add_argument('--base-url', default=None,
+                        help="Use a stub started separately (stub_openai_server.py) instead of one in this process, "
+                             "so the stub's CPU time does not compete with the code being measured")
+    parser.add_argument('--answer-cache', action='store_true', help="Keep the answer cache enabled")
+    parser.add_argument('--approximate-tokens', action='store_true',
+                        help="Estimate token counts if the tiktoken encodings are not cached (no network)")
+    parser.add_argument('--results', default=RESULTS_PATH)
+    parser.add_argument('--compare', type=int, default=0, help="Print the last N results instead of running")
+    parser.add_argument('--verbose', action='store_true')
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(args.results, args.compare)
+    else:
+        run(args)
+
+if __name__ == "__main__":
+    main()
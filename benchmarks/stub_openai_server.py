@@ -0,0 +1,175 @@
+"""
+Local stand-in for the OpenAI embeddings and chat completions endpoints, used to
+benchmark the app without network noise or API costs. Embeddings are deterministic
+bags of terms, so texts sharing words are close to each other, and completions are
+deterministic text derived from the prompt, optionally streamed token by token.
+
+Run it with:
+    python benchmarks/stub_openai_server.py --port 8001 --latency 0.2 --tokens-per-second 100
+
+and point the app at it:
+    OPENAI_BASE_URL=http://127.0.0.1:8001/v1 OPENAI_API_KEY=stub python populate_vectordb.py
+"""
+import argparse
+import base64
+import hashlib
+import json
+import re
+import threading
+import time
+import zlib
+from collections import Counter
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+DEFAULT_DIMENSIONS = 3072
+DEFAULT_COMPLETION_TOKENS = 200
+
+WORDS = ["competitor", "lens", "launch", "clinical", "data", "patients", "vision", "approval", "market", "quarter"]
+
+@lru_cache(maxsize=4096)
+def term_vector(term, dimensions):
+    seed = zlib.crc32(str(term).encode('utf-8'))
+    return np.random.RandomState(seed).standard_normal(dimensions).astype(np.float32)
+
+def fake_embedding(value, dimensions):
+    """
+    Returns a deterministic unit vector: the sum of a random vector per term, weighted by
+    the term's frequency. value is a text or a list of token IDs.
+    """
+    terms = value if isinstance(value, list) else re.findall(r"\w+", str(value).lower())
+    vector = np.zeros(dimensions, dtype=np.float32)
+    for term, count in Counter(terms).items():
+        vector += count * term_vector(term, dimensions)
+    norm = np.linalg.norm(vector) or 1.0
+    return vector / norm
+
+def fake_completion(messages, tokens):
+    """
+    Returns deterministic completion words derived from the hash of the messages.
+    """
+    seed = hashlib.sha256(json.dumps(messages, sort_keys=True).encode('utf-8')).digest()
+    return ["**Augmented Response**\n\n"] + [f"{WORDS[seed[i % len(seed)] % len(WORDS)]} " for i in range(tokens)]
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024  # Load tests open many connections at once
+
+class StubOpenAIHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # Keep-alive connections, like the real API
+    latency = 0.0
+    dimensions = DEFAULT_DIMENSIONS
+    completion_tokens = DEFAULT_COMPLETION_TOKENS
+    tokens_per_second = 0.0  # 0 sends the whole completion at once
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        time.sleep(self.latency)
+
+        if self.path.endswith('/embeddings'):
+            self.send_json(self.embeddings_response(body))
+        elif self.path.endswith('/chat/completions'):
+            self.chat_completion(body)
+        else:
+            self.send_json({"error": {"message": f"Unknown endpoint {self.path}"}}, status=404)
+
+    def embeddings_response(self, body):
+        inputs = body.get('input', [])
+        if not isinstance(inputs, list) or (inputs and isinstance(inputs[0], int)):
+            inputs = [inputs]
+        dimensions = body.get('dimensions') or self.dimensions
+
+        data = []
+        for i, value in enumerate(inputs):
+            vector = fake_embedding(value, dimensions)
+            if body.get('encoding_format') == 'base64':
+                vector = base64.b64encode(vector.astype('<f4').tobytes()).decode('ascii')
+            else:
+                vector = vector.tolist()
+            data.append({"object": "embedding", "index": i, "embedding": vector})
+
+        return {
+            "object": "list",
+            "data": data,
+            "model": body.get('model', 'text-embedding-3-large'),
+            "usage": {"prompt_tokens": 0, "total_tokens": 0},
+        }
+
+    def chat_completion(self, body):
+        words = fake_completion(body.get('messages', []), body.get('max_tokens') or self.completion_tokens)
+        completion = {
+            "id": "chatcmpl-stub",
+            "created": int(time.time()),
+            "model": body.get('model', 'gpt-3.5-turbo'),
+        }
+        if not body.get('stream'):
+            self.pace(len(words))
+            self.send_json(dict(completion, object="chat.completion", choices=[{
+                "index": 0,
+                "message": {"role": "assistant", "content": "".join(words)},
+                "finish_reason": "stop",
+            }], usage={"prompt_tokens": 0, "completion_tokens": len(words), "total_tokens": len(words)}))
+            return
+
+        # Server-sent events, one word per chunk; the connection closes after [DONE]
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Connection', 'close')
+        self.close_connection = True
+        self.end_headers()
+        for word in words:
+            self.pace(1)
+            chunk = dict(completion, object="chat.completion.chunk", choices=[{
+                "index": 0, "delta": {"content": word}, "finish_reason": None,
+            }])
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode('utf-8'))
+            self.wfile.flush()
+        self.wfile.write(b"data: [DONE]\n\n")
+
+    def pace(self, tokens):
+        if self.tokens_per_second:
+            time.sleep(tokens / self.tokens_per_second)
+
+    def send_json(self, payload, status=200):
+        encoded = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(encoded)))
+        self.end_headers()
+        self.wfile.write(encoded)
+
+    def log_message(self, format, *args):
+        pass
+
+def start_server(host='127.0.0.1', port=0, **settings):
+    """
+    Starts the stub in a background thread and returns the server and its /v1 base URL.
+    settings override the handler's class attributes (latency, dimensions, ...).
+    """
+    handler = type("ConfiguredStubOpenAIHandler", (StubOpenAIHandler,), settings)
+    server = StubServer((host, port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}/v1"
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stub for the OpenAI API")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8001)
+    parser.add_argument('--latency', type=float, default=0.0, help="Seconds to wait before each response")
+    parser.add_argument('--dimensions', type=int, default=DEFAULT_DIMENSIONS)
+    parser.add_argument('--completion-tokens', type=int, default=DEFAULT_COMPLETION_TOKENS)
+    parser.add_argument('--tokens-per-second', type=float, default=0.0, help="Pace of generated tokens (0 = unlimited)")
+    args = parser.parse_args()
+
+    StubOpenAIHandler.latency = args.latency
+    StubOpenAIHandler.dimensions = args.dimensions
+    StubOpenAIHandler.completion_tokens = args.completion_tokens
+    StubOpenAIHandler.tokens_per_second = args.tokens_per_second
+    server = StubServer((args.host, args.port), StubOpenAIHandler)
+    print(f"Stub OpenAI server listening on http://{args.host}:{args.port}/v1")
+    server.serve_forever()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+import re
+
+import config as cfg
+from token_counting import embedding_tokenizer
+
+# Sentence boundaries: end punctuation followed by whitespace and something that can start a sentence
+SENTENCE_BOUNDARY = re.compile(r'(?<=[.!?])\s+(?=["“(\[A-Z0-9])')
+
+def count_tokens(text):
+    """
+    Counts the tokens of a text with the tokenizer of the embedding model.
+    """
+    return embedding_tokenizer().count(text)
+
+def iter_lines(file_path):
+    """
+    Streams the lines of a file with their line number and character offsets, without
+    reading the whole file into memory.
+    """
+    offset = 0
+    with open(file_path, 'r', encoding='utf-8', newline='') as f:
+        for line_number, line in enumerate(f):
+            text = line.rstrip('\r\n')
+            yield line_number, text, offset, offset + len(text)
+            offset += len(line)
+
+def split_to_fit(text, start, max_tokens):
+    """
+    Splits a line that is longer than max_tokens into sentences, and sentences that are
+    still too long into token windows. Returns (text, start, end, tokens) pieces.
+    """
+    tokens = count_tokens(text)
+    if tokens <= max_tokens:
+        return [(text, start, start + len(text), tokens)]
+
+    pieces = []
+    position = 0
+    for boundary in list(SENTENCE_BOUNDARY.finditer(text)) + [None]:
+        end = boundary.start() if boundary else len(text)
+        sentence = text[position:end]
+        sentence_tokens = count_tokens(sentence)
+        if sentence_tokens <= max_tokens:
+            pieces.append((sentence, start + position, start + end, sentence_tokens))
+        else:
+            offset = position
+            for window, window_tokens in embedding_tokenizer().windows(sentence, max_tokens):
+                pieces.append((window, start + offset, start + offset + len(window), window_tokens))
+                offset += len(window)
+        position = boundary.end() if boundary else len(text)
+    return [piece for piece in pieces if piece[0].strip()]
+
+def make_chunk(units, title):
+    parts = []
+    previous_line = None
+    for line_number, text, _, _, _ in units:
+        if parts:
+            parts.append(" " if line_number == previous_line else "\n")
+        parts.append(text)
+        previous_line = line_number
+    return {"text": "".join(parts), "title": title, "start": units[0][2], "end": units[-1][3]}
+
+def overlap_tail(units, overlap_tokens):
+    """
+    Returns the trailing units of a chunk that fit in overlap_tokens, to start the next chunk with.
+    """
+    tail = []
+    size = 0
+    for unit in reversed(units):
+        if size + unit[4] <= overlap_tokens:
+            tail.insert(0, unit)
+            size += unit[4]
+            continue
+
+        # Fall back to the trailing sentences of a unit that is too long to repeat whole
+        line_number, text, start, _, _ = unit
+        piece = None
+        for position in reversed([match.end() for match in SENTENCE_BOUNDARY.finditer(text)]):
+            tokens = count_tokens(text[position:])
+            if size + tokens > overlap_tokens:
+                break
+            piece = (line_number, text[position:], start + position, start + len(text), tokens)
+        if piece:
+            tail.insert(0, piece)
+        break
+    return tail
+
+def iter_chunks(file_path, chunk_tokens=None, overlap_tokens=None):
+    """
+    Streams structure-aware chunks of a scraped TXT file. Chunks never cross the "## title"
+    headers written by the scraper, prefer to end at paragraph breaks, only split lines at
+    sentence boundaries when they are too long, and repeat up to overlap_tokens of the
+    previous chunk. Each chunk is a dict with its text, the release title and its
+    character offsets in the file.
+    """
+    chunk_tokens = chunk_tokens or cfg.chunk_tokens
+    overlap_tokens = cfg.chunk_overlap_tokens if overlap_tokens is None else overlap_tokens
+
+    title = ""
+    units = []  # (line number, text, start, end, tokens) of the chunk being built
+    size = 0
+    has_new_text = False  # Whether units holds more than the overlap of the previous chunk
+
+    for line_number, line, start, end in iter_lines(file_path):
+        stripped = line.strip()
+        is_header = stripped.startswith("## ")
+
+        # Release headers and paragraph breaks in a reasonably full chunk end the chunk
+        if has_new_text and (is_header or (not stripped and size >= chunk_tokens // 2)):
+            yield make_chunk(units, title)
+            units = [] if is_header else overlap_tail(units, overlap_tokens)
+            size = sum(unit[4] for unit in units)
+            has_new_text = False
+        if is_header:
+            title = stripped[3:].strip()
+            units, size = [], 0
+        if not stripped:
+            continue
+
+        for text, piece_start, piece_end, tokens in split_to_fit(line, start, chunk_tokens):
+            if has_new_text and size + tokens > chunk_tokens:
+                yield make_chunk(units, title)
+                units = overlap_tail(units, overlap_tokens)
+                size = sum(unit[4] for unit in units)
+                has_new_text = False
+            while units and size + tokens > chunk_tokens:
+                size -= units.pop(0)[4]
+            units.append((line_number, text, piece_start, piece_end, tokens))
+            size += tokens
+            has_new_text = True
+
+    if has_new_text:
+        yield make_chunk(units, title)
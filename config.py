@@ -1 +1,109 @@
-deploy = True
\ No newline at end of file
+deploy = True
+
+# Location of the Chroma database
+db_path = "./chroma_db"
+index_lock_path = "./chroma_db.lock"  # Held by populate_vectordb while it writes and by chatbot requests while they retrieve
+index_update_lock_path = "./chroma_db.update.lock"  # Held by populate_vectordb for a whole run, so two runs never overlap
+
+# Embedding settings for populating the vector database
+embedding_backend = "openai"  # "openai" (embeddings API) or "local" (sentence-transformers on the CPU, no network); changing it rebuilds the database
+embedding_model = "text-embedding-3-large"
+embedding_dimensions = None  # Shorten the embeddings (e.g. 1024 or 256), None for the model's full size; changing it rebuilds the database
+local_embedding_model = "BAAI/bge-small-en-v1.5"  # Model of the local backend (pip install sentence-transformers)
+local_embedding_batch_size = 64  # Texts encoded per forward pass of the local model
+local_embedding_processes = 0  # Processes encoding ingestion batches with the local model (0 = in the populating process)
+embed_batch_size = 256  # Max chunks per embeddings request (API limit is 2048 inputs)
+embed_batch_tokens = 100000  # Max tokens per embeddings request (API limit is 300k)
+embed_max_workers = 4  # Max embedding requests in flight at once
+chunk_tokens = 200  # Target chunk size in tokens of the embedding model
+chunk_overlap_tokens = 40  # Tokens repeated from the end of the previous chunk
+tiktoken_cache_dir = "./tiktoken_cache"  # Tokenizer files of the OpenAI models, relative to the repo; fill once with: python token_counting.py download
+approximate_token_counts = False  # Estimate the counts of OpenAI tokenizers that are neither cached nor downloadable (offline benchmarks)
+vector_quantization = None  # "int8" or "binary" to search a compact sidecar index instead of Chroma's float HNSW index
+quantized_rerank_candidates = 4  # Shortlist per search result re-ranked with the float vectors (0 = no re-rank)
+incremental_indexing = True  # Only re-embed changed chunks instead of rebuilding the database
+near_duplicate_filter = True  # Skip releases and chunks that near-duplicate ones from other files
+near_duplicate_threshold = 0.8  # Min estimated Jaccard similarity of word shingles to skip a text
+
+# Persistent embedding cache shared by populate_vectordb and the chatbot
+embedding_cache_path = "./embedding_cache.sqlite3"
+embedding_cache_max_entries = 20000  # ~240 MB of 3072-dim float32 vectors
+
+# Chatbot settings
+chatbot_model = "gpt-3.5-turbo"
+context_token_budget = 3000  # Max tokens of retrieved passages in the prompt
+context_max_distance = 0.8  # Drop search results with a larger cosine distance
+context_min_passage_tokens = 50  # Don't add truncated passages shorter than this
+stream_responses = True  # Render the answer token by token as it is generated
+
+# PDF export of reports; the first font file that exists is used (fonts-dejavu-core and fonts-noto-cjk on Debian)
+pdf_fonts = {
+    "regular": ["/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf", "/Library/Fonts/Arial Unicode.ttf", "C:/Windows/Fonts/arial.ttf"],
+    "bold": ["/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf", "C:/Windows/Fonts/arialbd.ttf"],
+    # All that exist are used, for characters the regular font lacks
+    "fallback": ["/usr/share/fonts/opentype/noto/NotoSansCJK-Regular.ttc", "/usr/share/fonts/truetype/wqy/wqy-microhei.ttc",
+                 "/System/Library/Fonts/PingFang.ttc", "C:/Windows/Fonts/msyh.ttc"],
+}
+pdf_cache_entries = 64  # Rendered PDFs kept in memory, by hash of the report text
+
+# Async query pipeline shared by the chatbot page and batch callers
+async_max_connections = 100  # Pooled HTTP connections to the OpenAI API per API key
+async_max_clients = 16  # API keys whose clients are kept; the least recently used one is closed
+async_max_embeddings = 64  # Query embeddings requested at once per process
+async_max_generations = 64  # Chat completions in flight at once per process
+async_max_threads = 32  # Worker threads for the blocking steps (cache lookups, context packing)
+
+# Headless batch reports (python batch_reports.py questions.txt)
+batch_concurrency = 16  # Questions answered at once
+batch_requests_per_minute = 500  # Completions started per minute across the batch
+batch_tokens_per_minute = 200000  # Prompt and answer tokens spent per minute across the batch
+
+# Scheduled refresh of the competitor data (python refresh_pipeline.py)
+refresh_sites = ["jnj"]  # Site adapters in scraper/site_adapters.py
+refresh_articles_per_site = 4  # Latest releases listed per site
+refresh_fetch_workers = 8  # Release pages fetched at once (the fetcher also limits each host)
+refresh_queue_size = 32  # Releases waiting between two stages
+refresh_checkpoint_every = 10  # Saved releases between checkpoints of the fetch state
+refresh_parse_description = None  # Rewrite releases with scraper/parse.py using this description, None to keep the text
+refresh_parse_chunk_chars = 6000  # Characters per parse request
+refresh_parse_workers = 2  # Releases parsed at once
+refresh_lock_path = "./refresh.lock"  # Keeps two refreshes from running at once
+
+# Per-stage latency tracing of chatbot requests (report with: python tracing.py report)
+tracing_enabled = True
+trace_path = "./traces.sqlite3"
+trace_max_requests = 50000  # Older requests are pruned
+
+# Semantic cache of answers to repeated and near-duplicate questions
+answer_cache_enabled = True
+answer_cache_path = "./answer_cache.sqlite3"
+answer_cache_max_distance = 0.05  # Max cosine distance between a new and a cached query
+answer_cache_ttl_seconds = 7 * 24 * 3600
+answer_cache_max_entries = 1000
+
+# Retrieval settings
+retrieval_mode = "hybrid"  # "vector", "lexical" or "hybrid" (BM25 fused with vector search)
+retrieval_k = 20  # Search results passed on to context packing
+lexical_k = 20  # BM25 hits per collection fused with the vector hits
+retrieval_collection_quota = 15  # Max results per collection when searching several
+retrieval_max_workers = 8  # Collections searched in parallel across all sessions
+competitor_labels = {"jnj": "JNJ", "rxsight": "RXSight", "zeiss": "Zeiss IOLs"}
+all_competitors_label = "All competitors"
+
+# Re-ranking settings (per collection overrides in rerank_overrides, e.g. {"zeiss": {"mmr_lambda": 0.5}})
+rerank_mmr_lambda = 0.7  # Relevance vs diversity of MMR (1 = relevance only), None to skip MMR
+rerank_candidates = 2  # Search results fetched per result kept after re-ranking
+rerank_cross_encoder = False  # Re-score the top results with a local cross-encoder (needs sentence-transformers)
+cross_encoder_model = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+cross_encoder_shortlist = 20  # Max results re-scored by the cross-encoder
+rerank_budget_ms = 100  # Time per collection the cross-encoder shortlist is sized to
+rerank_overrides = {}
+
+# Conversation memory of chat sessions
+memory_recent_turns = 3  # Latest turns included verbatim; older ones are summarized
+memory_token_budget = 1500  # Max tokens of summary and turns in the prompt
+memory_summary_tokens = 300  # Max tokens of the rolling summary
+memory_summary_input_tokens = 3000  # Max tokens of the turns folded into the summary at once
+memory_summary_model = "gpt-3.5-turbo"
+memory_reuse_min_similarity = 0.85  # Min cosine similarity of a follow-up to an earlier question to reuse its search results
+memory_reuse_max_term_share = 0.9  # Terms in at most this share of a collection's chunks must be in the earlier question too
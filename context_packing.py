@@ -0,0 +1,100 @@
+import logging
+
+import config as cfg
+from token_counting import chat_tokenizer
+
+def count_tokens(text):
+    """
+    Counts the tokens of a text with the tokenizer of the chatbot model.
+    """
+    return chat_tokenizer().count(text)
+
+def truncate_to_tokens(text, max_tokens):
+    windows = chat_tokenizer().windows(text, max_tokens) if max_tokens > 0 else []
+    return windows[0][0] if windows else ""
+
+def strip_overlap(previous, current, min_overlap=20):
+    """
+    Removes the start of current that repeats the end of previous.
+    """
+    for size in range(min(len(previous), len(current)), min_overlap - 1, -1):
+        if previous.endswith(current[:size]):
+            return current[size:]
+    return current
+
+def merge_adjacent_chunks(results):
+    """
+    Merges search results that are consecutive chunks of the same source into single
+    passages, removing the text they overlap on. Each passage keeps the best rank (position
+    in results) of the chunks it was built from.
+    """
+    ordered = sorted(
+        ((doc, rank) for rank, (doc, _) in enumerate(results)),
+        key=lambda item: (item[0].metadata.get("source", ""), item[0].metadata.get("chunk", 0)),
+    )
+    passages = []
+    for doc, rank in ordered:
+        source = doc.metadata.get("source", "")
+        chunk = doc.metadata.get("chunk", 0)
+        last = passages[-1] if passages else None
+        if last and last["source"] == source and last["last_chunk"] == chunk - 1:
+            last["text"] += strip_overlap(last["text"], doc.page_content)
+            last["last_chunk"] = chunk
+            last["rank"] = min(last["rank"], rank)
+        elif last and last["source"] == source and last["last_chunk"] == chunk:
+            continue  # Same chunk returned twice
+        else:
+            passages.append({
+                "source": source,
+                "first_chunk": chunk,
+                "last_chunk": chunk,
+                "title": doc.metadata.get("title", ""),
+                "text": doc.page_content,
+                "rank": rank,
+            })
+    return passages
+
+def format_passage(passage):
+    header = f"[Source: {passage['source']}"
+    if passage["title"]:
+        header += f" | {passage['title']}"
+    return f"{header}]\n{passage['text'].strip()}"
+
+def pack_context(results, token_budget=None, max_distance=None):
+    """
+    Turns ranked (Document, distance) search results into a prompt context: results
+    further than max_distance are dropped, adjacent chunks of the same source are merged,
+    and the best ranked passages are packed until the token budget is used up. Results
+    without a distance (lexical-only hits) are kept.
+    """
+    token_budget = token_budget or cfg.context_token_budget
+    max_distance = cfg.context_max_distance if max_distance is None else max_distance
+
+    relevant = [(doc, score) for doc, score in results if score is None or score <= max_distance]
+    passages = sorted(merge_adjacent_chunks(relevant), key=lambda passage: passage["rank"])
+
+    packed = []
+    used_tokens = 0
+    separator_tokens = count_tokens("\n\n")
+    for passage in passages:
+        text = format_passage(passage)
+        tokens = count_tokens(text)
+        remaining = token_budget - used_tokens - (separator_tokens if packed else 0)
+        if tokens > remaining:
+            if remaining < cfg.context_min_passage_tokens:
+                break
+            text = truncate_to_tokens(text, remaining)
+            tokens = remaining
+        packed.append(text)
+        used_tokens += tokens + (separator_tokens if len(packed) > 1 else 0)
+
+    context = "\n\n".join(packed)
+
+    if logging.getLogger().isEnabledFor(logging.DEBUG):
+        # Only tokenized for the log: the results' text is not counted anywhere else
+        raw_tokens = sum(count_tokens(doc.page_content) for doc, _ in results)
+        logging.debug(
+            f"Packed {len(packed)} passages from {len(results)} results into {used_tokens} tokens "
+            f"(saved {raw_tokens - used_tokens} of {raw_tokens} tokens)"
+        )
+    return context
@@ -0,0 +1,136 @@
+"""
+Bounded memory of one chat session. The latest turns go into the prompt verbatim and
+older turns as a summary that is updated incrementally, a few turns at a time, by a
+completion running after the answer was delivered. Together they stay within
+config.memory_token_budget, so prompts do not grow with the length of a session.
+
+The memory also keeps the search results of the latest turns. A follow-up reuses an
+earlier question's results and packed context instead of searching again if its
+embedding is close to the question's and it names nothing the question did not, such
+as another product: "and in more detail?" reuses them, "and for CT LUCIA?" searches.
+"""
+import asyncio
+import logging
+
+import numpy as np
+
+import config as cfg
+from context_packing import count_tokens, truncate_to_tokens
+from lexical_index import tokenize
+
+SUMMARY_PROMPT = """Update the summary of a conversation between an ALCON employee and an assistant reporting on competitors' innovations.
+Keep the companies, products, dates and figures discussed and the questions asked. Answer with the updated summary only, in at most {max_words} words.
+
+Current summary:
+{summary}
+
+New turns:
+{turns}"""
+
+class ConversationMemory:
+    """
+    Turns and search results of a chat session. Used on the query pipeline loop only.
+    """
+
+    def __init__(self, recent_turns=None, token_budget=None, summary_tokens=None):
+        self.recent_turns = recent_turns or cfg.memory_recent_turns
+        self.token_budget = token_budget or cfg.memory_token_budget
+        self.summary_tokens = summary_tokens or cfg.memory_summary_tokens
+        self.summary = ""
+        self.turns = []  # Turns not folded into the summary yet, oldest first
+        self.retrievals = []  # Search results of the latest turns, newest last
+        self._compaction = None
+
+    def has_history(self):
+        return bool(self.summary or self.turns)
+
+    def add_turn(self, user_query, answer):
+        self.turns.append({"user": user_query, "assistant": answer, "tokens": count_tokens(user_query) + count_tokens(answer)})
+
+    def history_messages(self):
+        """
+        Returns the chat messages of the history: the summary, then as many of the latest
+        turns as fit into the rest of the budget. The latest turn is truncated if it does
+        not fit on its own.
+        """
+        messages = []
+        budget = self.token_budget
+        if self.summary:
+            messages.append({"role": "system", "content": f"Summary of the earlier conversation: {self.summary}"})
+            budget -= count_tokens(self.summary)
+
+        recent = []
+        for turn in reversed(self.turns[-self.recent_turns:]):
+            if turn["tokens"] > budget:
+                if not recent and budget > count_tokens(turn["user"]):
+                    answer = truncate_to_tokens(turn["assistant"], budget - count_tokens(turn["user"]))
+                    recent.append({"user": turn["user"], "assistant": answer})
+                break
+            recent.append(turn)
+            budget -= turn["tokens"]
+        for turn in reversed(recent):
+            messages.append({"role": "user", "content": turn["user"]})
+            messages.append({"role": "assistant", "content": turn["assistant"]})
+        return messages
+
+    def has_retrievals(self):
+        return bool(self.retrievals)
+
+    def find_retrieval(self, collection_key, index_version, query_embedding, content_terms):
+        """
+        Returns the retrieval (query, results, context) of the earlier question most
+        similar to a new one, if it searched the same collections of the same index, is
+        similar enough and contains all content_terms of the new one
+        (retrieval.query_content_terms).
+        """
+        if query_embedding is None:
+            return None
+        query = np.asarray(query_embedding, dtype=np.float32)
+        query /= max(np.linalg.norm(query), 1e-12)
+        best, best_similarity = None, cfg.memory_reuse_min_similarity
+        for retrieval in self.retrievals:
+            if (retrieval["collection_key"], retrieval["index_version"]) != (collection_key, index_version):
+                continue
+            if not content_terms <= retrieval["terms"]:
+                continue  # The follow-up is about something the question was not
+            if retrieval["embedding"].shape == query.shape and float(retrieval["embedding"] @ query) >= best_similarity:
+                best, best_similarity = retrieval, float(retrieval["embedding"] @ query)
+        return best
+
+    def remember_retrieval(self, collection_key, index_version, user_query, query_embedding, results, context):
+        if query_embedding is None:
+            return
+        embedding = np.asarray(query_embedding, dtype=np.float32)
+        embedding /= max(np.linalg.norm(embedding), 1e-12)
+        self.retrievals.append({"collection_key": collection_key, "index_version": index_version, "query": user_query,
+                                "terms": set(tokenize(user_query)), "embedding": embedding, "results": results,
+                                "context": context})
+        del self.retrievals[:-self.recent_turns]
+
+    def schedule_compaction(self, client):
+        """
+        Starts folding the turns beyond the recent ones into the summary, unless that is
+        running already. The next question does not wait for it: until it completes, the
+        prompt holds the old summary and the latest turns that fit.
+        """
+        if len(self.turns) > self.recent_turns and (self._compaction is None or self._compaction.done()):
+            self._compaction = asyncio.ensure_future(self.compact(client))
+
+    async def compact(self, client):
+        while len(self.turns) > self.recent_turns:
+            folded = self.turns[:len(self.turns) - self.recent_turns]
+            turns = "\n\n".join(f"User: {turn['user']}\nAssistant: {turn['assistant']}" for turn in folded)
+            # The answers are long reports; their start carries the gist
+            turns = truncate_to_tokens(turns, cfg.memory_summary_input_tokens)
+            prompt = SUMMARY_PROMPT.format(max_words=self.summary_tokens * 3 // 4, summary=self.summary or "(none)", turns=turns)
+            try:
+                response = await client.chat.completions.create(
+                    model=cfg.memory_summary_model, messages=[{"role": "user", "content": prompt}],
+                    max_tokens=self.summary_tokens,
+                )
+            except Exception as e:
+                # The turns stay; the prompt keeps only the latest ones that fit until the next try
+                logging.warning(f"Conversation summary failed: {e}")
+                return
+            self.summary = truncate_to_tokens(response.choices[0].message.content.strip(), self.summary_tokens)
+            del self.turns[:len(folded)]  # Turns added meanwhile were appended after them
@@ -0,0 +1,156 @@
+"""
+Embedding backends, selected with config.embedding_backend:
+
+- "openai": the OpenAI embeddings API (config.embedding_model), optionally shortened
+  with config.embedding_dimensions
+- "local": a sentence-transformers model (config.local_embedding_model) run on this
+  machine's CPU, so neither query embeddings nor ingestion need the network once the
+  model is downloaded; chunks are counted with the model's own tokenizer
+  (token_counting.py). sentence-transformers and torch are only imported when this
+  backend is used:
+      pip install sentence-transformers
+
+Every Chroma collection records the backend, model and dimension that built it
+(collection_metadata), and searches check it against the query embedding
+(check_collection_embedding), so a database built by another backend fails loudly
+instead of returning meaningless neighbours.
+"""
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from langchain_openai import OpenAIEmbeddings
+
+import config as cfg
+from embedding_cache import CachedEmbeddings, embedding_model_key
+
+BACKENDS = ("openai", "local")
+
+def embedding_settings():
+    """
+    Settings the stored embeddings depend on; the database is rebuilt when they change.
+    """
+    model = cfg.local_embedding_model if cfg.embedding_backend == "local" else cfg.embedding_model
+    return {"backend": cfg.embedding_backend, "model": model, "dimensions": cfg.embedding_dimensions}
+
+def load_sentence_transformer(model_name, dimensions=None):
+    try:
+        from sentence_transformers import SentenceTransformer
+    except ImportError as e:
+        raise ImportError("The local embedding backend needs sentence-transformers: pip install sentence-transformers") from e
+    # truncate_dim shortens the embeddings of Matryoshka models like config.embedding_dimensions does for OpenAI
+    return SentenceTransformer(model_name, device="cpu", truncate_dim=dimensions)
+
+def encode(model, texts, batch_size):
+    return model.encode(texts, batch_size=batch_size, normalize_embeddings=True, convert_to_numpy=True,
+                        show_progress_bar=False).astype(np.float32)
+
+_worker_model = None  # Model of a LocalEmbeddings worker process
+
+def _init_worker(model_name, dimensions, threads):
+    global _worker_model
+    import torch
+    torch.set_num_threads(threads)
+    _worker_model = load_sentence_transformer(model_name, dimensions)
+
+def _encode_in_worker(texts, batch_size):
+    return encode(_worker_model, texts, batch_size)
+
+class LocalEmbeddings(Embeddings):
+    """
+    Sentence-transformers model on the CPU. Texts are encoded in batches of batch_size
+    in one vectorized forward pass each. With processes > 1, large embed_documents calls
+    (ingestion) are split across worker processes that each load the model and use an
+    equal share of the CPU threads; queries are always encoded in this process.
+    """
+
+    def __init__(self, model_name=None, dimensions=None, batch_size=None, processes=None):
+        self.model_name = model_name or cfg.local_embedding_model
+        self.dimensions = dimensions
+        self.batch_size = batch_size or cfg.local_embedding_batch_size
+        self.processes = cfg.local_embedding_processes if processes is None else processes
+        self._model = None
+        self._pool = None
+        self._lock = threading.Lock()
+
+    @property
+    def model(self):
+        with self._lock:
+            if self._model is None:
+                self._model = load_sentence_transformer(self.model_name, self.dimensions)
+            return self._model
+
+    def _get_pool(self):
+        with self._lock:
+            if self._pool is None:
+                threads = max(1, (os.cpu_count() or 1) // self.processes)
+                # Spawned, not forked: the parent runs threads (embedding workers, Chroma)
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.processes,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_init_worker,
+                    initargs=(self.model_name, self.dimensions, threads),
+                )
+            return self._pool
+
+    def embed_documents(self, texts):
+        texts = list(texts)
+        if self.processes > 1 and len(texts) > self.batch_size:
+            batches = [texts[i:i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+            results = self._get_pool().map(_encode_in_worker, batches, [self.batch_size] * len(batches))
+            return [vector for vectors in results for vector in vectors.tolist()]
+        return encode(self.model, texts, self.batch_size).tolist()
+
+    def embed_query(self, text):
+        return encode(self.model, [text], 1)[0].tolist()
+
+def create_embedding_function(backend=None, api_key=None):
+    """
+    Returns the embedding function of a backend (config.embedding_backend by default),
+    without the cache.
+    """
+    backend = backend or cfg.embedding_backend
+    if backend == "openai":
+        # Chunks are cut to chunk_tokens already, so LangChain need not tokenize them again to split long ones
+        return OpenAIEmbeddings(api_key=api_key, model=cfg.embedding_model, dimensions=cfg.embedding_dimensions,
+                                chunk_size=cfg.embed_batch_size, check_embedding_ctx_length=False)
+    if backend == "local":
+        return LocalEmbeddings(dimensions=cfg.embedding_dimensions)
+    raise ValueError(f"Unknown embedding backend '{backend}', expected one of {BACKENDS}")
+
+def create_embeddings(api_key=None):
+    """
+    Returns the embedding function of config.embedding_backend behind the persistent
+    embedding cache.
+    """
+    settings = embedding_settings()
+    return CachedEmbeddings(create_embedding_function(api_key=api_key),
+                            embedding_model_key(settings["model"], settings["dimensions"]))
+
+def collection_metadata(dimension):
+    """
+    Chroma metadata recording what embeds a new collection.
+    """
+    settings = embedding_settings()
+    return {"embedding_backend": settings["backend"], "embedding_model": settings["model"], "embedding_dimension": dimension}
+
+def check_collection_embedding(collection_name, metadata, dimension):
+    """
+    Raises ValueError if a collection was built by another backend or model than the
+    current settings, or holds vectors of another dimension. Collections built before
+    the metadata was recorded are not checked.
+    """
+    metadata = metadata or {}
+    if "embedding_backend" not in metadata:
+        return
+    settings = embedding_settings()
+    built_with = (metadata["embedding_backend"], metadata["embedding_model"], metadata["embedding_dimension"])
+    if built_with != (settings["backend"], settings["model"], dimension):
+        raise ValueError(
+            f"The {collection_name} collection was built with the {built_with[0]} embedding model {built_with[1]} "
+            f"({built_with[2]} dimensions), but the {settings['backend']} model {settings['model']} produces "
+            f"{dimension} dimensions. Run populate_vectordb.py to rebuild the database."
+        )
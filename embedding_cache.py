@@ -0,0 +1,192 @@
+import asyncio
+import atexit
+import contextvars
+import hashlib
+import sqlite3
+import threading
+import time
+import unicodedata
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+import config as cfg
+
+# Whether the last embed_query call of the current thread or asyncio task was a cache hit
+_query_hit = contextvars.ContextVar("query_hit", default=None)
+
+def normalize_text(text):
+    """
+    Normalizes text so trivially different inputs (unicode forms, whitespace) share a cache entry.
+    """
+    return " ".join(unicodedata.normalize('NFC', text).split())
+
+def embedding_model_key(model, dimensions=None):
+    """
+    Cache namespace of an embedding model; shortened embeddings are cached apart from full ones.
+    """
+    return f"{model}:{dimensions}" if dimensions else model
+
+def cache_key(model, text):
+    return hashlib.sha256(f"{model}\0{normalize_text(text)}".encode('utf-8')).hexdigest()
+
+class CachedEmbeddings(Embeddings):
+    """
+    Wraps an embedding function with a persistent SQLite cache keyed by (model, text hash).
+    Vectors are stored as float32 blobs, the least recently used entries are evicted once
+    the cache holds more than max_entries vectors, and hits and misses are counted.
+
+    Hits only read the database: their use times are kept in memory and written in
+    batches. The number of rows is kept in memory too and only counted again before
+    evicting.
+    """
+    touch_batch_size = 256  # Hits whose use time is kept in memory before it is written
+    touch_max_seconds = 60  # Max time a use time stays unwritten
+    evict_slack = 0.1  # Share of max_entries evicted beyond the overflow, so evictions are rare
+
+    def __init__(self, embeddings, model, path=None, max_entries=None):
+        self.embeddings = embeddings
+        self.model = model
+        self.max_entries = max_entries or cfg.embedding_cache_max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path or cfg.embedding_cache_path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+        self._conn.commit()
+        # Rows in the cache, counted again before evicting as other processes share the file
+        self._count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        self._touched = {}  # Key -> last use time of hits not written yet
+        self._touched_since = time.time()
+        atexit.register(self.flush)
+
+    def _lookup(self, keys):
+        with self._lock:
+            found = {}
+            unique_keys = list(dict.fromkeys(keys))
+            for i in range(0, len(unique_keys), 500):
+                batch = unique_keys[i:i + 500]
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(batch))})", batch
+                ).fetchall()
+                found.update((key, np.frombuffer(vector, dtype=np.float32).tolist()) for key, vector in rows)
+            if found:
+                now = time.time()
+                self._touched.update((key, now) for key in found)
+                if len(self._touched) >= self.touch_batch_size or now - self._touched_since >= self.touch_max_seconds:
+                    self._write_touched()
+                    self._conn.commit()
+            return found
+
+    def _write_touched(self):
+        # Called with the lock held; the caller commits
+        if self._touched:
+            self._conn.executemany(
+                "UPDATE embeddings SET last_used = ? WHERE key = ?", [(now, key) for key, now in self._touched.items()]
+            )
+            self._touched = {}
+        self._touched_since = time.time()
+
+    def flush(self):
+        """
+        Writes the use times of recent hits, e.g. before the process exits.
+        """
+        with self._lock:
+            self._write_touched()
+            self._conn.commit()
+
+    def _store(self, items):
+        with self._lock:
+            now = time.time()
+            # Texts are only stored after a miss; one another process stored meanwhile is kept
+            inserted = self._conn.executemany(
+                "INSERT OR IGNORE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)",
+                [(key, np.asarray(vector, dtype=np.float32).tobytes(), now) for key, vector in items],
+            ).rowcount
+            self._count += max(inserted, 0)
+            self._write_touched()
+            if self._count > self.max_entries:
+                # Eviction goes by the use times, so they are written first (above)
+                self._count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+                overflow = self._count - self.max_entries
+                if overflow > 0:
+                    overflow += int(self.max_entries * self.evict_slack)
+                    self._conn.execute(
+                        "DELETE FROM embeddings WHERE key IN (SELECT key FROM embeddings ORDER BY last_used LIMIT ?)",
+                        (overflow,),
+                    )
+                    self._count -= overflow
+            self._conn.commit()
+
+    def embed_documents(self, texts):
+        keys = [cache_key(self.model, text) for text in texts]
+        cached = self._lookup(keys)
+
+        # Embed each missing text once, even if it appears several times in the batch
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in cached and key not in missing:
+                missing[key] = text
+        if missing:
+            vectors = self.embeddings.embed_documents(list(missing.values()))
+            new_items = list(zip(missing.keys(), vectors))
+            self._store(new_items)
+            cached.update(new_items)
+
+        with self._lock:
+            self.misses += len(missing)
+            self.hits += len(texts) - len(missing)
+        return [cached[key] for key in keys]
+
+    def embed_query(self, text):
+        key = cache_key(self.model, text)
+        cached = self._lookup([key])
+        _query_hit.set(key in cached)
+        if key in cached:
+            with self._lock:
+                self.hits += 1
+            return cached[key]
+
+        vector = self.embeddings.embed_query(text)
+        self._store([(key, vector)])
+        with self._lock:
+            self.misses += 1
+        return vector
+
+    async def aembed_query(self, text):
+        """
+        Async embed_query: the cache is read and written on a worker thread and misses are
+        embedded with the async client of the wrapped embeddings.
+        """
+        key = cache_key(self.model, text)
+        cached = await asyncio.to_thread(self._lookup, [key])
+        _query_hit.set(key in cached)
+        if key in cached:
+            with self._lock:
+                self.hits += 1
+            return cached[key]
+
+        vector = await self.embeddings.aembed_query(text)
+        await asyncio.to_thread(self._store, [(key, vector)])
+        with self._lock:
+            self.misses += 1
+        return vector
+
+    def last_query_hit(self):
+        """
+        Returns whether the last query embedded by the current thread or asyncio task was
+        served from the cache.
+        """
+        return _query_hit.get()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
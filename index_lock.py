@@ -0,0 +1,68 @@
+"""
+Reader/writer lock of the on-disk index (Chroma database, lexical and quantized indexes
+and manifest), shared by the processes that use it. populate_vectordb holds it
+exclusively while it writes an update it has already embedded, and each chatbot
+request holds it shared once for all of its retrieval, so no request sees a
+half-written update or mixes two versions of the index. Reads never wait for each
+other.
+
+populate_vectordb also holds the update lock for a whole run, so two runs never embed
+and write over each other; searches never wait for it.
+
+The locks are advisory flocks on config.index_lock_path and config.index_update_lock_path.
+They are no-ops on platforms without fcntl (Windows).
+"""
+import asyncio
+import os
+from contextlib import asynccontextmanager, contextmanager
+
+import config as cfg
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+class LockBusy(Exception):
+    """
+    Raised by a non-blocking lock that another process holds.
+    """
+
+@contextmanager
+def file_lock(path, exclusive=False, blocking=True):
+    if fcntl is None:
+        yield
+        return
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "a") as f:
+        flags = fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH
+        try:
+            fcntl.flock(f, flags if blocking else flags | fcntl.LOCK_NB)
+        except BlockingIOError as e:
+            raise LockBusy(f"{path} is locked by another process") from e
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+def index_read_lock():
+    return file_lock(cfg.index_lock_path)
+
+def index_write_lock():
+    return file_lock(cfg.index_lock_path, exclusive=True)
+
+@asynccontextmanager
+async def async_index_read_lock():
+    """
+    index_read_lock for coroutines; the lock is waited for on a worker thread, so the
+    event loop keeps serving other requests meanwhile.
+    """
+    lock = index_read_lock()
+    await asyncio.to_thread(lock.__enter__)
+    try:
+        yield
+    finally:
+        lock.__exit__(None, None, None)
+
+def index_update_lock():
+    return file_lock(cfg.index_update_lock_path, exclusive=True)
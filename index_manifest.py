@@ -0,0 +1,80 @@
+import hashlib
+import json
+import os
+
+# The manifest lives next to the Chroma files so that wiping the database also resets it
+MANIFEST_FILE = "index_manifest.json"
+
+def manifest_path(db_path):
+    return os.path.join(db_path, MANIFEST_FILE)
+
+def load_manifest(db_path):
+    """
+    Loads the manifest of indexed files and chunks, or returns None if the database
+    was not built incrementally yet.
+    """
+    path = manifest_path(db_path)
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def save_manifest(db_path, manifest):
+    """
+    Writes the manifest atomically so readers never see a partially written file.
+    """
+    os.makedirs(db_path, exist_ok=True)
+    path = manifest_path(db_path)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, path)
+
+def get_index_stamp(db_path):
+    """
+    Cheap change marker for the on-disk index: the modification time of the manifest,
+    which is rewritten at the end of every populate_vectordb run that changed something.
+    """
+    try:
+        return os.stat(manifest_path(db_path)).st_mtime_ns
+    except FileNotFoundError:
+        return 0
+
+def new_manifest():
+    return {"files": {}, "collections": {}}
+
+def content_hash(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+def file_hash(file_path, block_size=1 << 20):
+    """
+    Hashes a file's bytes without loading it into memory at once.
+    """
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def chunk_id(source, chunk_text, occurrence=0):
+    """
+    Builds a stable chunk ID from the source file and the chunk content, so unchanged
+    chunks keep their ID across rebuilds. Repeated identical chunks within one source
+    are told apart by their occurrence number.
+    """
+    return hashlib.sha256(f"{source}\0{content_hash(chunk_text)}\0{occurrence}".encode('utf-8')).hexdigest()[:32]
+
+def collection_version(chunk_ids):
+    """
+    Derives a version string for a collection from the set of chunk IDs it holds.
+    """
+    return hashlib.sha256("\n".join(sorted(chunk_ids)).encode('utf-8')).hexdigest()[:16]
+
+def get_index_version(db_path, collection_name):
+    """
+    Returns the current version of a collection, or None if it is not in the manifest.
+    """
+    manifest = load_manifest(db_path)
+    if manifest is None:
+        return None
+    return manifest["collections"].get(collection_name, {}).get("version")
@@ -0,0 +1,102 @@
+import gzip
+import json
+import math
+import os
+import re
+from collections import Counter, defaultdict
+
+# BM25 parameters
+K1 = 1.5
+B = 0.75
+
+TOKEN_PATTERN = re.compile(r"\w+")
+
+def tokenize(text):
+    return TOKEN_PATTERN.findall(text.lower())
+
+def lexical_index_path(db_path, collection_name):
+    return os.path.join(db_path, "lexical", f"{collection_name}.json.gz")
+
+class LexicalIndex:
+    """
+    BM25 inverted index over the chunks of one collection. Postings are stored per term as
+    parallel lists of document positions and term frequencies.
+    """
+
+    def __init__(self, ids, lengths, postings):
+        self.ids = ids
+        self.lengths = lengths
+        self.postings = postings
+        self.avg_length = sum(lengths) / len(lengths) if lengths else 0.0
+
+    @classmethod
+    def build(cls, ids, texts):
+        lengths = []
+        postings = defaultdict(lambda: ([], []))
+        for position, text in enumerate(texts):
+            tokens = tokenize(text)
+            lengths.append(len(tokens))
+            for term, frequency in Counter(tokens).items():
+                positions, frequencies = postings[term]
+                positions.append(position)
+                frequencies.append(frequency)
+        return cls(list(ids), lengths, dict(postings))
+
+    def search(self, query, k):
+        """
+        Returns up to k (chunk ID, BM25 score) pairs, best first.
+        """
+        scores = defaultdict(float)
+        num_docs = len(self.ids)
+        for term in set(tokenize(query)):
+            if term not in self.postings:
+                continue
+            positions, frequencies = self.postings[term]
+            idf = math.log(1 + (num_docs - len(positions) + 0.5) / (len(positions) + 0.5))
+            for position, frequency in zip(positions, frequencies):
+                norm = K1 * (1 - B + B * self.lengths[position] / self.avg_length)
+                scores[position] += idf * frequency * (K1 + 1) / (frequency + norm)
+
+        best = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+        return [(self.ids[position], score) for position, score in best]
+
+    def document_share(self, term):
+        """
+        Returns the share of the chunks that contain a term, or None if no chunk does.
+        """
+        if term not in self.postings or not self.ids:
+            return None
+        return len(self.postings[term][0]) / len(self.ids)
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with gzip.open(tmp_path, 'wt', encoding='utf-8') as f:
+            json.dump({"ids": self.ids, "lengths": self.lengths, "postings": self.postings}, f, separators=(',', ':'))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            data = json.load(f)
+        return cls(data["ids"], data["lengths"], data["postings"])
+
+def load_lexical_index(db_path, collection_name):
+    """
+    Loads the lexical index of a collection, or returns None if it was never built.
+    """
+    path = lexical_index_path(db_path, collection_name)
+    if not os.path.exists(path):
+        return None
+    return LexicalIndex.load(path)
+
+def reciprocal_rank_fusion(rankings, k=60):
+    """
+    Fuses several ranked lists of IDs into one, scoring each ID by the sum of 1 / (k + rank).
+    Returns (ID, fused score) pairs, best first.
+    """
+    scores = defaultdict(float)
+    for ranking in rankings:
+        for rank, item in enumerate(ranking, start=1):
+            scores[item] += 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
@@ -0,0 +1,155 @@
+import json
+import os
+import re
+import zlib
+from collections import defaultdict, deque
+
+import numpy as np
+
+# MinHash / LSH parameters: 32 bands of 4 rows make pairs with a Jaccard similarity of 0.8
+# candidates with near certainty, and candidates are then checked against the threshold
+NUM_PERM = 128
+BANDS = 32
+SHINGLE_WORDS = 5  # Texts are compared on overlapping 5-word shingles
+MIN_WORDS = 8  # Shorter texts (headings, contact lines, ...) are never treated as duplicates
+DEFAULT_THRESHOLD = 0.8  # Min estimated Jaccard similarity to count as a near duplicate
+
+PRIME = (1 << 31) - 1
+_random = np.random.RandomState(20240601)  # Fixed seed: signatures are persisted between runs
+PERM_A = _random.randint(1, PRIME, size=NUM_PERM).astype(np.uint64)
+PERM_B = _random.randint(0, PRIME, size=NUM_PERM).astype(np.uint64)
+
+WORD_PATTERN = re.compile(r"\w+")
+
+def shingles(lines):
+    """
+    Returns the hashed word shingles of a text, given as a string or an iterable of lines
+    so large files can be streamed, and the number of words.
+    """
+    if isinstance(lines, str):
+        lines = [lines]
+    window = deque(maxlen=SHINGLE_WORDS)
+    hashes = set()
+    words = 0
+    for line in lines:
+        for word in WORD_PATTERN.findall(line.lower()):
+            window.append(word)
+            words += 1
+            if len(window) == SHINGLE_WORDS:
+                hashes.add(zlib.crc32(" ".join(window).encode('utf-8')))
+    if 0 < words < SHINGLE_WORDS:
+        hashes.add(zlib.crc32(" ".join(window).encode('utf-8')))
+    return hashes, words
+
+def minhash(hashes):
+    values = np.fromiter(hashes, dtype=np.uint64, count=len(hashes))
+    return ((values[:, None] * PERM_A + PERM_B) % PRIME).min(axis=0).astype(np.uint32)
+
+class NearDuplicateIndex:
+    """
+    Persistent MinHash index with LSH banding. Texts are registered per document (a file
+    or release URL) and scope ("release", "passage", ...); a new text is a near
+    duplicate when a text of another document in the same scope has an estimated
+    Jaccard similarity of at least threshold. Keeps track of which documents dropped
+    duplicates of which, so they can be re-checked when the original changes.
+    """
+
+    def __init__(self, path=None, threshold=None):
+        self.path = path
+        self.threshold = threshold or DEFAULT_THRESHOLD
+        self.entries = []  # (document, scope, key) per signature, None once removed
+        self.signatures = []
+        self.buckets = defaultdict(list)
+        self.dependents = defaultdict(set)  # Document -> documents that dropped duplicates of it
+        self.checked = 0
+        self.removed = defaultdict(int)  # Duplicates dropped per scope
+        self.removed_chars = 0
+
+        if path and os.path.exists(path):
+            with np.load(path) as data:
+                entries = json.loads(str(data["entries"]))
+                for entry, signature in zip(entries, data["signatures"]):
+                    self._add(tuple(entry), signature)
+                self.dependents.update((doc, set(docs)) for doc, docs in json.loads(str(data["dependents"])).items())
+
+    def _bands(self, scope, signature):
+        rows = NUM_PERM // BANDS
+        for band in range(BANDS):
+            yield scope, band, signature[band * rows:(band + 1) * rows].tobytes()
+
+    def _add(self, entry, signature):
+        position = len(self.entries)
+        self.entries.append(entry)
+        self.signatures.append(signature)
+        for bucket in self._bands(entry[1], signature):
+            self.buckets[bucket].append(position)
+
+    def find(self, document, scope, signature):
+        """
+        Returns the (document, scope, key) entry of the closest near duplicate from another
+        document, or None.
+        """
+        best, best_similarity = None, self.threshold
+        candidates = {position for bucket in self._bands(scope, signature) for position in self.buckets.get(bucket, ())}
+        for position in candidates:
+            entry = self.entries[position]
+            if entry is None or entry[0] == document:
+                continue
+            similarity = float(np.mean(self.signatures[position] == signature))
+            if similarity >= best_similarity:
+                best, best_similarity = entry, similarity
+        return best
+
+    def check(self, document, key, text, scope="passage"):
+        """
+        Returns the entry that text near-duplicates, or registers text under document and
+        key and returns None. text can be a string or an iterable of lines.
+        """
+        hashes, words = shingles(text)
+        if words < MIN_WORDS:
+            return None
+        self.checked += 1
+        signature = minhash(hashes)
+        duplicate = self.find(document, scope, signature)
+        if duplicate is None:
+            self._add((document, scope, key), signature)
+            return None
+
+        self.removed[scope] += 1
+        self.removed_chars += len(text) if isinstance(text, str) else 0
+        self.dependents[duplicate[0]].add(document)
+        return duplicate
+
+    def remove_document(self, document):
+        """
+        Forgets the texts of a document before it is re-checked or deleted. Returns the
+        documents that dropped duplicates of it and may now have to keep them.
+        """
+        for position, entry in enumerate(self.entries):
+            if entry is not None and entry[0] == document:
+                self.entries[position] = None
+        for documents in self.dependents.values():
+            documents.discard(document)
+        return self.dependents.pop(document, set())
+
+    def save(self, path=None):
+        path = path or self.path
+        live = [position for position, entry in enumerate(self.entries) if entry is not None]
+        signatures = np.array([self.signatures[position] for position in live], dtype=np.uint32).reshape(-1, NUM_PERM)
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            np.savez_compressed(
+                f,
+                entries=json.dumps([self.entries[position] for position in live]),
+                signatures=signatures,
+                dependents=json.dumps({doc: sorted(docs) for doc, docs in self.dependents.items() if docs}),
+            )
+        os.replace(tmp_path, path)
+
+    def stats(self):
+        return {
+            "checked": self.checked,
+            "removed": dict(self.removed),
+            "removed_chars": self.removed_chars,
+        }
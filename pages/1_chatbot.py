@@ -1,15 +1,9 @@
-import os
+import hashlib
+import logging
 import sys
+import tempfile
 
 import streamlit as st
-from openai import OpenAI
-
-# Data handling imports
-import csv
-
-# Utility imports
-from datetime import datetime
-import time
 
 # Configuration imports
 import config as cfg
@@ -23,101 +17,49 @@ else:
     load_dotenv('.env')
 
 # OpenAI and LangChain imports
-from langchain_chroma import Chroma
-from langchain_openai import OpenAIEmbeddings
-from fpdf import FPDF
-
-# Define the chatbot model
-chatbot_model = "gpt-3.5-turbo"
-
-# Initialize embeddings with OpenAI's text-embedding-3-large model
-embeddings = OpenAIEmbeddings(model="text-embedding-3-large")
-
-# Define the persist directory for the Chroma database
-persist_directory = "./chroma_db"
-
-# Create a Chroma instance for annual and quarterly collections
-jnj_vectordb = Chroma(persist_directory=persist_directory, embedding_function=embeddings, collection_name='jnj')
-
-# Function to find relevant entries from the Chroma database
-def find_relevant_entries_from_chroma_db(query, selected_collection):
-    if selected_collection == "JNJ":
-        vectordb = jnj_vectordb
-
-    results = vectordb.similarity_search_with_score(query, k=30)
+from conversation_memory import ConversationMemory
+from pdf_export import pdf_bytes, write_pdf_zip
+from resources import get_embeddings, get_openai_client, get_collection_options
+from retrieval import search_collections
+from query_pipeline import answer_query, run_sync, iterate_sync
+from tracing import Trace
+
+def get_selected_collections(selected_collection):
+    return get_collection_options().get(selected_collection, [])
+
+# Function to find relevant entries from the Chroma database; the query is embedded at most
+# once, searched in every selected collection in parallel and fused with lexical (BM25) hits
+def find_relevant_entries_from_chroma_db(query, selected_collection, query_embedding=None):
+    results = search_collections(query, get_selected_collections(selected_collection), query_embedding)
     
     for doc, score in results:
-        print(f"Similarity: {score:.3f}")
+        print(f"Similarity: {score:.3f}" if score is not None else "Similarity: lexical match")
         print(f"Content: {doc.page_content}")
         print(f"Metadata: {doc.metadata}")
         print("---")
+    logging.debug(f"Embedding cache: {get_embeddings().stats()}")
 
     return results
 
-# Function to generate a GPT response
-def generate_gpt_response(user_query, chroma_result, client):
-    current_year = datetime.now().year
-    last_quarter = 2
-
-    combined_prompt = f"""User query: {user_query}
-
-    You are a employee at ALCON Inc to find new inovation from different company. Generate a report on the competitors of what's they have doing. Write as long as possible, generate a comprehensive report. Add bullet points also if needed
-
-    Please provide an augmented response considering the following related information from our database:
-    {chroma_result}
-
-    The current year is {current_year} and the last available quarter is {last_quarter}. 
-
-    Format your response as follows:
-    **Augmented Response**
-
-    [Your augmented response here]
-    """
-    response = client.chat.completions.create(
-        model=chatbot_model,
-        messages=[
-            {"role": "system", "content": "You are a helpful assistant capable of providing context-aware responses."},
-            {"role": "user", "content": combined_prompt}
-        ]
-    )
-
-    return response.choices[0].message.content
-
-def log_response_time(query, response_time, is_first_prompt):
-    csv_file = 'responses.csv'
-    file_exists = os.path.isfile(csv_file)
-
-    with open(csv_file, 'a', newline='') as file:
-        writer = csv.writer(file)
-        if not file_exists:
-            writer.writerow(['Timestamp', 'Query', 'Response Time (seconds)', 'Is First Prompt'])
-        writer.writerow([datetime.now(), query, f"{response_time:.2f}", "Yes" if is_first_prompt else "No"])
-
-def query_interface(user_query, is_first_prompt, selected_collection, client):
-    start_time = time.time()
-
-    chroma_result = find_relevant_entries_from_chroma_db(user_query, selected_collection)
-    gpt_response = generate_gpt_response(user_query, str(chroma_result), client)
-
-    logging_response_time = True
-    if logging_response_time:
-        end_time = time.time()
-        response_time = end_time - start_time
-
-        log_response_time(user_query, response_time, is_first_prompt)
-
-    return gpt_response
-
-def create_pdf(content):
-    pdf = FPDF()
-    pdf.add_page()
-    pdf.set_font("Arial", size=12)
-    pdf.multi_cell(0, 10, content)
-    return pdf
-
+# Function to answer a question through the shared async query pipeline; the script
+# thread only waits for the result. With the session's memory, the answer follows up on
+# the earlier conversation
+def query_interface(user_query, is_first_prompt, selected_collection, client, memory=None):
+    trace = Trace("query", collection=selected_collection, is_first_prompt=is_first_prompt)
+    return run_sync(answer_query(user_query, get_selected_collections(selected_collection), client.api_key, trace=trace,
+                                 memory=memory))
+
+# Function to stream a GPT response; retrieval runs before this returns, generation
+# happens while the returned generator is consumed
+def query_interface_stream(user_query, is_first_prompt, selected_collection, client, memory=None):
+    trace = Trace("query_stream", collection=selected_collection, is_first_prompt=is_first_prompt)
+    stream = run_sync(answer_query(user_query, get_selected_collections(selected_collection), client.api_key,
+                                   stream=True, trace=trace, memory=memory))
+    return iterate_sync(stream)
+
+# The PDF of a response is rendered once and served from the cache on later reruns
 def download_pdf_button(response):
-    pdf = create_pdf(response)
-    pdf_output = pdf.output(dest='S').encode('latin1')
+    pdf_output = pdf_bytes(response)
     st.download_button(
         label="Download Response as PDF",
         data=pdf_output,
@@ -125,6 +67,34 @@ def download_pdf_button(response):
         mime="application/pdf"
     )
 
+# Function to offer every response of the chat as one zip of PDFs; the zip is only built
+# when asked for, streamed to a temporary file and kept until the responses change
+def download_all_button(messages):
+    responses = [message["content"] for message in messages if message["role"] == "assistant" and message["content"]]
+    if len(responses) < 2:
+        return
+    key = hashlib.sha256("\0".join(responses).encode("utf-8")).hexdigest()
+    if st.session_state.get("responses_zip", (None, None))[0] != key:
+        if not st.button("Prepare All Responses (zip)"):
+            return
+        reports = ((f"chatbot_response_{number}.pdf", response) for number, response in enumerate(responses, 1))
+        zip_file = tempfile.TemporaryFile()
+        write_pdf_zip(reports, zip_file)
+        zip_file.flush()
+        discard_responses_zip()
+        st.session_state.responses_zip = (key, zip_file)
+    st.download_button(
+        label="Download All Responses (zip)",
+        data=st.session_state.responses_zip[1].raw,  # The button reads unbuffered files from the start
+        file_name="chatbot_responses.zip",
+        mime="application/zip"
+    )
+
+def discard_responses_zip():
+    _, zip_file = st.session_state.pop("responses_zip", (None, None))
+    if zip_file is not None:
+        zip_file.close()
+
 def display_chatbot():
     st.title("💬 Chatbot")
     st.write(
@@ -134,11 +104,14 @@ def display_chatbot():
     api_key = st.text_input("Enter your OpenAI API key:", type="password")
 
     if api_key:
-        client = OpenAI(api_key=api_key)
-        selected_collection = st.radio("Select Time Period (Will Work on other companies)", ("JNJ","RXSight", "Zeiss IOLs"))
+        client = get_openai_client(api_key)
+        selected_collection = st.radio("Select Competitor", list(get_collection_options()))
         
         if "messages" not in st.session_state:
             st.session_state.messages = []
+        # The displayed history grows with the chat; the prompt only gets the bounded memory
+        if "memory" not in st.session_state:
+            st.session_state.memory = ConversationMemory()
 
         for message in st.session_state.messages:
             with st.chat_message(message["role"]):
@@ -152,20 +125,38 @@ def display_chatbot():
                 st.markdown(safe_prompt) 
             st.session_state.messages.append({"role": "user", "content": prompt})
 
-            with st.spinner("Thinking..."):
-                is_first_prompt = len(st.session_state.messages) == 1
-                response = query_interface(prompt, is_first_prompt, selected_collection, client)
-
-            with st.chat_message("assistant"):
-                safe_response = response.replace('$', '\\$')
-                st.markdown(safe_response, unsafe_allow_html=True) 
+            is_first_prompt = len(st.session_state.messages) == 1
+            if cfg.stream_responses:
+                with st.chat_message("assistant"):
+                    with st.spinner("Thinking..."):
+                        stream = query_interface_stream(prompt, is_first_prompt, selected_collection, client,
+                                                        st.session_state.memory)
+
+                    # Render tokens as they arrive and keep the raw text for the history and PDF
+                    response_parts = []
+                    def render_stream():
+                        for text in stream:
+                            response_parts.append(text)
+                            yield text.replace('$', '\\$')
+                    st.write_stream(render_stream())
+                    response = "".join(response_parts)
+            else:
+                with st.spinner("Thinking..."):
+                    response = query_interface(prompt, is_first_prompt, selected_collection, client, st.session_state.memory)
+
+                with st.chat_message("assistant"):
+                    safe_response = response.replace('$', '\\$')
+                    st.markdown(safe_response, unsafe_allow_html=True) 
             st.session_state.messages.append({"role": "assistant", "content": response})
 
         if response:
             download_pdf_button(response)
+        download_all_button(st.session_state.messages)
 
         if st.button("Clear Chat History"):
             st.session_state.messages = []
+            st.session_state.memory = ConversationMemory()
+            discard_responses_zip()
             st.rerun()
     else:
         st.info("Please add your OpenAI API key to continue.", icon="🗝️")
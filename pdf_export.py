@@ -0,0 +1,166 @@
+"""
+PDF export of generated reports, shared by the chatbot's download buttons and the batch
+report runner. Reports are rendered from their Markdown (headings, bullet and numbered
+lists, **bold** and *italics*) with a Unicode TrueType font, config.pdf_fonts, and fallback fonts for
+scripts it lacks, such as Chinese and Japanese. Without any of the fonts the PDF uses
+the core Helvetica font, which only covers Latin-1.
+
+pdf_bytes() renders each distinct report once per process and serves repeated requests,
+e.g. every Streamlit rerun, from a cache keyed by the hash of the text. iter_pdf_zip()
+streams many reports as a zip archive, holding one rendered report in memory at a time,
+and write_pdf_zip() writes that stream to a file.
+"""
+import hashlib
+import io
+import os
+import re
+import threading
+import zipfile
+from collections import OrderedDict
+
+from fpdf import FPDF
+
+import config as cfg
+
+HEADING_SIZES = {1: 18, 2: 15, 3: 13}
+LIST_ITEM = re.compile(r"^(\s*)([-*+]|\d+[.)])\s+(.*)$")
+HEADING = re.compile(r"^(#{1,6})\s+(.*?)\s*#*$")
+NEEDS_FALLBACK = re.compile(r"[^\u0000-\u2e7f]")  # CJK and other scripts the body fonts lack
+# fpdf2 Markdown markers other than bold, which would otherwise turn "--" or "__" into formatting
+OTHER_MARKERS = re.compile(r"(__|--|~~)")
+ITALICS = re.compile(r"(?<![*\w])\*(?![\s*])([^*]+?)(?<!\s)\*(?![*\w])")
+STYLES = ("", "B", "I", "BI")
+
+def find_font(candidates):
+    return next((path for path in candidates if os.path.exists(path)), None)
+
+def add_fonts(pdf, content):
+    """
+    Adds the configured fonts that exist on this machine and returns the font family of
+    the body text. Fallback fonts, which are large, are only added for text that needs them.
+    """
+    regular = find_font(cfg.pdf_fonts["regular"])
+    if regular is None:
+        return None
+    bold = find_font(cfg.pdf_fonts["bold"]) or regular
+    for style in STYLES:
+        pdf.add_font("body", style, bold if "B" in style else regular)
+
+    if NEEDS_FALLBACK.search(content):
+        fallbacks = []
+        for number, path in enumerate(path for path in cfg.pdf_fonts["fallback"] if os.path.exists(path)):
+            family = f"fallback{number}"
+            pdf.add_font(family, "", path)
+            fallbacks.append(family)
+        if fallbacks:
+            # Used for bold and italic text as well, in the regular style
+            pdf.set_fallback_fonts(fallbacks, exact_match=False)
+    return "body"
+
+def markdown_line(text):
+    """
+    Converts a line of Markdown to fpdf2's inline markup: **bold** stays, *italics*
+    become __italics__, and fpdf2's other markers are escaped.
+    """
+    text = OTHER_MARKERS.sub(lambda match: "\\" + match.group(1), text)
+    return ITALICS.sub(r"__\1__", text)
+
+def render_markdown(pdf, family, content):
+    body_size = 11
+    for line in content.splitlines():
+        heading = HEADING.match(line)
+        item = LIST_ITEM.match(line)
+        if not line.strip():
+            pdf.ln(3)
+        elif heading:
+            level = len(heading.group(1))
+            pdf.set_font(family, "B", HEADING_SIZES.get(level, body_size + 1))
+            pdf.ln(2)
+            pdf.multi_cell(0, 8, markdown_line(heading.group(2)), markdown=True, new_x="LMARGIN", new_y="NEXT")
+            pdf.set_font(family, "", body_size)
+        elif item:
+            indent = 5 + 3 * min(len(item.group(1).expandtabs(4)) // 2, 4)
+            bullet = "-" if family == "helvetica" else "•"
+            marker = bullet if item.group(2) in "-*+" else item.group(2)
+            pdf.set_x(pdf.l_margin + indent)
+            pdf.cell(6, 6, marker)
+            pdf.multi_cell(0, 6, markdown_line(item.group(3)), markdown=True, new_x="LMARGIN", new_y="NEXT")
+        else:
+            pdf.multi_cell(0, 6, markdown_line(line), markdown=True, new_x="LMARGIN", new_y="NEXT")
+
+def create_pdf(content):
+    pdf = FPDF()
+    pdf.set_auto_page_break(True, margin=15)
+    pdf.add_page()
+    family = add_fonts(pdf, content)
+    if family is None:
+        # The core fonts only cover Latin-1; other characters (curly quotes, dashes) are replaced
+        content = content.encode('latin-1', 'replace').decode('latin-1')
+        family = "helvetica"
+    pdf.set_font(family, "", 11)
+    render_markdown(pdf, family, content)
+    return pdf
+
+_cache = OrderedDict()  # Hash of the report text -> PDF bytes, least recently used first
+_cache_lock = threading.Lock()
+
+def pdf_bytes(content):
+    """
+    Returns the PDF of a report, rendered once and then served from the cache.
+    """
+    key = hashlib.sha256(content.encode("utf-8")).hexdigest()
+    with _cache_lock:
+        if key in _cache:
+            _cache.move_to_end(key)
+            return _cache[key]
+    data = bytes(create_pdf(content).output())
+    with _cache_lock:
+        _cache[key] = data
+        while len(_cache) > cfg.pdf_cache_entries:
+            _cache.popitem(last=False)
+    return data
+
+class _ChunkBuffer(io.RawIOBase):
+    """
+    Write-only, unseekable file whose written bytes are taken out in chunks.
+    """
+
+    def __init__(self):
+        self.chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def take(self):
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+def iter_pdf_zip(reports, use_cache=True):
+    """
+    Yields a zip archive of PDFs in chunks, from (file name, report text) pairs. Each
+    report is rendered (or taken from the cache) and written out before the next one.
+    Without use_cache, e.g. for the reports of a batch, the rendered PDFs are not kept.
+    """
+    buffer = _ChunkBuffer()
+    # PDF content streams are compressed already
+    with zipfile.ZipFile(buffer, "w", compression=zipfile.ZIP_STORED) as archive:
+        for name, content in reports:
+            archive.writestr(name, pdf_bytes(content) if use_cache else bytes(create_pdf(content).output()))
+            yield buffer.take()
+    yield buffer.take()
+
+def write_pdf_zip(reports, file, use_cache=True):
+    """
+    Writes the zip archive of iter_pdf_zip() to a path or an open binary file.
+    """
+    if isinstance(file, (str, os.PathLike)):
+        with open(file, "wb") as f:
+            write_pdf_zip(reports, f, use_cache)
+        return
+    for chunk in iter_pdf_zip(reports, use_cache):
+        file.write(chunk)
@@ -1,13 +1,26 @@
 import os
 from dotenv import load_dotenv
 import logging
+import pickle
 import shutil
+import tempfile
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, ALL_COMPLETED, wait
+import numpy as np
 import streamlit as st
 import config as cfg
 from langchain_core.documents import Document
-from langchain_chroma import Chroma
-from langchain_openai import OpenAIEmbeddings
 import chromadb
+from answer_cache import AnswerCache
+from embedding_backends import create_embeddings, embedding_settings, collection_metadata, check_collection_embedding
+from chunking import iter_chunks, iter_lines, count_tokens
+from lexical_index import LexicalIndex, lexical_index_path
+from near_duplicates import NearDuplicateIndex
+from quantized_index import write_quantized_index, remove_quantized_index, quantized_index_paths
+from index_lock import index_update_lock, index_write_lock
+from index_manifest import (load_manifest, save_manifest, new_manifest, file_hash, content_hash, chunk_id,
+                            collection_version)
 
 # Load environment variables
 deploy = cfg.deploy
@@ -19,77 +32,208 @@ else:
 
 # Document locations (relative to this py file)
 folder_paths = ['data']
-DB_PATH = "./chroma_db"  # Centralized path for the database
+DB_PATH = cfg.db_path  # Centralized path for the database
 
 # Set up logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-def chunk_text(text, chunk_size=500):
+def list_txt_files(folders):
     """
-    Splits the text into chunks of specified size.
+    Yields the name and path of every TXT file in the specified folders. Files in a
+    subfolder (e.g. data/jnj/<release>.txt) are named "<subfolder>/<file>".
     """
-    return [text[i:i + chunk_size] for i in range(0, len(text), chunk_size)]
-
-def process_txt_files(folders):
-    """
-    Process TXT files from specified folders and convert them to a list of LangChain documents.
-    Each file is treated as a separate document.
-    """
-    all_docs = []
     for folder in folders:
         if not os.path.exists(folder):
             logging.warning(f"Folder '{folder}' does not exist.")
             continue
-        
+
         logging.info(f"Processing folder: {folder}")
-        txt_files = [f for f in os.listdir(folder) if f.endswith('.txt')]
-        
-        for file in txt_files:
-            file_path = os.path.join(folder, file)
-            logging.info(f"Processing TXT file: {file_path}")
-            
-            # Read TXT file
-            with open(file_path, 'r', encoding='utf-8') as f:
-                content = f.read()
-            
-            # Chunk the content
-            chunks = chunk_text(content)
-            for i, chunk in enumerate(chunks):
-                metadata = {
-                    "source": file,
-                    "chunk": i
-                }
-                doc = Document(page_content=chunk, metadata=metadata)
-                all_docs.append((file, doc))
-            
-            logging.info(f"Processed TXT file: {file}")
-    
-    logging.info(f"Total TXT documents created: {len(all_docs)}")
-    return all_docs
-
-def insert_into_vector_db(txt_docs):
-    """
-    Inserts documents into vector databases for TXT data.
+        for entry in sorted(os.listdir(folder)):
+            entry_path = os.path.join(folder, entry)
+            if os.path.isdir(entry_path):
+                for file in sorted(os.listdir(entry_path)):
+                    if file.endswith('.txt'):
+                        yield f"{entry}/{file}", os.path.join(entry_path, file)
+            elif entry.endswith('.txt'):
+                yield entry, entry_path
+
+def get_collection_name(file):
+    # One collection per competitor: data/jnj.txt and the releases in data/jnj/ both go to "jnj"
+    return file.split('/')[0].replace('.txt', '')
+
+def near_duplicates_path():
+    return os.path.join(DB_PATH, "near_duplicates.npz")
+
+def load_txt_file(file, file_path, near_duplicates=None):
+    """
+    Streams the chunks of a TXT file as LangChain documents with stable chunk IDs.
+    The file is read incrementally, so memory does not grow with the file size.
+    With a near-duplicate index, files and chunks that near-duplicate those of other
+    files are skipped before they are embedded.
+    """
+    logging.info(f"Processing TXT file: {file_path}")
+
+    if near_duplicates is not None:
+        duplicate = near_duplicates.check(file, file, (line for _, line, _, _ in iter_lines(file_path)), scope="release")
+        if duplicate:
+            logging.info(f"Skipping {file}: near duplicate of {duplicate[0]}")
+            return
+
+    occurrences = defaultdict(int)
+    for i, chunk in enumerate(iter_chunks(file_path)):
+        metadata = {
+            "source": file,
+            "chunk": i,
+            "title": chunk["title"],
+            "start": chunk["start"],
+            "end": chunk["end"],
+        }
+        text_hash = content_hash(chunk["text"])
+        doc_id = chunk_id(file, chunk["text"], occurrences[text_hash])
+        occurrences[text_hash] += 1
+        if near_duplicates is not None and near_duplicates.check(file, doc_id, chunk["text"]):
+            continue
+        yield Document(id=doc_id, page_content=chunk["text"], metadata=metadata)
+
+    logging.info(f"Processed TXT file: {file}")
+
+def process_txt_files(folders, near_duplicates=None):
+    """
+    Process TXT files from specified folders and stream them as (file, document) pairs.
+    Each file is treated as a separate document.
+    """
+    for file, file_path in list_txt_files(folders):
+        for doc in load_txt_file(file, file_path, near_duplicates):
+            yield file, doc
+
+def embed_batch(embeddings, batch):
+    """
+    Embeds a batch of documents with a single embeddings request.
+    """
+    vectors = embeddings.embed_documents([doc.page_content for doc in batch])
+    return batch, np.asarray(vectors, dtype=np.float32)
+
+def upsert_batch(collection, batch, vectors):
+    """
+    Writes an embedded batch to a Chroma collection in one bulk upsert.
+    """
+    collection.upsert(
+        ids=[doc.id for doc in batch],
+        embeddings=vectors,
+        documents=[doc.page_content for doc in batch],
+        metadatas=[doc.metadata for doc in batch],
+    )
+    return len(batch)
+
+class StagedWrites:
+    """
+    Chunk writes prepared before the index lock is taken: embedded batches to upsert and
+    position metadata to update, in the order they were made. They are spooled to a
+    temporary file, so a full rebuild does not hold every vector in memory.
+    """
+
+    def __init__(self):
+        self.file = tempfile.TemporaryFile()
+
+    def add(self, collection_name, docs, vectors=None):
+        # Without vectors, only the metadata of the documents is updated
+        pickle.dump((collection_name, docs, vectors), self.file, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def __iter__(self):
+        self.file.seek(0)
+        while True:
+            try:
+                yield pickle.load(self.file)
+            except EOFError:
+                return
+
+    def close(self):
+        self.file.close()
+
+def embed_into_staging(txt_docs, staged):
+    """
+    Embeds documents for insertion into the vector databases and adds them to staged.
+    Documents are consumed as a stream and grouped into per-collection batches that stay
+    within the request size and token limits of the embeddings API. Batches are embedded
+    by a pool of workers with a bounded number of requests in flight. Nothing is written
+    to the database yet, so chatbot searches carry on meanwhile.
     """
     try:
-        embeddings = OpenAIEmbeddings(api_key=OPENAI_API_KEY, model='text-embedding-3-large')
-
-        client = chromadb.PersistentClient(path=DB_PATH)  # Use centralized DB_PATH
-        
-        # Process and insert TXT documents into separate collections
-        for file, doc in txt_docs:
-            collection_name = file.replace('.txt', '')
-            collection = client.get_or_create_collection(
-                name=collection_name,
-                metadata={'hnsw:space': 'cosine'}
-            )
-            vectorstore = Chroma(
-                client=client,
-                collection_name=collection_name,
-                embedding_function=embeddings,
-            )
-            vectorstore.add_documents(documents=[doc])
-            logging.info(f"Inserted document from {file} into the {collection_name} vector store")
+        start_time = time.perf_counter()
+        embeddings = create_embeddings(api_key=OPENAI_API_KEY)
+
+        batches = defaultdict(list)
+        batch_tokens = defaultdict(int)
+        embedded = 0
+        in_flight = {}  # Future -> collection name
+
+        def stage_done(return_when):
+            nonlocal embedded
+            done, _ = wait(in_flight, return_when=return_when)
+            for future in done:
+                batch, vectors = future.result()
+                staged.add(in_flight.pop(future), batch, vectors)
+                embedded += len(batch)
+
+        with ThreadPoolExecutor(max_workers=cfg.embed_max_workers) as executor:
+            def submit(collection_name):
+                # Keep at most embed_max_workers batch requests in flight
+                if len(in_flight) >= cfg.embed_max_workers:
+                    stage_done(FIRST_COMPLETED)
+                in_flight[executor.submit(embed_batch, embeddings, batches.pop(collection_name))] = collection_name
+                batch_tokens.pop(collection_name)
+
+            for file, doc in txt_docs:
+                collection_name = get_collection_name(file)
+                tokens = count_tokens(doc.page_content)
+                batch = batches[collection_name]
+                if batch and (len(batch) >= cfg.embed_batch_size or batch_tokens[collection_name] + tokens > cfg.embed_batch_tokens):
+                    submit(collection_name)
+                batches[collection_name].append(doc)
+                batch_tokens[collection_name] += tokens
+
+            for collection_name in list(batches):
+                submit(collection_name)
+            if in_flight:
+                stage_done(ALL_COMPLETED)
+
+        elapsed = time.perf_counter() - start_time
+        logging.info(f"Embedded {embedded} chunks in {elapsed:.2f}s ({embedded / max(elapsed, 1e-9):.1f} chunks/sec)")
+        logging.info(f"Embedding cache: {embeddings.stats()}")
+        return embedded
+    except Exception as e:
+        logging.error(f"Error embedding documents for the vector store: {str(e)}")
+        raise
+
+def insert_into_vector_db(client, staged):
+    """
+    Writes staged chunks into the vector databases: each embedded batch is upserted in one
+    write and the metadata of moved chunks is updated in place. Called with the index
+    write lock held.
+    """
+    try:
+        collections = {}
+        inserted = defaultdict(int)
+        for collection_name, batch, vectors in staged:
+            if vectors is None:
+                client.get_collection(collection_name).update(
+                    ids=[doc.id for doc in batch],
+                    metadatas=[doc.metadata for doc in batch],
+                )
+                continue
+            # Created on the first upsert, when the dimension of the embeddings is known
+            if collection_name not in collections:
+                collection = client.get_or_create_collection(
+                    name=collection_name,
+                    metadata={'hnsw:space': 'cosine', **collection_metadata(vectors.shape[1])}
+                )
+                check_collection_embedding(collection_name, collection.metadata, vectors.shape[1])
+                collections[collection_name] = collection
+            inserted[collection_name] += upsert_batch(collections[collection_name], batch, vectors)
+
+        for collection_name, count in inserted.items():
+            logging.info(f"Inserted {count} documents into the {collection_name} vector store")
+        return sum(inserted.values())
     except Exception as e:
         logging.error(f"Error inserting documents into vector store: {str(e)}")
         raise
@@ -117,20 +261,228 @@ def delete_vector_db():
         logging.error(f"Error accessing or deleting files in chroma_db directory: {str(e)}")
         raise
 
+def build_lexical_index(client, collection_name, page_size=5000):
+    """
+    Rebuilds the BM25 index of a collection from the chunks stored in Chroma.
+    """
+    collection = client.get_collection(collection_name)
+    ids, texts = [], []
+    offset = 0
+    while True:
+        page = collection.get(include=["documents"], limit=page_size, offset=offset)
+        ids.extend(page["ids"])
+        texts.extend(page["documents"])
+        if len(page["ids"]) < page_size:
+            break
+        offset += page_size
+
+    LexicalIndex.build(ids, texts).save(lexical_index_path(DB_PATH, collection_name))
+    logging.info(f"Built lexical index for the {collection_name} collection ({len(ids)} chunks)")
+
+def build_quantized_index(client, collection_name, page_size=5000):
+    """
+    Rebuilds the quantized index of a collection (config.vector_quantization) from the
+    embeddings stored in Chroma.
+    """
+    collection = client.get_collection(collection_name)
+    count = collection.count()
+
+    def pages():
+        for offset in range(0, count, page_size):
+            page = collection.get(include=["embeddings"], limit=page_size, offset=offset)
+            yield page["ids"], page["embeddings"]
+
+    write_quantized_index(DB_PATH, collection_name, cfg.vector_quantization, count, pages())
+    logging.info(f"Built {cfg.vector_quantization} quantized index for the {collection_name} collection ({count} chunks)")
+
+def build_missing_search_indexes(manifest, client=None):
+    """
+    Builds the lexical and quantized indexes that are missing, e.g. after a setting
+    changed. The database is only opened if something is missing. Returns whether any
+    index was built.
+    """
+    built = False
+    for collection_name in manifest["collections"]:
+        missing_lexical = not os.path.exists(lexical_index_path(DB_PATH, collection_name))
+        missing_quantized = cfg.vector_quantization and not all(
+            os.path.exists(path) for path in quantized_index_paths(DB_PATH, collection_name, cfg.vector_quantization)
+        )
+        if missing_lexical or missing_quantized:
+            client = client or chromadb.PersistentClient(path=DB_PATH)
+            built = True
+        if missing_lexical:
+            build_lexical_index(client, collection_name)
+        if missing_quantized:
+            build_quantized_index(client, collection_name)
+    return built
+
+def sync_vector_db(folders, manifest, rebuild=False):
+    """
+    Brings the vector database in line with the TXT files using the manifest of
+    previously indexed files. Only new or changed chunks are embedded and upserted,
+    chunks that disappeared are deleted, and unchanged files are skipped entirely. With
+    rebuild, the database is deleted and built again from an empty manifest.
+
+    The chunks are embedded first and the index write lock is only held while the
+    database, its lexical and quantized indexes and the manifest are written.
+    """
+    start_time = time.perf_counter()
+
+    # Find changed and removed files by their hash before reading any chunks
+    changed_files = {}
+    file_paths = {}
+    for file, file_path in list_txt_files(folders):
+        file_paths[file] = file_path
+        current_hash = file_hash(file_path)
+        entry = manifest["files"].get(file)
+        if not entry or entry["hash"] != current_hash:
+            changed_files[file] = {"collection": get_collection_name(file), "hash": current_hash, "path": file_path}
+    removed_files = [file for file in manifest["files"] if file not in file_paths]
+
+    if not changed_files and not removed_files and not rebuild:
+        with index_write_lock():
+            if build_missing_search_indexes(manifest):
+                save_manifest(DB_PATH, manifest)  # Lets the chatbot pick up the new indexes
+        logging.info(f"Vector database is up to date ({time.perf_counter() - start_time:.3f}s)")
+        return
+
+    # Files that dropped near duplicates of a changed or removed file are checked again,
+    # since they may now hold the only copy of that text
+    near_duplicates = None
+    if cfg.near_duplicate_filter:
+        # A rebuild starts from an empty filter; the old one is deleted with the database
+        near_duplicates = NearDuplicateIndex(None if rebuild else near_duplicates_path(), cfg.near_duplicate_threshold)
+        pending = list(changed_files) + removed_files
+        while pending:
+            for dependent in near_duplicates.remove_document(pending.pop()):
+                if dependent not in changed_files and dependent in file_paths:
+                    changed_files[dependent] = {
+                        "collection": get_collection_name(dependent),
+                        "hash": file_hash(file_paths[dependent]),
+                        "path": file_paths[dependent],
+                    }
+                    pending.append(dependent)
+
+    deleted_ids = defaultdict(list)
+    for file in removed_files:
+        entry = manifest["files"][file]
+        deleted_ids[entry["collection"]].extend(entry["chunks"])
+    staged = StagedWrites()
+
+    def iter_new_docs():
+        """
+        Streams the chunks of the changed files that need to be embedded. Chunks that
+        were already indexed only get their position metadata updated.
+        """
+        for file, info in changed_files.items():
+            entry = manifest["files"].get(file)
+            old_ids = set(entry["chunks"]) if entry else set()
+            current_ids = []
+            moved_docs = []
+            for doc in load_txt_file(file, info.pop("path"), near_duplicates):
+                current_ids.append(doc.id)
+                if doc.id not in old_ids:
+                    yield file, doc
+                    continue
+                moved_docs.append(doc)
+                if len(moved_docs) >= cfg.embed_batch_size:
+                    staged.add(info["collection"], moved_docs)
+                    moved_docs = []
+            if moved_docs:
+                staged.add(info["collection"], moved_docs)
+            deleted_ids[info["collection"]].extend(old_ids.difference(current_ids))
+            info["chunks"] = current_ids
+
+    try:
+        embed_into_staging(iter_new_docs(), staged)
+
+        # Record the new state of the index
+        for file in removed_files:
+            del manifest["files"][file]
+        manifest["files"].update(changed_files)
+        chunks_by_collection = defaultdict(list)
+        for entry in manifest["files"].values():
+            chunks_by_collection[entry["collection"]].extend(entry["chunks"])
+        manifest["collections"] = {
+            name: {"version": collection_version(ids), "chunks": len(ids)}
+            for name, ids in chunks_by_collection.items()
+            if ids
+        }
+        manifest["embedding"] = embedding_settings()
+        changed_collections = {entry["collection"] for entry in changed_files.values()} | set(deleted_ids)
+
+        # Chatbot searches wait while the database is written, so they never read a half-written update
+        with index_write_lock():
+            if rebuild:
+                delete_vector_db()
+                logging.info("Existing vector database deleted")
+            client = chromadb.PersistentClient(path=DB_PATH)
+            new_chunks = insert_into_vector_db(client, staged)
+
+            for collection_name, ids in deleted_ids.items():
+                if ids:
+                    client.get_collection(collection_name).delete(ids=ids)
+                    logging.info(f"Deleted {len(ids)} stale chunks from the {collection_name} vector store")
+
+            # Rebuild the lexical and quantized indexes of the changed collections before publishing the manifest
+            existing_collections = {getattr(collection, "name", collection) for collection in client.list_collections()}
+            for collection_name in changed_collections:
+                if collection_name in manifest["collections"]:
+                    build_lexical_index(client, collection_name)
+                    if cfg.vector_quantization:
+                        build_quantized_index(client, collection_name)
+                else:
+                    # A collection without files is dropped, so the chatbot stops offering it
+                    if collection_name in existing_collections:
+                        client.delete_collection(collection_name)
+                        logging.info(f"Deleted the empty {collection_name} vector store")
+                    if os.path.exists(lexical_index_path(DB_PATH, collection_name)):
+                        os.remove(lexical_index_path(DB_PATH, collection_name))
+                    remove_quantized_index(DB_PATH, collection_name)
+            build_missing_search_indexes(manifest, client)
+            if near_duplicates is not None:
+                near_duplicates.save(near_duplicates_path())
+            save_manifest(DB_PATH, manifest)
+    finally:
+        staged.close()
+
+    if near_duplicates is not None:
+        stats = near_duplicates.stats()
+        logging.info(
+            f"Near-duplicate filter: checked {stats['checked']} texts, skipped {stats['removed'].get('release', 0)} files "
+            f"and {stats['removed'].get('passage', 0)} chunks ({stats['removed_chars']} characters)"
+        )
+
+    # Answers cached by the chatbot were generated from the previous collection contents
+    answer_cache = AnswerCache()
+    for collection_name in changed_collections:
+        answer_cache.invalidate(collection_name, keep_version=manifest["collections"].get(collection_name, {}).get("version"))
+
+    logging.info(
+        f"Incremental update: {len(changed_files)} changed and {len(removed_files)} removed files, "
+        f"{new_chunks} chunks embedded, {sum(len(ids) for ids in deleted_ids.values())} chunks deleted "
+        f"in {time.perf_counter() - start_time:.2f}s"
+    )
+
 def main():
     """
     Main function to process TXT files and populate the vector database.
+    The database is updated incrementally when a manifest from a previous run exists,
+    otherwise it is rebuilt from scratch.
     """
     try:
-        # Delete existing vector database
-        delete_vector_db()
-        logging.info("Existing vector database deleted")
-        
-        # Process TXT files
-        txt_docs = process_txt_files(folder_paths)
-
-        # Insert documents into the vector database
-        insert_into_vector_db(txt_docs)
+        # Keeps a second run from updating the index at the same time; chatbot searches
+        # only wait for the index lock, which sync_vector_db takes to write
+        with index_update_lock():
+            manifest = load_manifest(DB_PATH) if cfg.incremental_indexing else None
+            # Databases from before the settings were recorded hold full-size OpenAI embeddings
+            recorded = {"backend": "openai", "model": cfg.embedding_model, "dimensions": None, **(manifest or {}).get("embedding", {})}
+            if manifest is not None and recorded != embedding_settings():
+                logging.info("Embedding settings changed, rebuilding the vector database")
+                manifest = None
+
+            # Embed and insert only what changed since the manifest was written
+            sync_vector_db(folder_paths, manifest or new_manifest(), rebuild=manifest is None)
 
         logging.info("Vector database population completed successfully")
     except Exception as e:
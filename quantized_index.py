@@ -0,0 +1,179 @@
+"""
+Compact sidecar vector index of a collection, searched instead of Chroma's float HNSW
+index so chatbot workers never load that index into memory. Vectors are kept in memory
+as int8 codes with a scale per vector, or as sign bits; the normalized float vectors
+stay on disk, memory-mapped, and only the shortlist of each query is read from them to
+re-rank it exactly.
+"""
+import os
+
+import numpy as np
+
+QUANTIZATION_MODES = ("int8", "binary")
+BLOCK_BYTES = 1 << 20  # Size of the float copy of the int8 codes scored at once
+# Set bits of every byte, for numpy < 2.0, which has no np.bitwise_count
+BYTE_BIT_COUNTS = np.array([bin(byte).count("1") for byte in range(256)], dtype=np.uint8)
+
+def count_bits(codes):
+    """
+    Returns the number of set bits in each row of packed bits.
+    """
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(codes).sum(axis=1, dtype=np.int64)
+    return BYTE_BIT_COUNTS[codes].sum(axis=1, dtype=np.int64)
+
+def quantized_index_paths(db_path, collection_name, mode):
+    """
+    Returns the paths of the codes of a collection in a quantization mode and of its
+    float vectors, which are shared by the modes.
+    """
+    folder = os.path.join(db_path, "quantized")
+    return os.path.join(folder, f"{collection_name}.{mode}.npz"), os.path.join(folder, f"{collection_name}.vectors.npy")
+
+def normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    return vectors / np.maximum(np.linalg.norm(vectors, axis=-1, keepdims=True), 1e-12)
+
+def quantize(vectors, mode):
+    """
+    Returns the codes and scales of normalized vectors; binary codes have no scales.
+    """
+    if mode == "int8":
+        scales = np.abs(vectors).max(axis=1) / 127
+        codes = np.round(vectors / np.maximum(scales, 1e-12)[:, None]).astype(np.int8)
+        return codes, scales.astype(np.float32)
+    if mode == "binary":
+        return np.packbits(vectors > 0, axis=1), None
+    raise ValueError(f"Unknown quantization mode '{mode}', expected one of {QUANTIZATION_MODES}")
+
+class QuantizedIndex:
+    """
+    Quantized codes of the chunks of one collection, with their IDs and the normalized
+    float vectors used for re-ranking (usually memory-mapped).
+    """
+
+    def __init__(self, ids, mode, codes, scales, vectors):
+        self.ids = ids
+        self.mode = mode
+        self.codes = codes
+        self.scales = scales
+        self.vectors = vectors
+        self.dimensions = vectors.shape[1]
+        self._positions = None
+
+    def approximate_similarities(self, query):
+        """
+        Estimates the cosine similarity of a normalized query to every vector from the
+        codes alone.
+        """
+        similarities = np.empty(len(self.ids), dtype=np.float32)
+        if self.mode == "binary":
+            query_bits = np.packbits(query > 0)
+        block_size = max(1, BLOCK_BYTES // (4 * self.dimensions))
+        for start in range(0, len(self.ids), block_size):
+            block = self.codes[start:start + block_size]
+            if self.mode == "int8":
+                scores = (block.astype(np.float32) @ query) * self.scales[start:start + block_size]
+            else:
+                # The share of differing sign bits estimates the angle between the vectors
+                hamming = count_bits(block ^ query_bits)
+                scores = np.cos(np.pi * hamming / self.dimensions)
+            similarities[start:start + len(block)] = scores
+        return similarities
+
+    def search(self, query_embedding, k, rerank_candidates=0):
+        """
+        Returns up to k (chunk ID, cosine distance) pairs, nearest first. With
+        rerank_candidates, the best k * rerank_candidates vectors by their codes are
+        re-ranked by their exact distance.
+        """
+        if not len(self.ids):
+            return []
+        query = normalize(query_embedding)
+        if query.shape[0] != self.dimensions:
+            raise ValueError(f"Query has {query.shape[0]} dimensions, the index of this collection {self.dimensions}")
+
+        similarities = self.approximate_similarities(query)
+        shortlist_size = min(len(self.ids), k * rerank_candidates if rerank_candidates else k)
+        shortlist = np.argpartition(-similarities, shortlist_size - 1)[:shortlist_size]
+        if rerank_candidates:
+            shortlist.sort()  # Reads the memory-mapped rows in file order
+            similarities = self.vectors[shortlist] @ query
+        else:
+            similarities = similarities[shortlist]
+
+        best = np.argsort(-similarities)[:k]
+        return [(str(self.ids[shortlist[i]]), float(1 - similarities[i])) for i in best]
+
+    def get_vectors(self, ids):
+        """
+        Returns the normalized float vectors of chunk IDs, or None if any of them is
+        missing from the index.
+        """
+        if self._positions is None:
+            self._positions = {str(chunk_id): position for position, chunk_id in enumerate(self.ids)}
+        positions = [self._positions.get(chunk_id) for chunk_id in ids]
+        if None in positions:
+            return None
+        return np.asarray(self.vectors[positions])
+
+def write_quantized_index(db_path, collection_name, mode, count, pages):
+    """
+    Writes the quantized index of a collection from pages of (IDs, embeddings) holding
+    count vectors in total, without holding all float vectors in memory at once. Both
+    files are replaced atomically, and the codes of other modes, which no longer match
+    the float vectors, are removed.
+    """
+    index_path, vectors_path = quantized_index_paths(db_path, collection_name, mode)
+    os.makedirs(os.path.dirname(index_path), exist_ok=True)
+    vectors_tmp_path = f"{vectors_path}.tmp"
+    vectors = None
+    ids, codes, scales = [], [], []
+    offset = 0
+    for page_ids, embeddings in pages:
+        page_vectors = normalize(embeddings)
+        if vectors is None:
+            vectors = np.lib.format.open_memmap(vectors_tmp_path, mode="w+", dtype=np.float32,
+                                                shape=(count, page_vectors.shape[1]))
+        vectors[offset:offset + len(page_vectors)] = page_vectors
+        offset += len(page_vectors)
+        page_codes, page_scales = quantize(page_vectors, mode)
+        ids.extend(page_ids)
+        codes.append(page_codes)
+        if page_scales is not None:
+            scales.append(page_scales)
+    if vectors is None or offset != count:
+        raise ValueError(f"Expected {count} vectors for the {collection_name} collection, got {offset}")
+    vectors.flush()
+    del vectors
+
+    arrays = {"ids": np.array(ids), "codes": np.concatenate(codes)}
+    if scales:
+        arrays["scales"] = np.concatenate(scales)
+    index_tmp_path = f"{index_path}.tmp"
+    with open(index_tmp_path, "wb") as f:
+        np.savez(f, **arrays)
+    os.replace(vectors_tmp_path, vectors_path)
+    os.replace(index_tmp_path, index_path)
+    for other_mode in QUANTIZATION_MODES:
+        other_index_path, _ = quantized_index_paths(db_path, collection_name, other_mode)
+        if other_mode != mode and os.path.exists(other_index_path):
+            os.remove(other_index_path)
+
+def remove_quantized_index(db_path, collection_name):
+    for mode in QUANTIZATION_MODES:
+        for path in quantized_index_paths(db_path, collection_name, mode):
+            if os.path.exists(path):
+                os.remove(path)
+
+def load_quantized_index(db_path, collection_name, mode):
+    """
+    Loads the quantized index of a collection with its float vectors memory-mapped, or
+    returns None if it was not built for this mode.
+    """
+    index_path, vectors_path = quantized_index_paths(db_path, collection_name, mode)
+    if not os.path.exists(index_path) or not os.path.exists(vectors_path):
+        return None
+    with np.load(index_path) as data:
+        scales = data["scales"] if "scales" in data else None
+        return QuantizedIndex(data["ids"], mode, data["codes"], scales, np.load(vectors_path, mmap_mode="r"))
@@ -0,0 +1,307 @@
+"""
+Asyncio query pipeline shared by the chatbot page and batch callers. All queries of the
+process run on one background event loop, so waiting on the OpenAI API does not hold a
+thread per session. API clients share a connection pool per API key, and semaphores
+bound the embeddings and completions in flight across the process. Lexical searches
+start while the query is embedded, and vector searches run while the answer cache is
+checked.
+
+Async callers await answer_query() directly; synchronous callers such as the Streamlit
+page go through run_sync() and iterate_sync().
+"""
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import httpx
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+
+import config as cfg
+from context_packing import pack_context, count_tokens
+from index_lock import async_index_read_lock
+from reranking import candidate_count, rerank
+from resources import get_embeddings, get_answer_cache, get_collection_version
+from retrieval import (plan_search, vector_search, lexical_search, fuse_collection, merge_results, run_in_pool,
+                       query_content_terms)
+from tracing import Trace
+
+SYSTEM_PROMPT = "You are a helpful assistant capable of providing context-aware responses."
+
+def build_messages(user_query, context, history=()):
+    current_year = datetime.now().year
+    last_quarter = 2
+
+    combined_prompt = f"""User query: {user_query}
+
+    You are a employee at ALCON Inc to find new inovation from different company. Generate a report on the competitors of what's they have doing. Write as long as possible, generate a comprehensive report. Add bullet points also if needed
+
+    Please provide an augmented response considering the following related information from our database:
+    {context}
+
+    The current year is {current_year} and the last available quarter is {last_quarter}.
+
+    Format your response as follows:
+    **Augmented Response**
+
+    [Your augmented response here]
+    """
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        *history,
+        {"role": "user", "content": combined_prompt}
+    ]
+
+_loop = None
+_loop_lock = threading.Lock()
+
+def get_loop():
+    """
+    Returns the process-wide event loop, running on a daemon thread started on first use.
+    """
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            # Cache lookups and context packing run on these threads (to_thread)
+            _loop.set_default_executor(ThreadPoolExecutor(max_workers=cfg.async_max_threads, thread_name_prefix="query-pipeline"))
+            threading.Thread(target=_loop.run_forever, name="query-pipeline", daemon=True).start()
+        return _loop
+
+def run_sync(coroutine):
+    """
+    Runs a coroutine on the pipeline loop and waits for its result from a synchronous caller.
+    """
+    return asyncio.run_coroutine_threadsafe(coroutine, get_loop()).result()
+
+def iterate_sync(async_iterator):
+    """
+    Iterates an async iterator of the pipeline loop from a synchronous caller. Stopping
+    early closes the iterator on the loop.
+    """
+    completed = False
+    try:
+        while True:
+            try:
+                yield run_sync(async_iterator.__anext__())
+            except StopAsyncIteration:
+                completed = True
+                return
+    finally:
+        if not completed and hasattr(async_iterator, "aclose"):
+            run_sync(async_iterator.aclose())
+
+_clients = OrderedDict()  # API key -> client, least recently used first
+_client_users = {}  # Client -> requests using it
+_limits = {}
+
+async def acquire_async_openai_client(api_key):
+    """
+    Returns the async client of an API key for one request, which hands it back with
+    release_async_openai_client(). Clients live on the pipeline loop and share a bounded
+    pool of keep-alive connections. Every visitor brings their own key, so only the
+    clients of the config.async_max_clients most recently used keys are kept; an evicted
+    client is closed once no request uses it.
+    """
+    if api_key in _clients:
+        _clients.move_to_end(api_key)
+    else:
+        _clients[api_key] = AsyncOpenAI(api_key=api_key, http_client=DefaultAsyncHttpxClient(
+            limits=httpx.Limits(max_connections=cfg.async_max_connections, max_keepalive_connections=cfg.async_max_connections)
+        ))
+        while len(_clients) > cfg.async_max_clients:
+            _, evicted = _clients.popitem(last=False)
+            if evicted not in _client_users:
+                await evicted.close()
+    client = _clients[api_key]
+    _client_users[client] = _client_users.get(client, 0) + 1
+    return client
+
+async def release_async_openai_client(client):
+    _client_users[client] -= 1
+    if not _client_users[client]:
+        del _client_users[client]
+        if client not in _clients.values():
+            await client.close()
+
+def get_limit(stage):
+    # Semaphores are created on the pipeline loop the first time a stage runs
+    if stage not in _limits:
+        _limits[stage] = asyncio.Semaphore({"embed": cfg.async_max_embeddings, "generate": cfg.async_max_generations}[stage])
+    return _limits[stage]
+
+async def search(user_query, collection_names, query_embedding_task, trace, k=None, quota=None):
+    """
+    Searches the collections and returns ranked (Document, distance) pairs. Lexical
+    searches start at once; vector searches start when query_embedding_task completes.
+    The search span covers the time left after the embedding, the rerank span the
+    re-ranking of each collection's candidates. Callers hold the index read lock.
+    """
+    mode, lexical_query, k, quota = plan_search(user_query, collection_names, k, quota)
+    lexical_tasks = [
+        asyncio.ensure_future(run_in_pool(lexical_search, name, lexical_query)) if lexical_query is not None else None
+        for name in collection_names
+    ]
+    query_embedding = await query_embedding_task if mode != "lexical" else None
+
+    async def search_one(name, lexical_task):
+        candidates = candidate_count(name, quota)
+        vector_hits = await run_in_pool(vector_search, name, query_embedding, candidates) if query_embedding is not None else []
+        lexical_hits = await lexical_task if lexical_task is not None else None
+        return await run_in_pool(fuse_collection, name, vector_hits, lexical_hits, candidates)
+
+    with trace.span("search"):
+        per_collection = await asyncio.gather(*(search_one(name, task) for name, task in zip(collection_names, lexical_tasks)))
+    rerank_query = user_query.strip().strip('"')
+    with trace.span("rerank"):
+        per_collection = await asyncio.gather(*(
+            run_in_pool(rerank, name, rerank_query, results, quota) for name, results in zip(collection_names, per_collection)
+        ))
+    return merge_results([result for results in per_collection for result in results], k)
+
+async def answer_query(user_query, collection_names, api_key, stream=False, trace=None, query_embedding=None,
+                       memory=None):
+    """
+    Answers a question from the given collections. Returns the answer, or with stream an
+    async iterator of its text as it is generated. Answers are served from and stored in
+    the answer cache, and every stage is recorded on trace. Callers that embedded the
+    query already, e.g. in a batch, pass its vector as query_embedding. With a
+    ConversationMemory, the prompt includes the earlier conversation, follow-ups may
+    reuse earlier search results, and the answer is added to the memory once complete.
+    """
+    client = await acquire_async_openai_client(api_key)
+    try:
+        answer = await _answer_query(user_query, collection_names, client, stream, trace, query_embedding, memory)
+    except BaseException:
+        await release_async_openai_client(client)
+        raise
+    if not stream:
+        await release_async_openai_client(client)
+        return answer
+    return _release_after(answer, client)
+
+async def _release_after(stream, client):
+    # Hands the client back once the stream is consumed or closed
+    try:
+        async for text in stream:
+            yield text
+    finally:
+        await stream.aclose()
+        await release_async_openai_client(client)
+
+async def _answer_query(user_query, collection_names, client, stream, trace, query_embedding, memory):
+    trace = trace or Trace("query_async")
+    collection_key = ",".join(collection_names)
+
+    def remember(answer):
+        if memory is not None and answer:
+            memory.add_turn(user_query, answer)
+            memory.schedule_compaction(client)
+
+    # The whole retrieval reads one version of the index; generation runs without the lock
+    async with async_index_read_lock():
+        index_version = ",".join(get_collection_version(name) for name in collection_names)
+        mode, _, _, _ = plan_search(user_query, collection_names)
+
+        async def embed():
+            async with get_limit("embed"):
+                with trace.span("embed"):
+                    vector = await get_embeddings().aembed_query(user_query)
+            trace.set(embedding_cache_hit=get_embeddings().last_query_hit())
+            return vector
+
+        # The search waits for the embedding only for its vector part
+        if mode == "lexical":
+            embedding_task = None
+        elif query_embedding is not None:
+            embedding_task = asyncio.get_running_loop().create_future()
+            embedding_task.set_result(query_embedding)
+        else:
+            embedding_task = asyncio.ensure_future(embed())
+        search_task = asyncio.ensure_future(search(user_query, collection_names, embedding_task, trace))
+
+        # Answers to follow-ups depend on the conversation, so only opening questions are cached
+        use_answer_cache = cfg.answer_cache_enabled and not (memory is not None and memory.has_history())
+        cached_answer = None
+        try:
+            query_embedding = await embedding_task if embedding_task is not None else None
+            if use_answer_cache and query_embedding is not None:
+                with trace.span("answer_cache"):
+                    cached_answer = await asyncio.to_thread(get_answer_cache().lookup, collection_key, index_version, query_embedding)
+                trace.set(answer_cache_hit=cached_answer is not None)
+        except BaseException:
+            search_task.cancel()
+            raise
+
+        def store(answer):
+            if use_answer_cache and answer and query_embedding is not None:
+                get_answer_cache().store(collection_key, index_version, user_query, query_embedding, answer)
+
+        if cached_answer is not None:
+            search_task.cancel()
+            remember(cached_answer)
+            trace.mark("first_token")
+            trace.set(answer_tokens=count_tokens(cached_answer))
+            trace.finish()
+            return single_item(cached_answer) if stream else cached_answer
+
+        reused = None
+        if memory is not None and memory.has_retrievals() and query_embedding is not None:
+            content_terms = await run_in_pool(query_content_terms, user_query, collection_names)
+            reused = memory.find_retrieval(collection_key, index_version, query_embedding, content_terms)
+        if reused is not None:
+            search_task.cancel()
+            results, context = reused["results"], reused["context"]
+        else:
+            results = await search_task
+            with trace.span("pack"):
+                context = await asyncio.to_thread(pack_context, results)
+            if memory is not None:
+                memory.remember_retrieval(collection_key, index_version, user_query, query_embedding, results, context)
+    history = memory.history_messages() if memory is not None else []
+    trace.set(search_results=len(results), query_tokens=count_tokens(user_query), context_tokens=count_tokens(context),
+              history_tokens=sum(count_tokens(message["content"]) for message in history), retrieval_reused=reused is not None)
+
+    messages = build_messages(user_query, context, history)
+    if not stream:
+        async with get_limit("generate"):
+            with trace.span("generate"):
+                response = await client.chat.completions.create(model=cfg.chatbot_model, messages=messages)
+        answer = response.choices[0].message.content
+        await asyncio.to_thread(store, answer)
+        remember(answer)
+        trace.mark("first_token")
+        trace.set(answer_tokens=count_tokens(answer))
+        trace.finish()
+        return answer
+
+    async def stream_answer():
+        parts = []
+        completed = False
+        generate_start = time.perf_counter()
+        try:
+            async with get_limit("generate"):
+                response = await client.chat.completions.create(model=cfg.chatbot_model, messages=messages, stream=True)
+                async for chunk in response:
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        if not parts:
+                            trace.mark("first_token")
+                        parts.append(chunk.choices[0].delta.content)
+                        yield chunk.choices[0].delta.content
+            completed = True
+        finally:
+            # Also trace streams that were abandoned, but only cache complete answers
+            answer = "".join(parts)
+            trace.record("generate", generate_start)
+            if completed:
+                await asyncio.to_thread(store, answer)
+                remember(answer)
+            trace.set(answer_tokens=count_tokens(answer), completed=completed)
+            trace.finish()
+
+    return stream_answer()
+
+async def single_item(text):
+    yield text
@@ -0,0 +1,300 @@
+"""
+Scheduled refresh of the competitor data as one job: scrape, clean, deduplicate and save
+the new press releases of every site in config.refresh_sites, then update the index.
+
+Releases stream through stages that run concurrently, each on its own threads, joined
+by bounded queues (config.refresh_queue_size), so a slow stage holds back the ones
+before it instead of letting work pile up in memory:
+
+    list -> fetch (refresh_fetch_workers threads) -> clean and deduplicate
+         -> parse with GPT (only if config.refresh_parse_description is set) -> save
+
+Every site is scraped through its adapter in scraper/site_adapters.py. Saved releases
+go to data/<collection>/, the corpus populate_vectordb indexes incrementally, and the
+fetch state and near-duplicate index are checkpointed every refresh_checkpoint_every
+saved releases, so an interrupted run resumes with the releases it did not save. The
+index is updated by populate_vectordb, which holds the index lock exclusively while it
+writes, so the chatbot never searches a half-built index; scraping holds no lock.
+Per-stage timings are logged and traced (python tracing.py report --name refresh).
+
+    python refresh_pipeline.py
+    python refresh_pipeline.py --sites jnj --articles 10 --refresh
+    python refresh_pipeline.py --interval-hours 24
+"""
+import argparse
+import logging
+import os
+import queue
+import sys
+import threading
+import time
+
+# The scraper modules import each other by name (import scraper, from fetch_state ...); the
+# folder goes first so "scraper" is scraper/scraper.py and not the folder itself
+SCRAPER_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "scraper")
+sys.path.insert(0, SCRAPER_DIR)
+
+import config as cfg
+
+if cfg.deploy:
+    __import__('pysqlite3')
+    sys.modules['sqlite3'] = sys.modules.pop('pysqlite3')
+else:
+    from dotenv import load_dotenv
+    load_dotenv('.env')
+
+import jnj_scraper
+import populate_vectordb
+import scraper
+from fetch_state import FetchState, content_hash
+from index_lock import file_lock, LockBusy
+from near_duplicates import NearDuplicateIndex
+from site_adapters import get_adapters
+from tracing import Trace
+
+DONE = object()  # Marks the end of a stage's output
+
+class Stage:
+    """
+    One step of the pipeline. Its workers take records from the inbox, call func and put
+    the record it returns into the outbox; None drops the record. Counts the records and
+    the time spent in func.
+    """
+
+    def __init__(self, name, func, workers=1):
+        self.name = name
+        self.func = func
+        self.workers = workers
+        self.processed = 0
+        self.passed = 0
+        self.failed = 0
+        self.busy_seconds = 0.0
+        self.wall_seconds = 0.0
+        self._lock = threading.Lock()
+        self._running = workers
+
+    def start(self, inbox, outbox, on_error, trace):
+        start = time.perf_counter()
+
+        def work():
+            while True:
+                record = inbox.get()
+                if record is DONE:
+                    inbox.put(DONE)  # Lets the other workers of this stage stop too
+                    break
+                item_start = time.perf_counter()
+                try:
+                    result = self.func(record)
+                    error = None
+                except Exception as e:
+                    result, error = None, e
+                with self._lock:
+                    self.processed += 1
+                    self.busy_seconds += time.perf_counter() - item_start
+                    self.passed += result is not None
+                    self.failed += error is not None
+                if error is not None:
+                    on_error(self.name, record, error)
+                elif result is not None:
+                    outbox.put(result)
+            with self._lock:
+                self._running -= 1
+                last = self._running == 0
+            if last:
+                self.wall_seconds = time.perf_counter() - start
+                trace.record(self.name, start)
+                outbox.put(DONE)
+
+        threads = [threading.Thread(target=work, name=f"refresh-{self.name}-{i}", daemon=True) for i in range(self.workers)]
+        for thread in threads:
+            thread.start()
+        return threads
+
+def split_for_parse(content, max_chars):
+    """
+    Splits a release into chunks of whole lines of at most about max_chars for parsing.
+    """
+    chunks, current, size = [], [], 0
+    for line in content.splitlines():
+        if current and size + len(line) > max_chars:
+            chunks.append("\n".join(current))
+            current, size = [], 0
+        current.append(line)
+        size += len(line) + 1
+    if current:
+        chunks.append("\n".join(current))
+    return chunks
+
+def write_release(record):
+    """
+    Saves a release to the corpus; the file is replaced atomically.
+    """
+    folder = record["adapter"].output_folder()
+    os.makedirs(folder, exist_ok=True)
+    path = os.path.join(folder, jnj_scraper.release_file_name(record["url"]))
+    with open(f"{path}.tmp", "w", encoding="utf-8") as f:
+        f.write(f"## {record['title']}\n\n{record['content']}\n")
+    os.replace(f"{path}.tmp", path)
+    return path
+
+def run_refresh(sites=None, articles=None, refresh=False):
+    """
+    Scrapes the new releases of the sites and updates the index. Returns a summary with
+    the counts and timings of every stage. Raises LockBusy if another refresh is running.
+    """
+    with file_lock(cfg.refresh_lock_path, exclusive=True, blocking=False):
+        return _run_refresh(get_adapters(sites or cfg.refresh_sites), articles or cfg.refresh_articles_per_site, refresh)
+
+def _run_refresh(adapters, articles, refresh):
+    start = time.perf_counter()
+    trace = Trace("refresh", sites=",".join(adapter.collection for adapter in adapters))
+    state = FetchState(jnj_scraper.FETCH_STATE_PATH)
+    near_duplicates = NearDuplicateIndex(jnj_scraper.NEAR_DUPLICATES_PATH)
+    scraper.fetcher.reset_stats()
+
+    failed_sites = set()
+    saved = {adapter.collection: 0 for adapter in adapters}
+    checkpoint_lock = threading.Lock()  # Keeps the near-duplicate index unchanged while it is saved
+
+    def on_error(stage, record, error):
+        failed_sites.add(record["adapter"].collection)
+        logging.error(f"{stage} failed for {record['url']}: {error}")
+
+    def fetch(record):
+        response = record["adapter"].fetch(record, state)
+        if response is None:
+            raise RuntimeError("no response")
+        if response.status_code == 304:
+            return None  # Unchanged since the last fetch
+        return dict(record, response=response)
+
+    def clean(record):
+        # Runs on a single thread: the near-duplicate index is not thread-safe
+        response = record.pop("response")
+        content = record["adapter"].clean(response.text)
+        entry = state.get(record["url"]) or {}
+        if entry.get("content_hash") == content_hash(content):
+            state.update(record["url"], response)
+            return None  # Re-fetched, but the content is the same
+        with checkpoint_lock:
+            deduplicated = jnj_scraper.remove_near_duplicates(record["url"], content, near_duplicates)
+        if deduplicated is None:
+            state.update(record["url"], response, content, title=record["title"])
+            return None
+        return dict(record, response=response, content=deduplicated, scraped_content=content)
+
+    def parse(record):
+        from parse import parse_with_gpt4_stream  # Creates an OpenAI client on import
+        chunks = split_for_parse(record["content"], cfg.refresh_parse_chunk_chars)
+        return dict(record, content=parse_with_gpt4_stream(chunks, cfg.refresh_parse_description))
+
+    def save(record):
+        path = write_release(record)
+        # The release counts as processed only once its file is saved
+        state.update(record["url"], record["response"], record["scraped_content"], title=record["title"], file=path)
+        with checkpoint_lock:
+            saved[record["adapter"].collection] += 1
+            if sum(saved.values()) % cfg.refresh_checkpoint_every == 0:
+                state.save()
+                near_duplicates.save()
+        logging.info(f"Saved {path}")
+        return path
+
+    stages = [Stage("fetch", fetch, cfg.refresh_fetch_workers), Stage("clean", clean)]
+    if cfg.refresh_parse_description:
+        stages.append(Stage("parse", parse, cfg.refresh_parse_workers))
+    stages.append(Stage("save", save))
+
+    queues = [queue.Queue(maxsize=cfg.refresh_queue_size) for _ in range(len(stages) + 1)]
+    threads = []
+    for stage, inbox, outbox in zip(stages, queues, queues[1:]):
+        threads.extend(stage.start(inbox, outbox, on_error, trace))
+    results = queues[-1]
+
+    # The listings are read on this thread while the first releases are already being fetched
+    list_start = time.perf_counter()
+    listings = {}
+    listed = 0
+    for adapter in adapters:
+        try:
+            response, releases = adapter.list_releases(state, refresh, articles)
+        except Exception as e:
+            response, releases = None, None
+            logging.error(f"Listing the {adapter.collection} releases failed: {e}")
+        if releases is None:
+            failed_sites.add(adapter.collection)
+            continue
+        listings[adapter.collection] = response
+        for release in releases:
+            queues[0].put(dict(release, adapter=adapter))
+            listed += 1
+    queues[0].put(DONE)
+    trace.record("list", list_start)
+
+    while results.get() is not DONE:
+        pass
+    for thread in threads:
+        thread.join()
+
+    # Only remember a listing once every release on it was processed, so failed ones are retried
+    for adapter in adapters:
+        response = listings.get(adapter.collection)
+        if adapter.collection not in failed_sites and response is not None and response.status_code == 200:
+            state.update(adapter.listing_url, response)
+        if saved[adapter.collection] and adapter.legacy_output_file and os.path.exists(adapter.legacy_output_file):
+            os.remove(adapter.legacy_output_file)
+            logging.info(f"Removed {adapter.legacy_output_file}, superseded by {adapter.output_folder()}/")
+    state.save()
+    near_duplicates.save()
+    scrape_seconds = time.perf_counter() - start
+
+    # Also finishes the indexing of an earlier run that was interrupted
+    with trace.span("index"):
+        populate_vectordb.main()
+
+    fetched = scraper.fetcher.report()
+    summary = {
+        "listed": listed,
+        "saved": sum(saved.values()),
+        "failed_sites": sorted(failed_sites),
+        "pages_fetched": fetched["pages"],
+        "scrape_seconds": round(scrape_seconds, 2),
+        "seconds": round(time.perf_counter() - start, 2),
+        "stages": {
+            stage.name: {"processed": stage.processed, "passed": stage.passed, "failed": stage.failed,
+                         "busy_seconds": round(stage.busy_seconds, 2), "wall_seconds": round(stage.wall_seconds, 2)}
+            for stage in stages
+        },
+    }
+    trace.set(**{key: value for key, value in summary.items() if isinstance(value, (int, float))})
+    trace.finish()
+
+    logging.info(f"{'stage':<8} {'records':>8} {'passed':>7} {'failed':>7} {'busy s':>8} {'wall s':>8}")
+    for name, stats in summary["stages"].items():
+        logging.info(f"{name:<8} {stats['processed']:>8} {stats['passed']:>7} {stats['failed']:>7} "
+                     f"{stats['busy_seconds']:>8.2f} {stats['wall_seconds']:>8.2f}")
+    logging.info(f"Refreshed {len(adapters)} sites: {summary['saved']} of {listed} listed releases saved, "
+                 f"scraped in {summary['scrape_seconds']:.1f}s, {summary['seconds']:.1f}s with indexing")
+    return summary
+
+def main():
+    parser = argparse.ArgumentParser(description="Scrape the competitors' new releases and update the index")
+    parser.add_argument('--sites', default=None, help="Comma-separated site adapters (defaults to config.refresh_sites)")
+    parser.add_argument('--articles', type=int, default=None, help="Latest releases listed per site")
+    parser.add_argument('--refresh', action='store_true', help="Re-request releases processed before and save those that changed")
+    parser.add_argument('--interval-hours', type=float, default=0, help="Run again every so many hours (0 = once)")
+    args = parser.parse_args()
+
+    while True:
+        started = time.time()
+        try:
+            summary = run_refresh(args.sites.split(",") if args.sites else None, args.articles, args.refresh)
+        except LockBusy as e:
+            logging.warning(f"Skipping this refresh, another one is running: {e}")
+            summary = None
+        if not args.interval_hours:
+            sys.exit(1 if summary is None or summary["failed_sites"] else 0)
+        time.sleep(max(0.0, started + args.interval_hours * 3600 - time.time()))
+
+if __name__ == "__main__":
+    main()
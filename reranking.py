@@ -0,0 +1,131 @@
+"""
+Re-ranking of each collection's search results before context packing. Neighbouring
+chunks of one release are often all close to the query and would fill the prompt with
+the same text; maximal marginal relevance (MMR) keeps the most relevant results that are
+not near-duplicates of results kept before. It uses the stored embeddings of the
+candidates, so nothing is embedded again. Optionally, a local cross-encoder then
+re-scores the best of them against the query, as far as the latency budget of the
+stage allows.
+
+Settings come from config.rerank_* and can be overridden per collection in
+config.rerank_overrides.
+"""
+import threading
+import time
+
+import numpy as np
+
+import config as cfg
+from resources import get_quantized_index, get_vectordb
+
+def get_rerank_settings(collection_name):
+    settings = {
+        "mmr_lambda": cfg.rerank_mmr_lambda,
+        "candidates": cfg.rerank_candidates,
+        "cross_encoder": cfg.rerank_cross_encoder,
+        "cross_encoder_shortlist": cfg.cross_encoder_shortlist,
+        "budget_ms": cfg.rerank_budget_ms,
+    }
+    settings.update(cfg.rerank_overrides.get(collection_name, {}))
+    return settings
+
+def candidate_count(collection_name, k):
+    """
+    Number of search results to fetch from a collection so re-ranking can keep the best k.
+    """
+    settings = get_rerank_settings(collection_name)
+    if settings["mmr_lambda"] is None and not settings["cross_encoder"]:
+        return k
+    return k * settings["candidates"]
+
+def mmr(relevance, vectors, k, mmr_lambda):
+    """
+    Returns the positions of k items picked by maximal marginal relevance. Each pick
+    maximizes mmr_lambda * relevance - (1 - mmr_lambda) * (highest cosine similarity to
+    an item picked before); vectors must be normalized.
+    """
+    similarities = vectors @ vectors.T
+    selected = [int(np.argmax(relevance))]
+    max_similarity = similarities[selected[0]].copy()
+    available = np.ones(len(relevance), dtype=bool)
+    available[selected[0]] = False
+    while len(selected) < min(k, len(relevance)):
+        scores = np.where(available, mmr_lambda * relevance - (1 - mmr_lambda) * max_similarity, -np.inf)
+        best = int(np.argmax(scores))
+        selected.append(best)
+        available[best] = False
+        np.maximum(max_similarity, similarities[best], out=max_similarity)
+    return selected
+
+def candidate_vectors(collection_name, docs):
+    """
+    Returns the normalized stored embeddings of documents, from the quantized index when
+    it holds them (memory-mapped), otherwise from Chroma.
+    """
+    ids = [doc.id for doc in docs]
+    quantized_index = get_quantized_index(collection_name)
+    vectors = quantized_index.get_vectors(ids) if quantized_index is not None else None
+    if vectors is None:
+        stored = get_vectordb(collection_name).get(ids=ids, include=["embeddings"])
+        by_id = dict(zip(stored["ids"], stored["embeddings"]))
+        vectors = np.asarray([by_id[doc_id] for doc_id in ids], dtype=np.float32)
+    return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+_cross_encoder = None
+_cross_encoder_lock = threading.Lock()
+_seconds_per_pair = None  # Running estimate of the cross-encoder time per passage
+
+def get_cross_encoder():
+    global _cross_encoder
+    with _cross_encoder_lock:
+        if _cross_encoder is None:
+            try:
+                from sentence_transformers import CrossEncoder
+            except ImportError as e:
+                raise ImportError("The cross-encoder re-ranking needs sentence-transformers: pip install sentence-transformers") from e
+            _cross_encoder = CrossEncoder(cfg.cross_encoder_model, device="cpu")
+        return _cross_encoder
+
+def cross_encode(query, docs):
+    """
+    Returns the cross-encoder scores of documents for a query, and updates the estimate
+    of the time per document used to fit the shortlist into the budget.
+    """
+    global _seconds_per_pair
+    start = time.perf_counter()
+    scores = get_cross_encoder().predict([(query, doc.page_content) for doc in docs], show_progress_bar=False)
+    seconds = (time.perf_counter() - start) / len(docs)
+    _seconds_per_pair = seconds if _seconds_per_pair is None else 0.8 * _seconds_per_pair + 0.2 * seconds
+    return np.asarray(scores)
+
+def rerank(collection_name, query, results, k):
+    """
+    Re-ranks one collection's (Document, distance, rank score) triples, best first, and
+    returns the best k. MMR relevance is the rank score scaled to [0, 1], so lexical
+    and vector hits are weighed as search ranked them. The cross-encoder re-scores as
+    many of the top results as fit into the rest of the budget. The new order takes over
+    the rank scores of the old one, so results of several collections merge as before.
+    """
+    start = time.perf_counter()
+    settings = get_rerank_settings(collection_name)
+    if len(results) <= 1:
+        return results[:k]
+
+    order = list(range(len(results)))
+    if settings["mmr_lambda"] is not None:
+        scores = np.array([score for _, _, score in results])
+        relevance = (scores - scores.min()) / max(scores.max() - scores.min(), 1e-12)
+        order = mmr(relevance, candidate_vectors(collection_name, [doc for doc, _, _ in results]), k, settings["mmr_lambda"])
+
+    if settings["cross_encoder"] and query:
+        remaining = settings["budget_ms"] / 1000 - (time.perf_counter() - start)
+        shortlist = min(settings["cross_encoder_shortlist"], len(order))
+        if _seconds_per_pair:
+            shortlist = min(shortlist, int(remaining / _seconds_per_pair))
+        if shortlist > 1:
+            scores = cross_encode(query, [results[i][0] for i in order[:shortlist]])
+            order = [order[i] for i in np.argsort(-scores)] + order[shortlist:]
+
+    reranked = [results[i] for i in order[:k]]
+    scores = sorted((score for _, _, score in reranked), reverse=True)
+    return [(doc, distance, score) for (doc, distance, _), score in zip(reranked, scores)]
@@ -0,0 +1,140 @@
+"""
+Process-wide resources for the chatbot. Streamlit re-runs the page script on every
+interaction and for every session, so the embedding function, vector stores and API
+clients are created once per process here and shared by all sessions and threads.
+
+Everything the query pipeline loads from its own threads is cached with
+show_spinner=False: a cache spinner needs the script thread's session and raises
+NoSessionContext anywhere else.
+"""
+import threading
+
+import chromadb
+import streamlit as st
+from chromadb.api.shared_system_client import SharedSystemClient
+from langchain_chroma import Chroma
+from openai import OpenAI
+
+import config as cfg
+from answer_cache import AnswerCache
+from embedding_backends import create_embeddings
+from index_manifest import get_index_stamp, load_manifest
+from lexical_index import load_lexical_index
+from quantized_index import load_quantized_index
+
+_reload_lock = threading.Lock()
+
+@st.cache_resource(show_spinner=False)
+def get_embeddings():
+    # Embeddings of config.embedding_backend, served from the embedding cache shared with
+    # populate_vectordb when the text was embedded before
+    return create_embeddings()
+
+@st.cache_resource(max_entries=1, show_spinner=False)
+def get_chroma_client(index_stamp):
+    """
+    Opens the Chroma database once per version of the on-disk index. index_stamp is only
+    used as the cache key: when populate_vectordb rewrites the index, the stamp changes
+    and the database is reopened so the new HNSW files are loaded.
+    """
+    with _reload_lock:
+        # Chroma shares one system per path inside the process; drop it so the client
+        # below reads the index from disk again. Stores handed out before keep their old
+        # system, which is why callers should go through get_vectordb() for each query.
+        SharedSystemClient.clear_system_cache()
+        return chromadb.PersistentClient(path=cfg.db_path)
+
+@st.cache_resource(max_entries=1, show_spinner=False)
+def list_collection_names(index_stamp):
+    collections = get_chroma_client(index_stamp).list_collections()
+    return sorted(getattr(collection, "name", collection) for collection in collections)
+
+def get_collection_names():
+    """
+    Returns the names of the collections in the database, one per competitor data file.
+    """
+    return list_collection_names(get_index_stamp(cfg.db_path))
+
+def get_collection_options():
+    """
+    Maps the competitor choices shown to users to their collections, plus a choice for
+    all competitors when there are several.
+    """
+    collection_names = get_collection_names()
+    options = {cfg.competitor_labels.get(name, name): [name] for name in collection_names}
+    if len(collection_names) > 1:
+        options[cfg.all_competitors_label] = collection_names
+    return options
+
+@st.cache_resource(max_entries=32, show_spinner=False)
+def load_collection_metadata(collection_name, index_stamp):
+    return get_chroma_client(index_stamp).get_collection(collection_name).metadata
+
+def get_collection_metadata(collection_name):
+    """
+    Returns the Chroma metadata of a collection, e.g. the embedding backend that built it.
+    """
+    return load_collection_metadata(collection_name, get_index_stamp(cfg.db_path))
+
+@st.cache_resource(max_entries=32, show_spinner=False)
+def get_vectordb_for_stamp(collection_name, index_stamp):
+    return Chroma(
+        client=get_chroma_client(index_stamp),
+        embedding_function=get_embeddings(),
+        collection_name=collection_name,
+    )
+
+def get_vectordb(collection_name):
+    """
+    Returns the shared vector store for a collection, reopened only when the index changed.
+    """
+    return get_vectordb_for_stamp(collection_name, get_index_stamp(cfg.db_path))
+
+@st.cache_resource(max_entries=16)
+def get_openai_client(api_key):
+    # One client per API key, so its HTTP connection pool is reused across reruns and sessions
+    return OpenAI(api_key=api_key)
+
+@st.cache_resource(show_spinner=False)
+def get_answer_cache():
+    return AnswerCache()
+
+@st.cache_resource(max_entries=1, show_spinner=False)
+def load_collection_versions(index_stamp):
+    manifest = load_manifest(cfg.db_path)
+    if manifest is None:
+        return {}
+    return {name: info["version"] for name, info in manifest["collections"].items()}
+
+def get_collection_version(collection_name):
+    """
+    Returns the version of a collection's contents from the index manifest. Databases built
+    before the manifest existed fall back to the index stamp.
+    """
+    index_stamp = get_index_stamp(cfg.db_path)
+    return load_collection_versions(index_stamp).get(collection_name) or f"stamp-{index_stamp}"
+
+@st.cache_resource(max_entries=32, show_spinner=False)
+def load_lexical_index_for_stamp(collection_name, index_stamp):
+    return load_lexical_index(cfg.db_path, collection_name)
+
+def get_lexical_index(collection_name):
+    """
+    Returns the BM25 index of a collection, loaded once per version of the on-disk index,
+    or None if the collection has no lexical index yet.
+    """
+    return load_lexical_index_for_stamp(collection_name, get_index_stamp(cfg.db_path))
+
+@st.cache_resource(max_entries=32, show_spinner=False)
+def load_quantized_index_for_stamp(collection_name, mode, index_stamp):
+    return load_quantized_index(cfg.db_path, collection_name, mode)
+
+def get_quantized_index(collection_name):
+    """
+    Returns the quantized index of a collection for config.vector_quantization, loaded once
+    per version of the on-disk index, or None if quantization is off or the index was not
+    built yet.
+    """
+    if not cfg.vector_quantization:
+        return None
+    return load_quantized_index_for_stamp(collection_name, cfg.vector_quantization, get_index_stamp(cfg.db_path))
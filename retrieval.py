@@ -0,0 +1,148 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+import config as cfg
+from embedding_backends import check_collection_embedding
+from index_lock import index_read_lock
+from lexical_index import reciprocal_rank_fusion, tokenize
+from reranking import candidate_count, rerank
+from resources import get_vectordb, get_lexical_index, get_quantized_index, get_collection_metadata, get_embeddings
+
+# Shared by all sessions so concurrent searches reuse the same worker threads
+_executor = ThreadPoolExecutor(max_workers=cfg.retrieval_max_workers, thread_name_prefix="retrieval")
+
+def is_lexical_query(query):
+    """
+    Queries wrapped in double quotes, such as exact product names, are answered from
+    the lexical index alone.
+    """
+    query = query.strip()
+    return len(query) > 2 and query.startswith('"') and query.endswith('"')
+
+def vector_search(collection_name, query_embedding, k):
+    """
+    Returns the k nearest (Document, distance) pairs of a collection, from its quantized
+    index when config.vector_quantization is set and the index was built, otherwise from
+    Chroma's float index. Raises ValueError if the collection was embedded differently
+    from the query.
+    """
+    check_collection_embedding(collection_name, get_collection_metadata(collection_name), len(query_embedding))
+    quantized_index = get_quantized_index(collection_name)
+    if quantized_index is None:
+        return get_vectordb(collection_name).similarity_search_by_vector_with_relevance_scores(query_embedding, k=k)
+
+    hits = quantized_index.search(query_embedding, k, cfg.quantized_rerank_candidates)
+    docs = {doc.id: doc for doc in get_vectordb(collection_name).get_by_ids([doc_id for doc_id, _ in hits])}
+    return [(docs[doc_id], distance) for doc_id, distance in hits if doc_id in docs]
+
+def lexical_search(collection_name, query, k=None):
+    """
+    Returns the best (chunk ID, BM25 score) pairs of a collection, or nothing if the
+    collection has no lexical index.
+    """
+    lexical_index = get_lexical_index(collection_name)
+    return lexical_index.search(query, k or cfg.lexical_k) if lexical_index else []
+
+def query_content_terms(query, collection_names):
+    """
+    Returns the terms of a query that narrow a search down, e.g. product names: those in
+    at most config.memory_reuse_max_term_share of the chunks of a collection. Without
+    lexical indexes, every term of the query.
+    """
+    terms = set(tokenize(query))
+    lexical_indexes = [index for index in map(get_lexical_index, collection_names) if index is not None]
+    if not lexical_indexes:
+        return terms
+    return {
+        term for term in terms
+        if any((share := index.document_share(term)) is not None and share <= cfg.memory_reuse_max_term_share
+               for index in lexical_indexes)
+    }
+
+def fuse_collection(collection_name, vector_hits, lexical_hits, k):
+    """
+    Combines the vector and lexical hits of one collection into (Document, distance,
+    rank score) triples, best first. Vector and BM25 hits are combined with
+    reciprocal-rank fusion; documents found only by the lexical index have no distance.
+    Without lexical hits (None), the vector hits are ranked by distance.
+    """
+    if lexical_hits is None:
+        results = [(doc, distance, -distance) for doc, distance in vector_hits]
+    else:
+        docs = {doc.id: (doc, distance) for doc, distance in vector_hits}
+        missing_ids = [doc_id for doc_id, _ in lexical_hits if doc_id not in docs]
+        if missing_ids:
+            docs.update((doc.id, (doc, None)) for doc in get_vectordb(collection_name).get_by_ids(missing_ids))
+
+        fused = reciprocal_rank_fusion([
+            [doc.id for doc, _ in vector_hits],
+            [doc_id for doc_id, _ in lexical_hits],
+        ])
+        results = [(*docs[doc_id], score) for doc_id, score in fused if doc_id in docs][:k]
+
+    for doc, _, _ in results:
+        doc.metadata["collection"] = collection_name
+    return results
+
+def search_collection(collection_name, query, query_embedding, k, rerank_query=None):
+    """
+    Searches one collection and returns (Document, distance, rank score) triples, best
+    first. query is None for vector-only searches and query_embedding is None for
+    lexical-only ones. More candidates than k are fetched and re-ranked, by the cross-
+    encoder against rerank_query if it is enabled.
+    """
+    candidates = candidate_count(collection_name, k)
+    vector_hits = vector_search(collection_name, query_embedding, candidates) if query_embedding is not None else []
+    lexical_hits = lexical_search(collection_name, query) if query is not None else None
+    return rerank(collection_name, rerank_query, fuse_collection(collection_name, vector_hits, lexical_hits, candidates), k)
+
+def plan_search(query, collection_names, k=None, quota=None):
+    """
+    Returns the retrieval mode of a query, the text to search lexically (None in vector
+    mode), the number of results and the quota per collection.
+    """
+    k = k or cfg.retrieval_k
+    if len(collection_names) == 1:
+        quota = k
+    else:
+        quota = min(quota or cfg.retrieval_collection_quota, k)
+
+    mode = "lexical" if is_lexical_query(query) else cfg.retrieval_mode
+    lexical_query = query.strip().strip('"') if mode in ("lexical", "hybrid") else None
+    return mode, lexical_query, k, quota
+
+def merge_results(results, k):
+    """
+    Merges the (Document, distance, rank score) triples of several collections by rank
+    score and returns the best k as (Document, distance) pairs.
+    """
+    merged = sorted(results, key=lambda result: result[2], reverse=True)
+    return [(doc, distance) for doc, distance, _ in merged[:k]]
+
+async def run_in_pool(func, *args):
+    """
+    Runs a blocking search function on the shared retrieval threads from async code.
+    """
+    return await asyncio.get_running_loop().run_in_executor(_executor, func, *args)
+
+def search_collections(query, collection_names, query_embedding=None, k=None, quota=None):
+    """
+    Runs one query against several collections in parallel and merges the
+    (Document, distance) results by rank. The query is embedded at most once and the
+    vector is reused for every collection; lexical-only queries are not embedded at all.
+    Each collection contributes at most quota results, so a single large collection
+    cannot crowd out the others. The index read lock is held once for the whole search,
+    as the search functions above expect of their callers.
+    """
+    mode, lexical_query, k, quota = plan_search(query, collection_names, k, quota)
+    if mode == "lexical":
+        query_embedding = None
+    elif query_embedding is None:
+        query_embedding = get_embeddings().embed_query(query)
+
+    with index_read_lock():
+        futures = [
+            _executor.submit(search_collection, name, lexical_query, query_embedding, quota, query.strip().strip('"'))
+            for name in collection_names
+        ]
+        return merge_results([result for future in futures for result in future.result()], k)
@@ -0,0 +1,69 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+class FetchState:
+    """
+    Persistent record of the pages a scraper has fetched, keyed by URL. Stores the ETag,
+    Last-Modified and a hash of the content of each page, so later runs can send
+    conditional requests, skip releases that were already processed and avoid rewriting
+    files whose content did not change.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                self.pages = json.load(f)
+        else:
+            self.pages = {}
+
+    def get(self, url):
+        return self.pages.get(url)
+
+    def seen(self, url):
+        return url in self.pages
+
+    def conditional_headers(self, url):
+        """
+        Returns the If-None-Match / If-Modified-Since headers for a previously fetched URL.
+        """
+        entry = self.pages.get(url) or {}
+        headers = {}
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    def update(self, url, response=None, content=None, **fields):
+        """
+        Records a fetch of url. Returns True if the content differs from the last fetch.
+        """
+        with self._lock:
+            entry = self.pages.setdefault(url, {})
+            if response is not None:
+                entry["etag"] = response.headers.get("ETag")
+                entry["last_modified"] = response.headers.get("Last-Modified")
+            changed = True
+            if content is not None:
+                new_hash = content_hash(content)
+                changed = entry.get("content_hash") != new_hash
+                entry["content_hash"] = new_hash
+            entry["fetched"] = time.time()
+            entry.update(fields)
+            return changed
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with self._lock:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self.pages, f, indent=2, sort_keys=True)
+            os.replace(tmp_path, self.path)
+
+def content_hash(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
@@ -0,0 +1,106 @@
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Default politeness and robustness settings
+MAX_WORKERS = 8  # Pages fetched concurrently across all hosts
+PER_HOST_CONCURRENCY = 4  # Requests in flight per host
+PER_HOST_RATE = 2.0  # Requests started per second per host
+TIMEOUT = (10, 90)  # Connect and read timeouts in seconds (the scraper proxy renders pages slowly)
+RETRIES = 4  # Retries of failed requests, with exponential backoff
+BACKOFF_FACTOR = 1.0  # Waits 1s, 2s, 4s, ... between retries
+
+class Fetcher:
+    """
+    Shared HTTP client for the scrapers. Requests go through one pooled session with
+    timeouts and exponential-backoff retries (honouring Retry-After), and are throttled
+    per host by a concurrency limit and a minimum interval between requests. Keeps
+    counters for pages fetched, failures and bytes so runs can report their throughput.
+    """
+
+    def __init__(self, max_workers=MAX_WORKERS, per_host_concurrency=PER_HOST_CONCURRENCY,
+                 per_host_rate=PER_HOST_RATE, timeout=TIMEOUT, retries=RETRIES, backoff_factor=BACKOFF_FACTOR):
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.min_interval = 1.0 / per_host_rate if per_host_rate else 0.0
+
+        retry = Retry(
+            total=retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=("GET", "HEAD"),
+            respect_retry_after_header=True,
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self._lock = threading.Lock()
+        self._host_slots = defaultdict(lambda: threading.BoundedSemaphore(per_host_concurrency))
+        self._host_next_start = defaultdict(float)
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.pages = 0
+        self.failures = 0
+        self.bytes = 0
+        self.started = time.perf_counter()
+
+    def _wait_for_turn(self, host):
+        # Reserve the next start time for this host, then sleep until it comes
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._host_next_start[host])
+            self._host_next_start[host] = start + self.min_interval
+        if start > now:
+            time.sleep(start - now)
+
+    def get(self, url, params=None, headers=None):
+        """
+        Fetches a URL and returns the response, or None if the request failed after all
+        retries. Non-2xx responses other than 304 are counted as failures.
+        """
+        host = urlsplit(url).netloc
+        with self._host_slots[host]:
+            self._wait_for_turn(host)
+            try:
+                response = self.session.get(url, params=params, headers=headers, timeout=self.timeout)
+            except requests.RequestException as e:
+                print(f"Request to {url} failed: {e}")
+                with self._lock:
+                    self.failures += 1
+                return None
+
+        with self._lock:
+            if response.ok or response.status_code == 304:
+                self.pages += 1
+                self.bytes += len(response.content)
+            else:
+                self.failures += 1
+        return response
+
+    def map(self, func, items):
+        """
+        Runs func over items on a pool of max_workers threads and returns the results in
+        the order of items.
+        """
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            return list(executor.map(func, items))
+
+    def report(self):
+        elapsed = time.perf_counter() - self.started
+        return {
+            "pages": self.pages,
+            "failures": self.failures,
+            "megabytes": self.bytes / 1e6,
+            "seconds": elapsed,
+            "pages_per_second": self.pages / elapsed if elapsed else 0.0,
+        }
@@ -1,64 +1,187 @@
-import requests
 from bs4 import BeautifulSoup
+from urllib.parse import urljoin, urlsplit
+from fetch_state import FetchState
 import scraper
 
-import os,sys
+import os,re,sys
 
-# Function to scrape a specified number of recent press releases from JnJ
-def scrape_jnj_articles(num_articles=1):
-    url = "https://www.jnj.com/media-center/press-releases"
-    response = requests.get(url)
-    
-    if response.status_code != 200:
-        print(f"Failed to scrape the JnJ press releases. Status code: {response.status_code}")
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from near_duplicates import NearDuplicateIndex
+
+JNJ_PRESS_RELEASES_URL = "https://www.jnj.com/media-center/press-releases"
+OUTPUT_FOLDER = "data/jnj"  # One TXT file per press release
+LEGACY_OUTPUT_FILE = "data/jnj.txt"  # Single file written by earlier versions of the scraper
+FETCH_STATE_PATH = "data/fetch_state.json"
+NEAR_DUPLICATES_PATH = "data/near_duplicates.npz"  # MinHash signatures of the releases and paragraphs kept so far
+
+# Function to fetch a single press release; returns None if it failed, and a 304 response if it did not change
+def fetch_release(release_url, state=None):
+    print(f"Scraping URL: {release_url}")  # Debug: Print each URL being scraped
+    headers = state.conditional_headers(release_url) if state else None
+    response = scraper.fetch_website(release_url, headers=headers)
+    if response is None:
+        return None
+    if response.status_code not in (200, 304):
+        print(f"Failed to scrape {release_url}. Status code: {response.status_code}")
+        return None
+    return response
+
+# Function to fetch and clean a single press release, run concurrently by scrape_jnj_articles
+def scrape_release(release_url, state=None):
+    response = fetch_release(release_url, state)
+    if response is None or response.status_code == 304:
+        return response, None  # Failed, or unchanged since the last fetch
+    return response, clean_release(response.text)
+
+# Function to turn the HTML of a press release into its text, without boilerplate and repeated lines
+def clean_release(html):
+    cleaned_content = scraper.clean_body_content(html)
+
+    # Remove unwanted content
+    cleaned_content = scraper.remove_unwanted_content(cleaned_content)
+
+    # Process content to remove duplicates and reduce blank lines
+    processed_content = []
+    seen_lines = set()  # Track seen lines to avoid duplicates
+    for line in cleaned_content.splitlines():
+        if line not in seen_lines:
+            seen_lines.add(line)
+            if line.strip():  # Only add non-blank lines
+                processed_content.append(line)
+            elif processed_content and processed_content[-1]:  # Add a single blank line if the last line was not blank
+                processed_content.append("")
+    return "\n".join(processed_content)
+
+# Function to drop a release that near-duplicates an earlier one, and paragraphs repeated from other releases
+def remove_near_duplicates(release_url, content, near_duplicates):
+    near_duplicates.remove_document(release_url)  # The release may be re-scraped after a change
+    duplicate = near_duplicates.check(release_url, release_url, content, scope="release")
+    if duplicate:
+        print(f"Skipping {release_url}: near duplicate of {duplicate[0]}")
         return None
 
+    kept_lines = []
+    for i, line in enumerate(content.splitlines()):
+        if not near_duplicates.check(release_url, str(i), line, scope="paragraph"):
+            kept_lines.append(line)
+    return "\n".join(kept_lines)
+
+# Function to list the recent press releases from JnJ that were not processed before
+def list_jnj_releases(num_articles=1, url=JNJ_PRESS_RELEASES_URL, state=None, refresh=False):
+    """
+    Returns the listing response and the releases to fetch from it as dicts with their url
+    and title: none if the listing did not change since the last run, and None instead of
+    the list if it could not be scraped. With a fetch state, the listing is requested
+    conditionally and releases that were already processed are skipped. With refresh, the
+    listing is requested in full and every release on it is returned, so releases that
+    changed are found even when the listing did not.
+    """
+    headers = state.conditional_headers(url) if state and not refresh else None
+    response = scraper.fetcher.get(url, headers=headers)
+    
+    if response is not None and response.status_code == 304:
+        print("The JnJ press releases did not change since the last run.")
+        return response, []
+    if response is None or response.status_code != 200:
+        status = response.status_code if response is not None else "no response"
+        print(f"Failed to scrape the JnJ press releases. Status code: {status}")
+        return response, None
+
     soup = BeautifulSoup(response.text, "html.parser")
     # Update the class name based on the actual HTML structure
     press_releases = soup.find_all("h3", class_="PagePromo-title")[:num_articles]
 
     if not press_releases:
         print("No press releases found. Please check the class name or the website structure.")
-        return None
+        return response, None
 
-    scraped_content = []
-    seen_lines = set()  # Track seen lines to avoid duplicates
+    releases = []
     for release in press_releases:
         release_link = release.find("a")
-        release_url = release_link['href']
-        if not release_url.startswith("http"):
-            release_url = f"https://www.jnj.com{release_url}"
-        print(f"Scraping URL: {release_url}")  # Debug: Print each URL being scraped
-        
-        release_title = release_link.get_text(strip=True)
-        release_content = scraper.scrape_website(release_url)
-        cleaned_content = scraper.clean_body_content(release_content)
-        
-        # Remove unwanted content
-        cleaned_content = scraper.remove_unwanted_content(cleaned_content)
-        
-        # Process content to remove duplicates and reduce blank lines
-        processed_content = []
-        for line in cleaned_content.splitlines():
-            if line not in seen_lines:
-                seen_lines.add(line)
-                if line.strip():  # Only add non-blank lines
-                    processed_content.append(line)
-                elif processed_content and processed_content[-1]:  # Add a single blank line if the last line was not blank
-                    processed_content.append("")
-
-        scraped_content.append(f"\n\n## {release_title}\n\n" + "\n".join(processed_content))
-
-    return "\n".join(scraped_content)
+        release_url = urljoin(url, release_link['href'])
+        if state and not refresh and state.seen(release_url):
+            continue
+        releases.append({"url": release_url, "title": release_link.get_text(strip=True)})
+    print(f"{len(press_releases) - len(releases)} of {len(press_releases)} releases were already processed")
+    return response, releases
+
+# Function to scrape the recent press releases from JnJ that were not processed before
+def scrape_jnj_articles(num_articles=1, url=JNJ_PRESS_RELEASES_URL, state=None, refresh=False, near_duplicates=None):
+    """
+    Returns the new or changed releases as dicts with their url, title and content. With a
+    fetch state, the listing is requested conditionally and releases that were already
+    processed are skipped, unless refresh is set, in which case the listing is requested
+    in full and the releases are re-requested conditionally and only returned when their
+    content changed. With a near-duplicate
+    index, releases and paragraphs that near-duplicate earlier ones are dropped.
+    """
+    response, releases = list_jnj_releases(num_articles, url, state, refresh)
+    if releases is None or response.status_code == 304:
+        return releases
+
+    # Fetch the releases concurrently; results come back in listing order
+    results = scraper.fetcher.map(lambda release: scrape_release(release["url"], state), releases)
+
+    scraped_releases = []
+    failures = 0
+    for release, (release_response, content) in zip(releases, results):
+        if release_response is None:
+            failures += 1
+            continue
+        if content is None:
+            continue
+        if state and not state.update(release["url"], release_response, content, title=release["title"]):
+            continue  # Re-fetched, but the content is the same
+        if near_duplicates is not None:
+            content = remove_near_duplicates(release["url"], content, near_duplicates)
+            if content is None:
+                continue
+        scraped_releases.append(dict(release, content=content))
+
+    # Only remember the listing once every release on it was processed, so failed ones are retried
+    if state and not failures:
+        state.update(url, response)
+
+    stats = scraper.fetcher.report()
+    print(f"Fetched {stats['pages']} pages ({stats['megabytes']:.2f} MB) in {stats['seconds']:.1f}s: "
+          f"{stats['pages_per_second']:.2f} pages/sec, {stats['failures']} failures")
+    if near_duplicates is not None:
+        removed = near_duplicates.stats()["removed"]
+        print(f"Near-duplicate filter dropped {removed.get('release', 0)} releases and "
+              f"{removed.get('paragraph', 0)} paragraphs ({near_duplicates.stats()['removed_chars']} characters)")
+
+    return scraped_releases
+
+# Function to derive a stable file name from a release URL
+def release_file_name(release_url):
+    slug = urlsplit(release_url).path.rstrip("/").rsplit("/", 1)[-1]
+    slug = re.sub(r"[^A-Za-z0-9-]+", "-", slug).strip("-")[:100]
+    return f"{slug or 'release'}.txt"
 
 def main():
-    jnj_results = scrape_jnj_articles(num_articles=4)
+    state = FetchState(FETCH_STATE_PATH)
+    near_duplicates = NearDuplicateIndex(NEAR_DUPLICATES_PATH)
+    jnj_results = scrape_jnj_articles(num_articles=4, state=state, refresh="--refresh" in sys.argv,
+                                      near_duplicates=near_duplicates)
 
-    # Save results to a text file in the data folder
+    # Save each new or changed release to its own text file, so indexing only sees real changes
     if jnj_results:
-        with open("data/jnj.txt", "w", encoding="utf-8") as file:
-            file.write(jnj_results)
-            print("Results saved to data/jnj.txt")
+        os.makedirs(OUTPUT_FOLDER, exist_ok=True)
+        for release in jnj_results:
+            file_path = os.path.join(OUTPUT_FOLDER, release_file_name(release["url"]))
+            with open(file_path, "w", encoding="utf-8") as file:
+                file.write(f"## {release['title']}\n\n{release['content']}\n")
+            state.update(release["url"], file=file_path)
+            print(f"Saved {file_path}")
+
+        # The per-release files replace the single file written by earlier versions
+        if os.path.exists(LEGACY_OUTPUT_FILE):
+            os.remove(LEGACY_OUTPUT_FILE)
+            print(f"Removed {LEGACY_OUTPUT_FILE}, superseded by {OUTPUT_FOLDER}/")
+    elif jnj_results is not None:
+        print("No new press releases.")
+    state.save()
+    near_duplicates.save()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
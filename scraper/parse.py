@@ -1,46 +1,149 @@
-from openai import OpenAI
+from openai import OpenAI, APIConnectionError, InternalServerError, RateLimitError
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
+import hashlib
 import os
+import random
+import sqlite3
+import threading
+import time
 
 # Load environment variables from .env file
 load_dotenv()
 
-# Initialize the OpenAI client
+# Initialize the OpenAI client; retries are scheduled below so rate limits pause every worker
 api_key = os.getenv('OPENAI_API_KEY')
-client = OpenAI(api_key=api_key)
+client = OpenAI(api_key=api_key, max_retries=0)
 
-# Function to parse content using OpenAI GPT-4 API with streaming
-def parse_with_gpt4_stream(dom_chunks, parse_description):
-    system_prompt = "You are an AI assistant tasked with extracting specific information from the following text content. Remove HTML and CSS, and write it as if you were an advertiser for a Iols."
-    
-    parsed_results = []
+PARSE_MODEL = "gpt-4o-mini"  # Use "gpt-4o-mini" or another appropriate model
+SYSTEM_PROMPT = "You are an AI assistant tasked with extracting specific information from the following text content. Remove HTML and CSS, and write it as if you were an advertiser for a Iols."
+MAX_WORKERS = 4  # Chunks parsed concurrently
+MAX_ATTEMPTS = 5  # Attempts per chunk before giving up
+BACKOFF_SECONDS = 1.0  # First retry delay, doubled on every attempt
+PARSE_CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "parse_cache.sqlite3")
 
-    for i, chunk in enumerate(dom_chunks, start=1):
+class RateLimitGate:
+    """
+    Shared pause for all workers: when the API answers 429, nobody sends another request
+    until the Retry-After delay has passed.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._resume_at = 0.0
+
+    def pause(self, seconds):
+        with self._lock:
+            self._resume_at = max(self._resume_at, time.monotonic() + seconds)
+
+    def wait(self):
+        while True:
+            with self._lock:
+                delay = self._resume_at - time.monotonic()
+            if delay <= 0:
+                return
+            time.sleep(delay)
+
+class ParseCache:
+    """
+    Parsed chunks keyed by the hash of the prompt and the chunk, so re-parsing an
+    unchanged page costs no API calls.
+    """
+
+    def __init__(self, path=PARSE_CACHE_PATH):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS parsed (key TEXT PRIMARY KEY, result TEXT NOT NULL)")
+        self._conn.commit()
+
+    @staticmethod
+    def key(prompt, chunk):
+        prompt_hash = hashlib.sha256(prompt.encode('utf-8')).hexdigest()
+        chunk_hash = hashlib.sha256(chunk.encode('utf-8')).hexdigest()
+        return f"{prompt_hash}:{chunk_hash}"
+
+    def get(self, key):
+        with self._lock:
+            row = self._conn.execute("SELECT result FROM parsed WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def put(self, key, result):
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO parsed (key, result) VALUES (?, ?)", (key, result))
+            self._conn.commit()
+
+# Function to read the delay requested by a rate-limited response
+def retry_after_seconds(error, default):
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        if headers.get("retry-after"):
+            return float(headers["retry-after"])
+    except ValueError:
+        pass
+    return default
+
+# Function to parse one chunk, retrying transient failures with backoff
+def parse_chunk(chunk, parse_description, gate):
+    for attempt in range(1, MAX_ATTEMPTS + 1):
+        delay = BACKOFF_SECONDS * 2 ** (attempt - 1) * (1 + random.random() / 2)
+        gate.wait()
         try:
-            # Make the streaming API call to OpenAI's GPT-4
-            stream = client.chat.completions.create(
-                model="gpt-4o-mini",  # Use "gpt-4o-mini" or another appropriate model
+            response = client.chat.completions.create(
+                model=PARSE_MODEL,
                 messages=[
-                    {"role": "system", "content": system_prompt},
+                    {"role": "system", "content": SYSTEM_PROMPT},
                     {"role": "user", "content": f"Extract information matching this description: {parse_description} from the following content:\n\n{chunk}"}
                 ],
-                stream=True,  # Enable streaming
             )
+            response_text = response.choices[0].message.content
+            if response_text:
+                return response_text
+            error = "empty response"
+        except RateLimitError as e:
+            gate.pause(retry_after_seconds(e, delay))
+            error = e
+            delay = 0  # The gate already waits for the requested delay
+        except (APIConnectionError, InternalServerError) as e:
+            error = e
 
-            response_text = ""
-            for chunk in stream:
-                if chunk.choices[0].delta.content is not None:
-                    response_text += chunk.choices[0].delta.content
+        if attempt < MAX_ATTEMPTS:
+            print(f"Retrying chunk after attempt {attempt} failed: {error}")
+            time.sleep(delay)
+    raise RuntimeError(f"Parsing failed after {MAX_ATTEMPTS} attempts: {error}")
 
-            print(f"Parsed batch: {i} of {len(dom_chunks)}")
-            print(f"Response for batch {i}: {response_text}")  # Debug log
+# Function to parse content using OpenAI GPT-4 API, several chunks at a time
+def parse_with_gpt4_stream(dom_chunks, parse_description, max_workers=MAX_WORKERS, cache=None):
+    """
+    Parses the DOM chunks concurrently on a bounded worker pool and joins the results in
+    chunk order. Cached chunks are not sent again. Chunks that still fail after all
+    retries raise an error once the other chunks are done (and cached), so a rerun only
+    re-parses the failed ones.
+    """
+    cache = cache or ParseCache()
+    prompt = f"{PARSE_MODEL}\n{SYSTEM_PROMPT}\n{parse_description}"
+    keys = [ParseCache.key(prompt, chunk) for chunk in dom_chunks]
+    parsed_results = [cache.get(key) for key in keys]
+    pending = [i for i, result in enumerate(parsed_results) if result is None]
+    print(f"{len(dom_chunks) - len(pending)} of {len(dom_chunks)} batches found in the parse cache")
 
-            if response_text:
-                parsed_results.append(response_text)
-            else:
-                parsed_results.append("")  # Handle empty response if necessary
+    gate = RateLimitGate()
+    failed = []
+
+    def parse(i):
+        try:
+            parsed_results[i] = parse_chunk(dom_chunks[i], parse_description, gate)
         except Exception as e:
-            print(f"Error parsing batch {i}: {e}")
-            parsed_results.append("")
+            print(f"Error parsing batch {i + 1}: {e}")
+            failed.append(i + 1)
+            return
+        cache.put(keys[i], parsed_results[i])
+        print(f"Parsed batch: {i + 1} of {len(dom_chunks)}")
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        list(executor.map(parse, pending))
 
-    return "\n".join(parsed_results)
\ No newline at end of file
+    if failed:
+        raise RuntimeError(f"Failed to parse batches {sorted(failed)} of {len(dom_chunks)}")
+    return "\n".join(parsed_results)
@@ -1,8 +1,11 @@
-import requests
 from bs4 import BeautifulSoup
 from dotenv import load_dotenv
+import json
 import os
 import re
+from functools import lru_cache
+
+from fetcher import Fetcher
 
 # Load environment variables
 load_dotenv()
@@ -11,6 +14,9 @@ load_dotenv()
 API_KEY = os.getenv('API_KEY')
 SCRAPER_API_URL = os.getenv('SCRAPER_API_URL')
 
+# Boilerplate phrases and line patterns to remove, per site
+BOILERPLATE_PATTERNS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "boilerplate_patterns.json")
+
 # Predefined URLs
 URL_OPTIONS = {
     "JnJ": "https://www.jnj.com/media-center/press-releases/johnson-johnson-rolls-out-new-tecnis-odyssey-next-generation-intraocular-lens-offering-cataract-patients-precise-vision-at-every-distance-in-any-lighting",
@@ -25,140 +31,70 @@ def clean_body_content(body_content):
     for script_or_style in soup(["script", "style"]):
         script_or_style.extract()
 
-    # Get text or further process the content
+    # Get text and strip every line, dropping blank lines, in a single pass
     cleaned_content = soup.get_text(separator="\n")
-    cleaned_content = "\n".join(
-        line.strip() for line in cleaned_content.splitlines() if line.strip()
-    )
+    return "\n".join(line for line in map(str.strip, cleaned_content.splitlines()) if line)
 
-    # Remove all blank lines
-    cleaned_content = "\n".join(
-        line for line in cleaned_content.splitlines() if line
-    )
+# Shared pooled HTTP client, so concurrent scrapes reuse connections and respect per-host limits
+fetcher = Fetcher()
 
-    return cleaned_content
+# Function to fetch a website through the scraping proxy, optionally with conditional request headers
+def fetch_website(url, headers=None):
+    payload = {'api_key': API_KEY, 'url': url}
+    if headers:
+        payload['keep_headers'] = 'true'  # Forward our headers (e.g. If-None-Match) to the target site
+    return fetcher.get(SCRAPER_API_URL, params=payload, headers=headers)
 
 # Function to scrape website
 def scrape_website(url):
-    payload = {'api_key': API_KEY, 'url': url}
-    response = requests.get(SCRAPER_API_URL, params=payload)
+    response = fetch_website(url)
     
-    if response.status_code == 200:
+    if response is not None and response.status_code == 200:
         return response.text
     else:
-        print(f"Failed to scrape the website. Status code: {response.status_code}")
+        status = response.status_code if response is not None else "no response"
+        print(f"Failed to scrape {url}. Status code: {status}")
         return ""
 
-def remove_unwanted_content(content):
-    # Define unwanted content patterns
-    unwanted_patterns = [
-        "Skip to content",
-        "Business websites",
-        "J&J Innovative Medicine",
-        "J&J MedTech",
-        "US • English",
-        "Choose your country or region",
-        "Latest news",
-        "Innovation",
-        "Caring & giving",
-        "Personal stories",
-        "Health & wellness",
-        "Our Company",
-        "Discover J&J",
-        "Our Credo",
-        "Our Leadership",
-        "Code of Business Conduct",
-        "Corporate reports",
-        "Diversity, Equity & Inclusion",
-        "ESG Policies & Positions",
-        "Innovation at J&J",
-        "Uniting science and technology",
-        "Office of the Chief Medical Officer",
-        "Veterans, military & military families",
-        "Innovative Medicine",
-        "MedTech",
-        "Our societal impact",
-        "Global Health Equity",
-        "Global environmental sustainability",
-        "Suppliers",
-        "Responsible supply base",
-        "Supplier-enabled innovation",
-        "Supplier resources",
-        "Our heritage",
-        "Careers",
-        "Life at J&J",
-        "Diversity, Equity and Inclusion",
-        "Career areas of impact",
-        "Students",
-        "Re-Ignite Program",
-        "Contract & freelance partner opportunities",
-        "Career stories",
-        "Investors",
-        "Pharmaceutical pipeline",
-        "ESG resources",
-        "Investor fact sheet",
-        "Media Center",
-        "Menu",
-        "Search Query",
-        "Submit Search",
-        "Clear",
-        "Dictate search request",
-        "Search Results",
-        "No Results",
-        "Recently Viewed",
-        "Listening...",
-        "Sorry, I don't understand. Please try again",
-        "Show Search",
-        "Home",
-        "/",
-        "JNJ.com",
-        "NewPharm.com",
-        "China",
-        "中国人",
-        "France",
-        "Français",
-        "India",
-        "English",
-        "Japan",
-        "日本",
-        "Switzerland",
-        "Deutsch",
-        "United Kingdom",
-        " at J&J",
-        "Announcements",
-        "Our commitments",
-        "Environment, social, governance",
-        "Sustainability",
-        "Get in touch",
-        "Contact us",
-        "youtube",
-        "facebook",
-        "twitter",
-        "linkedin",
-        "This site is governed solely by applicable U.S. laws and governmental regulations. Please see our",
-        "Privacy Policy",
-        "Use of this site constitutes your consent to application of such laws and regulations and to our",
-        "Legal Notice",
-        "Cookie Policy",
-        "You should view the",
-        "News",
-        "section and the most recent SEC Filings in the Investor section in order to receive the most current information made available by Johnson & Johnson Services, Inc.",
-        "Contact us",
-        "with any questions or search this site for more information.",
-        "Do Not Sell or Share My Personal Information",
-        "Limit the Use of My Sensitive Personal Information",
-        "© 2024 Johnson & Johnson Services, Inc.",
-        "Terms of Use",
-        "Customize Cookie Settings",
-        "Back to top"
-    ]
-    
-    for pattern in unwanted_patterns:
-        content = content.replace(pattern, "")
-    
-    # Remove lines that contain only numbers or sequences of numbers separated by commas
-    content = "\n".join(
-        line for line in content.splitlines() if not re.match(r'^\d+(,\d+)*$', line) and line.strip()
+# Function to build one regex matching any of the phrases, as a prefix tree so the text is scanned once.
+# The text is scanned left to right and the longest phrase starting at each position is removed;
+# unlike the earlier replace per phrase, the order of the phrases does not matter when they overlap
+# ("Innovation at J&J MedTech" loses "Innovation at J&J" and "MedTech", not "J&J MedTech" first),
+# and text that only forms a phrase once another is removed stays
+def phrase_regex(phrases):
+    trie = {}
+    for phrase in phrases:
+        node = trie
+        for char in phrase:
+            node = node.setdefault(char, {})
+        node[""] = True
+
+    def to_regex(node):
+        branches = [re.escape(char) + to_regex(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ""
+        regex = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        # Optional continuations are greedy, so the longest phrase starting at a position wins
+        return f"(?:{regex})?" if "" in node else regex
+
+    return re.compile(to_regex(trie))
+
+# Function to compile the boilerplate patterns of a site, once per site
+@lru_cache(maxsize=None)
+def get_boilerplate_cleaner(site):
+    with open(BOILERPLATE_PATTERNS_PATH, "r", encoding="utf-8") as f:
+        patterns = json.load(f)[site]
+    phrases = phrase_regex(set(patterns.get("phrases", [])))
+    line_patterns = patterns.get("line_patterns", [])
+    lines = re.compile("|".join(f"(?:{pattern})" for pattern in line_patterns)) if line_patterns else None
+    return phrases, lines
+
+def remove_unwanted_content(content, site="jnj"):
+    # Remove the site's boilerplate phrases (navigation, footer, ...) in a single pass
+    phrases, lines = get_boilerplate_cleaner(site)
+    content = phrases.sub("", content)
+
+    # Drop blank lines and lines matching the site's line patterns (e.g. only numbers) in a single pass
+    return "\n".join(
+        line for line in content.splitlines() if line.strip() and not (lines and lines.match(line))
     )
-    
-    return content
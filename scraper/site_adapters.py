@@ -0,0 +1,61 @@
+import os
+
+import jnj_scraper
+
+DATA_FOLDER = "data"  # populate_vectordb indexes data/<collection>/ into the <collection> collection
+
+class SiteAdapter:
+    """
+    How the refresh pipeline scrapes one competitor's site: which collection its releases
+    go to, how to list the releases to fetch, how to fetch one and how to turn its HTML
+    into text. Adding a competitor means adding a subclass to ADAPTERS and its name to
+    config.refresh_sites.
+    """
+    collection = None
+    listing_url = None
+    legacy_output_file = None  # Single file of earlier scraper versions, superseded by the per-release files
+
+    def list_releases(self, state, refresh, limit):
+        """
+        Returns the listing response and the releases to fetch as dicts with their url and
+        title, or None instead of the list if the listing could not be scraped.
+        """
+        raise NotImplementedError
+
+    def fetch(self, release, state):
+        """
+        Returns the response of a release page, a 304 response if it did not change, or
+        None if it failed.
+        """
+        raise NotImplementedError
+
+    def clean(self, html):
+        raise NotImplementedError
+
+    def output_folder(self):
+        return os.path.join(DATA_FOLDER, self.collection)
+
+class JnJAdapter(SiteAdapter):
+    collection = "jnj"
+    listing_url = jnj_scraper.JNJ_PRESS_RELEASES_URL
+    legacy_output_file = jnj_scraper.LEGACY_OUTPUT_FILE
+
+    def list_releases(self, state, refresh, limit):
+        return jnj_scraper.list_jnj_releases(limit, self.listing_url, state, refresh)
+
+    def fetch(self, release, state):
+        return jnj_scraper.fetch_release(release["url"], state)
+
+    def clean(self, html):
+        return jnj_scraper.clean_release(html)
+
+ADAPTERS = {
+    "jnj": JnJAdapter,
+}
+
+# Function to create the adapters of the given sites
+def get_adapters(names):
+    unknown = [name for name in names if name not in ADAPTERS]
+    if unknown:
+        raise ValueError(f"No site adapter for {unknown}, expected some of {sorted(ADAPTERS)}")
+    return [ADAPTERS[name]() for name in names]
@@ -0,0 +1,153 @@
+"""
+Tokenizers used to size chunks (the embedding model's) and prompts (the chat model's).
+
+- OpenAI models are counted with tiktoken. tiktoken downloads an encoding's BPE file on
+  first use; it is kept in config.tiktoken_cache_dir, so after one run with network
+  access (python token_counting.py download) it loads offline.
+- The local embedding backend counts chunks with its model's own tokenizer, which comes
+  with the model files, so local ingestion does not need tiktoken.
+- With config.approximate_token_counts, an OpenAI encoding that is neither cached nor
+  downloadable is replaced by an estimate that tends to count high (offline benchmarks).
+
+Every tokenizer counts the tokens of a text and splits it into windows of at most
+max_tokens tokens, which join back to the text.
+"""
+import argparse
+import logging
+import os
+import re
+import threading
+
+import config as cfg
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+# Pieces tiktoken's encodings start from: contractions, words, up to 3 digits, punctuation runs, spaces
+APPROXIMATE_PIECES = re.compile(r"'(?:s|t|re|ve|m|ll|d)| ?[^\W\d_]+| ?\d{1,3}| ?[^\s\w]+|\s+(?!\S)|\s+")
+APPROXIMATE_TOKEN_CHARS = 6  # Characters per token of ASCII pieces; other scripts count one per character
+
+class TiktokenTokenizer:
+    def __init__(self, model):
+        import tiktoken
+        self.encoding = tiktoken.encoding_for_model(model)
+
+    def encode(self, text):
+        return self.encoding.encode(text, disallowed_special=())
+
+    def count(self, text):
+        return len(self.encode(text))
+
+    def windows(self, text, max_tokens):
+        """
+        Returns the (text, tokens) windows of at most max_tokens tokens of a text.
+        """
+        tokens = self.encode(text)
+        return [(self.encoding.decode(tokens[i:i + max_tokens]), len(tokens[i:i + max_tokens]))
+                for i in range(0, len(tokens), max_tokens)]
+
+class SpanTokenizer:
+    """
+    Tokenizer that knows where each token starts in the text, so windows are slices of it.
+    """
+
+    def starts(self, text):
+        raise NotImplementedError
+
+    def count(self, text):
+        return len(self.starts(text))
+
+    def windows(self, text, max_tokens):
+        starts = self.starts(text)
+        edges = [0] + starts[max_tokens::max_tokens] + [len(text)]
+        return [(text[begin:end], min(max_tokens, len(starts) - i * max_tokens))
+                for i, (begin, end) in enumerate(zip(edges, edges[1:])) if begin < end]
+
+class HuggingFaceTokenizer(SpanTokenizer):
+    """
+    Tokenizer of a local sentence-transformers model, from the model's tokenizer.json
+    (a folder, or a Hugging Face model name looked up in the local model cache first).
+    """
+
+    def __init__(self, model_name):
+        from tokenizers import Tokenizer
+        if os.path.isdir(model_name):
+            path = os.path.join(model_name, "tokenizer.json")
+        else:
+            from huggingface_hub import hf_hub_download
+            from huggingface_hub.utils import LocalEntryNotFoundError
+            try:
+                path = hf_hub_download(model_name, "tokenizer.json", local_files_only=True)
+            except LocalEntryNotFoundError:
+                path = hf_hub_download(model_name, "tokenizer.json")
+        self.tokenizer = Tokenizer.from_file(path)
+        # Chunks are counted in full, not cut at the model's input length
+        self.tokenizer.no_truncation()
+        self.tokenizer.no_padding()
+
+    def starts(self, text):
+        return [start for start, _ in self.tokenizer.encode(text, add_special_tokens=False).offsets]
+
+class ApproximateTokenizer(SpanTokenizer):
+    """
+    Estimate of an OpenAI tokenizer: the pieces its encodings start from, split every
+    APPROXIMATE_TOKEN_CHARS characters, or every character outside ASCII.
+    """
+
+    def starts(self, text):
+        starts = []
+        for match in APPROXIMATE_PIECES.finditer(text):
+            step = APPROXIMATE_TOKEN_CHARS if match.group().isascii() else 1
+            starts.extend(range(match.start(), match.end(), step))
+        return starts
+
+def load_tiktoken(model):
+    """
+    Returns the tiktoken tokenizer of an OpenAI model, loaded from or downloaded into
+    config.tiktoken_cache_dir (or the TIKTOKEN_CACHE_DIR environment variable).
+    """
+    os.environ.setdefault("TIKTOKEN_CACHE_DIR", os.path.normpath(os.path.join(ROOT, cfg.tiktoken_cache_dir)))
+    try:
+        return TiktokenTokenizer(model)
+    except Exception as e:
+        if not cfg.approximate_token_counts:
+            raise RuntimeError(
+                f"The tiktoken encoding of {model} is not in {os.environ['TIKTOKEN_CACHE_DIR']} and could not be "
+                f"downloaded ({e}). Run python token_counting.py download once with network access."
+            ) from e
+        logging.warning(f"The tiktoken encoding of {model} is not available, estimating its token counts")
+        return ApproximateTokenizer()
+
+_tokenizers = {}
+_tokenizers_lock = threading.Lock()
+
+def _get(key, load):
+    with _tokenizers_lock:
+        if key not in _tokenizers:
+            _tokenizers[key] = load()
+        return _tokenizers[key]
+
+def embedding_tokenizer():
+    """
+    Tokenizer of the embedding model of config.embedding_backend, loaded on first use.
+    """
+    if cfg.embedding_backend == "local":
+        return _get(("local", cfg.local_embedding_model), lambda: HuggingFaceTokenizer(cfg.local_embedding_model))
+    return _get(("openai", cfg.embedding_model), lambda: load_tiktoken(cfg.embedding_model))
+
+def chat_tokenizer():
+    return _get(("openai", cfg.chatbot_model), lambda: load_tiktoken(cfg.chatbot_model))
+
+def main():
+    parser = argparse.ArgumentParser(description="Cache the tokenizers of the configured models for offline use")
+    parser.add_argument('command', choices=["download"])
+    parser.parse_args()
+    cfg.approximate_token_counts = False
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    embedding_tokenizer()
+    for model in {cfg.embedding_model, cfg.chatbot_model, cfg.memory_summary_model}:
+        load_tiktoken(model)
+    logging.info(f"Tokenizers cached in {os.environ['TIKTOKEN_CACHE_DIR']}")
+
+if __name__ == "__main__":
+    main()
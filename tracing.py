@@ -0,0 +1,210 @@
+"""
+Lightweight request tracing for the chatbot. Each query gets a Trace that records
+per-stage spans (embed, answer_cache, search, pack, generate), the time to the first
+token and to completion, token counts and cache hits. Finished traces are queued and
+written to SQLite by a background thread, so requests never wait on the disk.
+
+Print latency percentiles per stage with:
+    python tracing.py report --since-hours 24
+"""
+import argparse
+import atexit
+import json
+import logging
+import queue
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+import numpy as np
+
+import config as cfg
+
+# Stages in the order of a request; first_token and complete are measured from its start
+STAGES = ["embed", "answer_cache", "search", "rerank", "pack", "generate", "first_token", "complete"]
+
+class Trace:
+    """
+    Spans and attributes of one request. Span starts are relative to the start of the
+    request; all times are in seconds.
+    """
+
+    def __init__(self, name, **attributes):
+        self.id = uuid.uuid4().hex
+        self.name = name
+        self.started = time.time()
+        self.attributes = attributes
+        self.spans = []
+        self._start = time.perf_counter()
+        self._finished = False
+
+    def record(self, name, start):
+        """
+        Records a span from start (a time.perf_counter() value) until now.
+        """
+        self.spans.append((name, start - self._start, time.perf_counter() - start))
+
+    @contextmanager
+    def span(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, start)
+
+    def mark(self, name):
+        """
+        Records the time elapsed since the start of the request, e.g. until the first token.
+        """
+        self.record(name, self._start)
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def finish(self):
+        if self._finished:
+            return
+        self._finished = True
+        self.mark("complete")
+        if cfg.tracing_enabled:
+            get_trace_writer().submit(self)
+
+class TraceWriter:
+    """
+    Writes finished traces to SQLite from a background thread, in batches. Only the
+    most recent max_requests requests are kept. If the queue is full, traces are
+    dropped rather than slowing down requests.
+    """
+
+    def __init__(self, path=None, max_requests=None, max_queued=10000):
+        self.path = path or cfg.trace_path
+        self.max_requests = max_requests or cfg.trace_max_requests
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize=max_queued)
+        self._thread = threading.Thread(target=self._run, name="trace-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, trace):
+        try:
+            self._queue.put_nowait(trace)
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self, timeout=5):
+        self._queue.put(None)
+        self._thread.join(timeout)
+
+    def _run(self):
+        conn = connect(self.path)
+        writes = 0
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < 500:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            traces = [trace for trace in batch if trace is not None]
+            try:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO requests (id, name, started, attributes) VALUES (?, ?, ?, ?)",
+                    [(t.id, t.name, t.started, json.dumps(t.attributes, default=str)) for t in traces],
+                )
+                conn.executemany(
+                    "INSERT INTO spans (request_id, name, start, duration) VALUES (?, ?, ?, ?)",
+                    [(t.id, name, start, duration) for t in traces for name, start, duration in t.spans],
+                )
+                writes += len(traces)
+                if writes >= 1000:
+                    prune(conn, self.max_requests)
+                    writes = 0
+                conn.commit()
+            except sqlite3.Error as e:
+                logging.warning(f"Failed to write {len(traces)} traces: {e}")
+            if len(traces) < len(batch):
+                conn.close()
+                return
+
+def connect(path):
+    conn = sqlite3.connect(path, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS requests (id TEXT PRIMARY KEY, name TEXT NOT NULL, started REAL NOT NULL, attributes TEXT NOT NULL)"
+    )
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS spans (request_id TEXT NOT NULL, name TEXT NOT NULL, start REAL NOT NULL, duration REAL NOT NULL)"
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS requests_started ON requests (started)")
+    conn.execute("CREATE INDEX IF NOT EXISTS spans_request ON spans (request_id)")
+    conn.commit()
+    return conn
+
+def prune(conn, max_requests):
+    cutoff = conn.execute("SELECT started FROM requests ORDER BY started DESC LIMIT 1 OFFSET ?", (max_requests,)).fetchone()
+    if cutoff:
+        conn.execute("DELETE FROM spans WHERE request_id IN (SELECT id FROM requests WHERE started <= ?)", cutoff)
+        conn.execute("DELETE FROM requests WHERE started <= ?", cutoff)
+
+_writer = None
+_writer_lock = threading.Lock()
+
+def get_trace_writer():
+    """
+    Returns the process-wide trace writer, started on first use and flushed at exit.
+    """
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = TraceWriter()
+            atexit.register(_writer.close)
+        return _writer
+
+def report(path=None, since_hours=None, name=None):
+    """
+    Prints the count and p50/p95/p99 latency of every stage, and the cache hit rates and
+    average token counts of the traced requests.
+    """
+    conn = connect(path or cfg.trace_path)
+    since = time.time() - since_hours * 3600 if since_hours else 0
+    filters = "r.started >= ?" + (" AND r.name = ?" if name else "")
+    params = (since, name) if name else (since,)
+
+    durations = {}
+    for stage, duration in conn.execute(f"SELECT s.name, s.duration FROM spans s JOIN requests r ON r.id = s.request_id WHERE {filters}", params):
+        durations.setdefault(stage, []).append(duration)
+    attributes = [json.loads(row[0]) for row in conn.execute(f"SELECT r.attributes FROM requests r WHERE {filters}", params)]
+    conn.close()
+
+    if not attributes:
+        print("No traced requests.")
+        return
+    print(f"{len(attributes)} requests")
+    print(f"{'stage':<14} {'count':>7} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for stage in STAGES + sorted(set(durations) - set(STAGES)):
+        if stage in durations:
+            p50, p95, p99 = np.percentile(np.array(durations[stage]) * 1000, [50, 95, 99])
+            print(f"{stage:<14} {len(durations[stage]):>7} {p50:>9.1f} {p95:>9.1f} {p99:>9.1f}")
+
+    for key in sorted({key for attrs in attributes for key in attrs}):
+        values = [attrs[key] for attrs in attributes if key in attrs]
+        if all(isinstance(value, bool) for value in values):
+            print(f"{key}: {sum(values) / len(values):.1%} of {len(values)} requests")
+        elif all(isinstance(value, (int, float)) for value in values):
+            print(f"{key}: mean {np.mean(values):.1f}, p95 {np.percentile(values, 95):.1f}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Chatbot request traces")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    report_parser = subparsers.add_parser("report", help="Print latency percentiles per stage")
+    report_parser.add_argument('--path', default=None, help="Trace database (defaults to config.trace_path)")
+    report_parser.add_argument('--since-hours', type=float, default=None, help="Only include recent requests")
+    report_parser.add_argument('--name', default=None, help="Only include requests of this kind, e.g. query or query_stream")
+    args = parser.parse_args()
+
+    if args.command == "report":
+        report(args.path, args.since_hours, args.name)
+
+if __name__ == "__main__":
+    main()